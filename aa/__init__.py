@@ -1,6 +1,6 @@
 """Python client to the EPICS Archiver Appliance."""
 
-from . import ca, data, fetcher, js, pb, rest, storage, utils
+from . import aio, align, ca, data, fetcher, js, pb, rest, storage, utils, wire
 from ._version_git import __version__
 
 # Below moved to utils but maintain API compat
@@ -8,6 +8,8 @@ from .utils import LOCALTZ, LOG_FORMAT, LOG_LEVEL, MONITOR, SCAN, UTC, set_up_lo
 
 __all__ = [
     "__version__",
+    "aio",
+    "align",
     "ca",
     "data",
     "fetcher",
@@ -16,6 +18,7 @@ __all__ = [
     "rest",
     "storage",
     "utils",
+    "wire",
     "SCAN",
     "MONITOR",
     "LOCALTZ",
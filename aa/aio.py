@@ -0,0 +1,386 @@
+"""Fetch data from the Archiver Appliance using asyncio.
+
+The classes in this module are counterparts of those in aa.fetcher, aa.pb,
+aa.js and aa.rest whose methods are coroutines. Requests are made using
+aiohttp, which must be installed separately (pip install aapy[aio]), and
+the received data is decoded in an executor so that the event loop is not
+blocked. Many retrievals can then be in flight at once in one process.
+"""
+import asyncio
+import json
+import logging as log
+
+from . import data, fetcher, js, pb, rest
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+__all__ = [
+    "AsyncAaFetcher",
+    "AsyncPbFetcher",
+    "AsyncJsonFetcher",
+    "AsyncAaRestClient",
+]
+
+
+class _AsyncHttpClient(object):
+    """Make requests using an aiohttp ClientSession."""
+
+    def __init__(self, session=None, timeout=None, pool_size=None):
+        """
+
+        Args:
+            session: aiohttp ClientSession to use, which may be shared
+                with other fetchers. If None, one is created when first
+                needed.
+            timeout: total timeout in seconds for each request. If None,
+                wait forever.
+            pool_size: maximum number of connections for the session that
+                is created. If None, use the aiohttp default.
+        """
+        if session is None and aiohttp is None:
+            raise ImportError("aiohttp is required unless a session is provided")
+        self._session = session
+        self._owns_session = session is None
+        self._timeout = timeout
+        self._pool_size = pool_size
+
+    def _get_session(self):
+        if self._session is None:
+            # The session must be created within the event loop.
+            connector = aiohttp.TCPConnector(limit=self._pool_size or 100)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    def _request_kwargs(self):
+        if self._timeout is None or aiohttp is None:
+            return {}
+        return {"timeout": aiohttp.ClientTimeout(total=self._timeout)}
+
+    async def _request(self, method, url, allow_not_found=False, **kwargs):
+        """Make a request and return the body of the response.
+
+        Args:
+            method: "get" or "post"
+            url: URL to request
+            allow_not_found: if True, return None rather than raising if
+                the response status is 404
+            kwargs: passed to the session method
+
+        Returns:
+            bytes of the response body
+        """
+        kwargs.update(self._request_kwargs())
+        request = getattr(self._get_session(), method)
+        async with request(url, **kwargs) as response:
+            if allow_not_found and response.status == 404:
+                return None
+            response.raise_for_status()
+            return await response.read()
+
+    async def close(self):
+        """Close the session if it was created by this object."""
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+class AsyncAaFetcher(_AsyncHttpClient):
+    """Abstract base class for fetching data from the Archiver Appliance
+    using asyncio."""
+
+    # URLs are built in the same way as for the blocking fetchers.
+    _format_datetime = staticmethod(fetcher.AaFetcher._format_datetime)
+    _construct_url = fetcher.AaFetcher._construct_url
+    _construct_snapshot_url = fetcher.AaFetcher._construct_snapshot_url
+    _localize_range = staticmethod(fetcher.Fetcher._localize_range)
+    # Whether to return empty data rather than raising if the AA responds
+    # with 404.
+    _empty_if_not_found = False
+
+    def __init__(
+        self, hostname, port, session=None, timeout=None, pool_size=None, executor=None
+    ):
+        """
+
+        Args:
+            hostname: hostname of Archiver Appliance
+            port: port to connect to
+            session: aiohttp ClientSession to use. If None, create one.
+            timeout: total timeout in seconds for each request
+            pool_size: maximum number of connections for the session that
+                is created
+            executor: concurrent.futures.Executor in which to decode the
+                data. If None, use the default executor of the event loop.
+        """
+        super(AsyncAaFetcher, self).__init__(session, timeout, pool_size)
+        self._host = hostname
+        self._port = port
+        self._endpoint = "http://{}:{}".format(self._host, self._port)
+        self._url = None
+        self._executor = executor
+        # Set to False if the AA does not support getDataAtTime.
+        self._snapshot_supported = True
+
+    def _parse_body(self, body, pv, start, end, count):
+        """Convert the body of a response from the Archiver Appliance.
+
+        This must be implemented by any subclasses. It is called in an
+        executor.
+
+        Args:
+            body: bytes of the response
+            pv: PV name requested
+            start: datetime of start of request
+            end: datetime of end of request
+            count: maximum number of events
+
+        Returns:
+            ArchiveData object containing all events
+
+        """
+        raise NotImplementedError()
+
+    async def _get_values(self, pv, start, end, count, request_params):
+        url = self._construct_url(pv, start, end, request_params)
+        body = await self._request("get", url, self._empty_if_not_found)
+        if body is None:
+            return data.ArchiveData.empty(pv)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, self._parse_body, body, pv, start, end, count
+        )
+
+    async def get_values(self, pv, start, end=None, count=None, request_params=None):
+        """Retrieve archive data.
+
+        The arguments and result are as for fetcher.Fetcher.get_values().
+        """
+        start, end = self._localize_range(start, end)
+        return await self._get_values(pv, start, end, count, request_params)
+
+    async def get_event_at(self, pv, instant, request_params=None):
+        """Retrieve the event preceding the specified datetime.
+
+        The arguments and result are as for fetcher.Fetcher.get_event_at().
+        """
+        archive_data = await self.get_values(pv, instant, instant, 1, request_params)
+        try:
+            return archive_data.get_event(0)
+        except IndexError:
+            error_msg = "No data found for pv {} at timestamp {}"
+            raise ValueError(error_msg.format(pv, instant))
+
+    async def get_values_many(
+        self,
+        pvs,
+        start,
+        end=None,
+        count=None,
+        request_params=None,
+        max_concurrency=fetcher.DEFAULT_MAX_WORKERS,
+    ):
+        """Retrieve archive data for several PVs at the same time.
+
+        The arguments and result are as for
+        fetcher.Fetcher.get_values_many(), except that max_concurrency
+        limits the number of requests in flight.
+        """
+        start, end = self._localize_range(start, end)
+        pvs = list(dict.fromkeys(pvs))
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def get_pv(pv):
+            params = None if request_params is None else dict(request_params)
+            async with semaphore:
+                return await self._get_values(pv, start, end, count, params)
+
+        outcomes = await asyncio.gather(
+            *(get_pv(pv) for pv in pvs), return_exceptions=True
+        )
+        results = fetcher.MultiPvData()
+        for pv, outcome in zip(pvs, outcomes):
+            if isinstance(outcome, BaseException) and not isinstance(
+                outcome, Exception
+            ):
+                # Such as CancelledError, which is not a failure of the PV.
+                raise outcome
+            if isinstance(outcome, Exception):
+                log.warning("Failed to retrieve {}: {}".format(pv, outcome))
+                results.errors[pv] = outcome
+            else:
+                results[pv] = outcome
+        return results
+
+    async def get_events_at(
+        self,
+        pvs,
+        instant,
+        request_params=None,
+        max_concurrency=fetcher.DEFAULT_MAX_WORKERS,
+    ):
+        """Retrieve the event preceding the specified datetime for many PVs.
+
+        The arguments and result are as for
+        fetcher.AaFetcher.get_events_at(), except that max_concurrency
+        limits the number of requests in flight.
+        """
+        instant, _ = self._localize_range(instant, instant)
+        pvs = list(dict.fromkeys(pvs))
+        if self._snapshot_supported:
+            url = self._construct_snapshot_url(instant, request_params)
+            headers = {"Content-Type": "application/json"}
+            semaphore = asyncio.Semaphore(max_concurrency)
+
+            async def post(batch):
+                async with semaphore:
+                    return await self._request(
+                        "post", url, True, data=json.dumps(batch), headers=headers
+                    )
+
+            size = fetcher.SNAPSHOT_BATCH_SIZE
+            bodies = await asyncio.gather(
+                *(post(pvs[i : i + size]) for i in range(0, len(pvs), size))
+            )
+            if None not in bodies:
+                pv_events = {}
+                for body in bodies:
+                    pv_events.update(json.loads(body))
+                return fetcher._snapshot_from_json(instant, pvs, pv_events)
+            log.info("getDataAtTime not available; retrieving PVs separately")
+            self._snapshot_supported = False
+        results = await self.get_values_many(
+            pvs, instant, instant, 1, request_params, max_concurrency
+        )
+        return fetcher._snapshot_from_data(instant, pvs, results)
+
+
+class AsyncPbFetcher(AsyncAaFetcher):
+    """Class to fetch data from the Archiver Appliance in PB format using
+    asyncio."""
+
+    # Not found typically means no data for the PV in this time range.
+    _empty_if_not_found = True
+
+    def __init__(
+        self,
+        hostname,
+        port,
+        wire_decoding=False,
+        session=None,
+        timeout=None,
+        pool_size=None,
+        executor=None,
+        nanoseconds=False,
+    ):
+        """
+
+        Args:
+            hostname: hostname of Archiver Appliance
+            port: port to connect to
+            wire_decoding: if True, decode scalar types using aa.wire
+                rather than the protobuf library
+            session: aiohttp ClientSession to use. If None, create one.
+            timeout: total timeout in seconds for each request
+            pool_size: maximum number of connections for the session that
+                is created
+            executor: concurrent.futures.Executor in which to decode the
+                data. If None, use the default executor of the event loop.
+            nanoseconds: if True, return ArchiveData with exact int64
+                nanosecond timestamps
+        """
+        super(AsyncPbFetcher, self).__init__(
+            hostname, port, session, timeout, pool_size, executor
+        )
+        self._url = "{}/retrieval/data/getData.raw".format(self._endpoint)
+        self._wire_decoding = wire_decoding
+        self._nanoseconds = nanoseconds
+
+    def _parse_body(self, body, pv, start, end, count):
+        return pb.parse_pb_data(
+            body, pv, start, end, count, self._wire_decoding, self._nanoseconds
+        )
+
+
+class AsyncJsonFetcher(AsyncAaFetcher):
+    """Class to fetch data from the Archiver Appliance using JSON and
+    asyncio."""
+
+    def __init__(
+        self,
+        hostname,
+        port,
+        session=None,
+        timeout=None,
+        pool_size=None,
+        executor=None,
+        nanoseconds=False,
+    ):
+        """
+
+        Args:
+            hostname: hostname of Archiver Appliance
+            port: port to connect to
+            session: aiohttp ClientSession to use. If None, create one.
+            timeout: total timeout in seconds for each request
+            pool_size: maximum number of connections for the session that
+                is created
+            executor: concurrent.futures.Executor in which to decode the
+                data. If None, use the default executor of the event loop.
+            nanoseconds: if True, return ArchiveData with exact int64
+                nanosecond timestamps
+        """
+        super(AsyncJsonFetcher, self).__init__(
+            hostname, port, session, timeout, pool_size, executor
+        )
+        self._url = "{}/retrieval/data/getData.json".format(self._endpoint)
+        self._nanoseconds = nanoseconds
+
+    def _parse_body(self, body, pv, start, end, count):
+        return js.parse_json_data(json.loads(body), pv, self._nanoseconds)
+
+
+class AsyncAaRestClient(_AsyncHttpClient, rest.AaRestClient):
+    """Class used for making calls to the AA Rest API using asyncio.
+
+    The methods are those of rest.AaRestClient, but return awaitables.
+    """
+
+    def __init__(self, hostname, port=80, session=None, timeout=None, pool_size=None):
+        """
+
+        Args:
+            hostname: hostname of Archiver Appliance
+            port: port to connect to
+            session: aiohttp ClientSession to use. If None, create one.
+            timeout: total timeout in seconds for each request
+            pool_size: maximum number of connections for the session that
+                is created
+        """
+        _AsyncHttpClient.__init__(self, session, timeout, pool_size)
+        self._hostname = "{}:{}".format(hostname, port)
+
+    async def _rest_get(self, command, **kwargs):
+        url = self._construct_url(command, **kwargs)
+        return json.loads(await self._request("get", url))
+
+    async def _rest_post(self, command, payload, headers, **kwargs):
+        url = self._construct_url(command, **kwargs)
+        body = await self._request("post", url, data=payload, headers=headers)
+        return json.loads(body)
+
+    async def get_never_connected_pvs(self):
+        pv_info = await self._rest_get("getNeverConnectedPVs")
+        return [info["pvName"] for info in pv_info]
+
+    async def get_currently_disconnected_pvs(self):
+        pv_info = await self._rest_get("getCurrentlyDisconnectedPVs")
+        return set([info["pvName"] for info in pv_info])
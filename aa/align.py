@@ -0,0 +1,318 @@
+"""Align the data of several PVs onto a common time base.
+
+Each PV is sampled at the times of its own events, so comparing PVs first
+needs their values at the same times. align() takes many ArchiveData
+objects and looks up the value of each PV at every target time with one
+numpy.searchsorted() call per PV, giving a table of columns that share
+one array of timestamps.
+
+The target times may be the union of the timestamps of all the PVs or a
+regular grid from grid_timestamps(). Values are joined onto them in one
+of these ways:
+
+- ASOF: the last event at or before each time, as the value of a PV holds
+  until it next changes
+- NEAREST: the event closest in time
+- LINEAR: linear interpolation between the events either side
+"""
+from __future__ import annotations
+
+import datetime as datetime_module
+from collections.abc import Mapping
+from typing import Dict, Iterable, List, Optional
+
+import numpy
+
+from . import data, utils
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+__all__ = [
+    "ASOF",
+    "NEAREST",
+    "LINEAR",
+    "METHODS",
+    "AlignedData",
+    "union_timestamps",
+    "grid_timestamps",
+    "align",
+]
+
+
+ASOF = "asof"
+NEAREST = "nearest"
+LINEAR = "linear"
+METHODS = (ASOF, NEAREST, LINEAR)
+
+
+class AlignedData(object):
+    """The values of several PVs at the same timestamps.
+
+    Each PV has a column of values with one row for each timestamp, as in
+    ArchiveData.values. Where a PV has no value for a timestamp, such as
+    before its first event, valid is False and the value is NaN, or zero
+    if the values are not floats.
+    """
+
+    DESC = "Aligned data for {} PVs: {} timestamps"
+
+    def __init__(
+        self,
+        timestamps: numpy.ndarray,
+        values: Dict[str, numpy.ndarray],
+        severities: Dict[str, numpy.ndarray],
+        valid: Dict[str, numpy.ndarray],
+    ):
+        """
+
+        Args:
+            timestamps: array of float seconds since the epoch
+            values: dict of the array of values of each PV, one row per
+                timestamp
+            severities: dict of the array of EPICS alarm severities of each
+                PV
+            valid: dict of boolean arrays of whether each PV has a value at
+                each timestamp
+        """
+        for pv in values:
+            assert len(values[pv]) == len(severities[pv]) == len(valid[pv])
+            assert len(values[pv]) == len(timestamps)
+        self._timestamps = timestamps
+        self._values = values
+        self._severities = severities
+        self._valid = valid
+
+    @property
+    def timestamps(self) -> numpy.ndarray:
+        return self._timestamps
+
+    @property
+    def pvs(self) -> List[str]:
+        return list(self._values)
+
+    @property
+    def values(self) -> Dict[str, numpy.ndarray]:
+        return self._values
+
+    @property
+    def severities(self) -> Dict[str, numpy.ndarray]:
+        return self._severities
+
+    @property
+    def valid(self) -> Dict[str, numpy.ndarray]:
+        return self._valid
+
+    @property
+    def datetime64s(self) -> numpy.ndarray:
+        """Returns a numpy datetime64[ns] array of the UTC timestamps."""
+        return utils.epoch_to_datetime64(self._timestamps)
+
+    def to_array(self) -> numpy.ndarray:
+        """Returns the first element of each PV's values as columns.
+
+        Returns:
+            float array with one row per timestamp and one column per PV,
+            in the order of pvs, with NaN where a PV has no value
+        """
+        # Each column is filled in turn, so store them contiguously.
+        array = numpy.empty((len(self), len(self._values)), order="F")
+        for i, (pv, values) in enumerate(self._values.items()):
+            array[:, i] = values[:, 0]
+            if values.dtype.kind != "f":
+                array[~self._valid[pv], i] = numpy.nan
+        return array
+
+    def to_dataframe(self):
+        """Returns a pandas DataFrame of the values indexed by time.
+
+        This requires pandas to be installed. A PV whose values have more
+        than one element has a column for each element, named pv[i].
+
+        Returns:
+            pandas.DataFrame with a UTC DatetimeIndex
+        """
+        if pandas is None:
+            raise ImportError("pandas is required for to_dataframe()")
+        columns = {}
+        for pv, values in self._values.items():
+            if values.shape[1] == 1:
+                columns[pv] = values[:, 0]
+            else:
+                for i in range(values.shape[1]):
+                    columns["{}[{}]".format(pv, i)] = values[:, i]
+        index = pandas.DatetimeIndex(self.datetime64s).tz_localize("UTC")
+        return pandas.DataFrame(columns, index=index)
+
+    def __getitem__(self, pv):
+        return self._values[pv]
+
+    def __contains__(self, pv):
+        return pv in self._values
+
+    def __len__(self):
+        return len(self._timestamps)
+
+    def __str__(self):
+        return AlignedData.DESC.format(len(self._values), len(self))
+
+    __repr__ = __str__
+
+
+def _data_list(archive_data) -> List[data.ArchiveData]:
+    if isinstance(archive_data, Mapping):
+        return list(archive_data.values())
+    return list(archive_data)
+
+
+def union_timestamps(archive_data: Iterable[data.ArchiveData]) -> numpy.ndarray:
+    """Returns the sorted timestamps of all events, without duplicates.
+
+    Args:
+        archive_data: ArchiveData objects, or a dict of them such as
+            fetcher.MultiPvData
+
+    Returns:
+        array of float seconds since the epoch
+    """
+    data_list = _data_list(archive_data)
+    if not data_list:
+        return numpy.zeros((0,))
+    return numpy.unique(numpy.concatenate([d.timestamps for d in data_list]))
+
+
+def grid_timestamps(
+    start: datetime_module.datetime, end: datetime_module.datetime, period: float
+) -> numpy.ndarray:
+    """Returns regularly spaced timestamps from start to end inclusive.
+
+    Args:
+        start: timezone-aware datetime of the first timestamp
+        end: timezone-aware datetime after which there are no timestamps
+        period: seconds between timestamps
+
+    Returns:
+        array of float seconds since the epoch
+    """
+    assert period > 0
+    start_ns = utils.datetime_to_epoch_ns(start)
+    end_ns = utils.datetime_to_epoch_ns(end)
+    n = int((end_ns - start_ns) // (period * 1e9)) + 1 if end_ns >= start_ns else 0
+    return (start_ns + numpy.arange(n) * (period * 1e9)) / 1e9
+
+
+def _missing_value(dtype):
+    return numpy.nan if dtype.kind in "fc" else 0
+
+
+def _preceding(times, timestamps):
+    """Returns the index of the last event at or before each timestamp.
+
+    Both arrays are in time order, so rather than searching for every
+    timestamp among the events, each event is placed among the timestamps
+    and the number of events up to each timestamp is counted.
+    """
+    first_after = numpy.searchsorted(timestamps, times, "left")
+    counts = numpy.bincount(first_after, minlength=len(timestamps) + 1)
+    return numpy.cumsum(counts[:-1]) - 1
+
+
+def _join(archive_data, timestamps, method, tolerance):
+    """Join the values of one PV onto timestamps.
+
+    Returns:
+        tuple of the values, severities and valid arrays
+    """
+    times = archive_data.timestamps
+    # Built each time it is used if the data is ragged.
+    all_values = archive_data.values
+    n = len(times)
+    if not n:
+        values = numpy.full((len(timestamps), all_values.shape[1]), numpy.nan)
+        valid = numpy.zeros(timestamps.shape, dtype=bool)
+        return values, numpy.zeros(timestamps.shape), valid
+    if method == LINEAR and all_values.dtype.kind not in "iufb":
+        raise ValueError("Values of {} cannot be interpolated".format(archive_data.pv))
+    before = _preceding(times, timestamps)
+    valid = before >= 0
+    index = before.clip(0)
+    if method == ASOF:
+        if tolerance is not None:
+            valid &= timestamps - times[index] <= tolerance
+    else:
+        # The first event after each timestamp and how far away they are.
+        after = numpy.minimum(before + 1, n - 1)
+        to_before = numpy.where(valid, timestamps - times[index], numpy.inf)
+        to_after = numpy.where(before + 1 < n, times[after] - timestamps, numpy.inf)
+        limit = numpy.inf if tolerance is None else tolerance
+        if method == NEAREST:
+            index = numpy.where(to_before <= to_after, index, after)
+            valid = numpy.minimum(to_before, to_after) <= limit
+        else:
+            # Exactly at an event, or between two events.
+            exact = to_before == 0
+            valid = exact | (valid & (to_after < numpy.inf))
+            valid &= numpy.minimum(to_before, to_after) <= limit
+
+    values = all_values.take(index, axis=0)
+    severities = archive_data.severities.take(index)
+    if method == LINEAR:
+        values = values.astype(numpy.float64)
+        between = valid & ~exact
+        right = after[between]
+        fraction = to_before[between] / (times[right] - times[index[between]])
+        v0 = values[between]
+        values[between] = v0 + fraction[:, numpy.newaxis] * (all_values[right] - v0)
+    invalid = numpy.flatnonzero(~valid)
+    values[invalid] = _missing_value(values.dtype)
+    severities[invalid] = 0
+    return values, severities, valid
+
+
+def align(
+    archive_data: Iterable[data.ArchiveData],
+    timestamps: Optional[numpy.ndarray] = None,
+    method: str = ASOF,
+    tolerance: Optional[float] = None,
+) -> AlignedData:
+    """Put the values of several PVs onto the same timestamps.
+
+    The timestamps of each ArchiveData object must be in time order, as
+    they are when retrieved.
+
+    Args:
+        archive_data: ArchiveData objects, or a dict of them such as
+            fetcher.MultiPvData
+        timestamps: array of float seconds since the epoch in time order,
+            for example from grid_timestamps(). If None, use the union of
+            the timestamps of all events.
+        method: how to join the values of each PV onto the timestamps, one
+            of METHODS
+        tolerance: if not None, the greatest number of seconds between a
+            timestamp and an event used for its value. Timestamps further
+            from any event have no value.
+
+    Returns:
+        AlignedData object with a column for each PV
+
+    Raises:
+        ValueError: if method is not one of METHODS, or if method is LINEAR
+            and a PV does not have numeric values
+    """
+    if method not in METHODS:
+        raise ValueError("Method {} not one of {}".format(method, METHODS))
+    data_list = _data_list(archive_data)
+    if timestamps is None:
+        timestamps = union_timestamps(data_list)
+    timestamps = numpy.asarray(timestamps, dtype=numpy.float64)
+    values = {}
+    severities = {}
+    valid = {}
+    for pv_data in data_list:
+        pv = pv_data.pv
+        values[pv], severities[pv], valid[pv] = _join(
+            pv_data, timestamps, method, tolerance
+        )
+    return AlignedData(timestamps, values, severities, valid)
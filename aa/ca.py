@@ -1,9 +1,8 @@
 """Simple client to the Channel Archiver using xmlrpc."""
 import logging as log
+import threading
 from xmlrpc.client import ServerProxy
 
-import numpy
-
 from . import data, utils
 from .fetcher import Fetcher
 
@@ -21,7 +20,17 @@ class CaClient(object):
         Args:
             url: url for the channel archiver
         """
-        self._proxy = ServerProxy(url)
+        self._url = url
+        # ServerProxy is not thread-safe, so each thread gets its own.
+        self._local = threading.local()
+        self._local.proxy = ServerProxy(url)
+
+    @property
+    def _proxy(self):
+        proxy = getattr(self._local, "proxy", None)
+        if proxy is None:
+            proxy = self._local.proxy = ServerProxy(self._url)
+        return proxy
 
     @staticmethod
     def _create_archive_event(pv, ca_event):
@@ -73,18 +82,17 @@ class CaFetcher(Fetcher):
         """
         self._client = CaClient(url)
 
-    def _get_values(self, pv, start, end=None, count=None, request_params=None):
+    def _iter_pages(self, pv, start, end, count):
+        """Yield ArchiveData for each page of up to 10000 events."""
         # Make count a large number if not specified to ensure we get all
         # data.
         count = 2 ** 31 if count is None else count
-        empty_array = numpy.zeros((0,))
-        all_data = data.ArchiveData(pv, empty_array, empty_array, empty_array)
+        received = 0
         last_timestamp = -1
         done = False
-        while done is not True and len(all_data) < count:
-            requested = min(count - len(all_data), 10000)
-            if all_data.timestamps.size:
-                last_timestamp = all_data.timestamps[-1]
+        while done is not True and received < count:
+            requested = min(count - received, 10000)
+            if last_timestamp >= 0:
                 start = utils.epoch_to_datetime(last_timestamp)
             log.info("Request PV {} for {} samples.".format(pv, requested))
             log.info("Request start {} end {}".format(start, end))
@@ -92,6 +100,17 @@ class CaFetcher(Fetcher):
             done = len(events) < requested
             # Drop any events that are earlier than ones already fetched.
             events = [e for e in events if e.timestamp > last_timestamp]
-            new_data = data.data_from_events(pv, events)
-            all_data = all_data.concatenate(new_data, zero_pad=True)
-        return all_data
+            page = data.data_from_events(pv, events)
+            if len(page):
+                received += len(page)
+                last_timestamp = page.timestamps[-1]
+            yield page
+
+    def _get_values(self, pv, start, end=None, count=None, request_params=None):
+        pages = [page for page in self._iter_pages(pv, start, end, count) if len(page)]
+        if not pages:
+            return data.ArchiveData.empty(pv)
+        return data.ArchiveData.concat(pages, zero_pad=True)
+
+    def _iter_values(self, pv, start, end, request_params):
+        return self._iter_pages(pv, start, end, None)
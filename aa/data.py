@@ -2,34 +2,50 @@
 from __future__ import annotations
 
 import datetime as datetime_module
+import functools
 import logging
 import re
 from collections import OrderedDict
-from typing import Dict, List, Optional
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
 
 import numpy
 import pytz
 
 from . import utils
 
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
 __all__ = [
     "ArchiveEvent",
     "ArchiveData",
+    "StatisticsData",
+    "Snapshot",
+    "EnumCodes",
     "data_from_events",
+    "data_from_values",
+    "values_array",
+    "ragged_values",
+    "concat_values",
     "parse_enum_options",
+    "enum_codes",
 ]
 
 
 DIFFERENT_PV_ERROR = "All concatenated ArchiveData objects must have the same PV name"
 TIMESTAMP_WARNING = "Timestamps not monotonically increasing: {} -> {}"
 REGEX_ENUM = r"^ENUM_([0-9]+)$"
-DTYPE_ENUM_STR = "U100"
 
 
 class ArchiveEvent(object):
 
     """One Event, retrieved from the AA, representing a change in value of a PV"""
 
+    # Many events may be created, so they have no attribute dict.
+    __slots__ = ("_pv", "_value", "_timestamp", "_severity", "_enum_options")
+
     DESC = (
         "Archive event for PV {}: "
         "timestamp {:%Y-%m-%d %H:%M:%S.%f %Z} value {} severity {}"
@@ -72,7 +88,7 @@ class ArchiveEvent(object):
     @property
     def has_enum_options(self) -> bool:
         """True if this PV has enum string labels available."""
-        return len(self._enum_options) > 0
+        return len(self.enum_options) > 0
 
     @property
     def enum_string(self) -> Optional[numpy.ndarray]:
@@ -93,7 +109,7 @@ class ArchiveEvent(object):
             datetime object
 
         """
-        return utils.epoch_to_datetime(self._timestamp).astimezone(tz)
+        return utils.epoch_to_datetime(self.timestamp).astimezone(tz)
 
     @property
     def utc_datetime(self) -> datetime_module.datetime:
@@ -110,6 +126,11 @@ class ArchiveEvent(object):
         """EPICS alarm sevirity"""
         return self._severity
 
+    def __reduce__(self):
+        # Rows of ArchiveData are pickled as standalone events.
+        state = (self.pv, self.value, self.timestamp, self.severity, self.enum_options)
+        return ArchiveEvent, state
+
     def __str__(self):
         display_val = (
             f"{self.enum_string} ({repr(self.value)})"
@@ -133,6 +154,40 @@ class ArchiveEvent(object):
         return equal
 
 
+class _ArchiveDataRow(ArchiveEvent):
+    """An ArchiveEvent that reads one row of an ArchiveData object.
+
+    Nothing is copied until a field is accessed, so iterating over an
+    ArchiveData object is cheap. A row keeps its ArchiveData alive.
+    """
+
+    __slots__ = ("_data", "_index")
+
+    def __init__(self, archive_data: ArchiveData, index: int):
+        self._data = archive_data
+        self._index = index
+
+    @property
+    def pv(self) -> str:
+        return self._data._pv
+
+    @property
+    def value(self) -> numpy.ndarray:
+        return self._data._value_at(self._index)
+
+    @property
+    def timestamp(self) -> float:
+        return self._data.timestamps[self._index]
+
+    @property
+    def severity(self) -> float:
+        return self._data._severities[self._index]
+
+    @property
+    def enum_options(self) -> OrderedDict[int, str]:
+        return self._data._enum_options
+
+
 class ArchiveData(object):
 
     """A collection of ArchiveEvents retireved from the AA.
@@ -143,6 +198,17 @@ class ArchiveData(object):
     - By `get_event(index)`
     - By iterating: `for event in data:`
     - By directly accessing the arrays of values and timestamps
+
+    Timestamps are float seconds since the epoch, which cannot represent
+    every nanosecond. If the object is created with timestamps_ns, the
+    exact int64 nanoseconds since the epoch are kept and the float
+    timestamps are only computed when they are first used.
+
+    Waveforms whose length changes from event to event may be stored
+    ragged: the values of all events are kept end to end in one flat
+    array, with an array of offsets giving where each event starts. No
+    zeros are stored, and slicing and concatenation never add any. The
+    zero-padded values array is then built each time values is used.
     """
 
     DESC = (
@@ -158,14 +224,42 @@ class ArchiveData(object):
         timestamps: numpy.ndarray,
         severities: numpy.ndarray,
         enum_options: OrderedDict[int, str] = OrderedDict(),
+        timestamps_ns: Optional[numpy.ndarray] = None,
+        offsets: Optional[numpy.ndarray] = None,
     ):
-        assert len(values) == len(timestamps) == len(severities)
-        if values.ndim == 1:
+        """
+
+        Args:
+            pv: name of PV
+            values: array of values, one row per event. If offsets is
+                given, a 1d array of the values of all events end to end.
+            timestamps: array of float seconds since the epoch. May be
+                None if timestamps_ns is given.
+            severities: array of EPICS alarm severities
+            enum_options: enum options of the PV, if any
+            timestamps_ns: array of int64 nanoseconds since the epoch, or
+                None
+            offsets: for ragged storage, int64 array of the n + 1
+                positions in values at which each of n events starts, the
+                last being where the final event ends. If None, values is
+                stored as a 2d array.
+        """
+        if timestamps_ns is not None:
+            timestamps_ns = numpy.asarray(timestamps_ns, dtype=numpy.int64)
+        exact = timestamps if timestamps_ns is None else timestamps_ns
+        if offsets is not None:
+            offsets = numpy.asarray(offsets, dtype=numpy.int64)
+            assert values.ndim == 1 and len(offsets) == len(exact) + 1
+        elif values.ndim == 1:
             values = values.reshape((-1, 1))
-        self._check_timestamps(timestamps)
+        assert len(exact) == len(severities)
+        assert offsets is not None or len(values) == len(exact)
+        self._check_timestamps(exact)
         self._pv: str = pv
         self._values: numpy.ndarray = values
-        self._timestamps: numpy.ndarray = timestamps
+        self._offsets: Optional[numpy.ndarray] = offsets
+        self._timestamps: Optional[numpy.ndarray] = timestamps
+        self._timestamps_ns: Optional[numpy.ndarray] = timestamps_ns
         self._severities: numpy.ndarray = severities
         self._enum_options: OrderedDict = enum_options
 
@@ -173,11 +267,13 @@ class ArchiveData(object):
     def _check_timestamps(ts_array: numpy.ndarray) -> None:
         back_steps = numpy.diff(ts_array) < 0
         if numpy.any(back_steps):
+            # Integer timestamps are in nanoseconds.
+            scale = 1e-9 if ts_array.dtype.kind in "iu" else 1
             for nonzero_index in numpy.nditer(numpy.nonzero(back_steps)):
                 logging.warning(
                     TIMESTAMP_WARNING.format(
-                        utils.epoch_to_datetime(ts_array[nonzero_index]),
-                        utils.epoch_to_datetime(ts_array[nonzero_index + 1]),
+                        utils.epoch_to_datetime(ts_array[nonzero_index] * scale),
+                        utils.epoch_to_datetime(ts_array[nonzero_index + 1] * scale),
                     )
                 )
 
@@ -193,12 +289,112 @@ class ArchiveData(object):
 
     @property
     def values(self) -> numpy.ndarray:
+        """Array of values, one row per event.
+
+        If the object is ragged, a new zero-padded array is built each time.
+        """
+        if self._offsets is not None:
+            return ragged_values(self._values, self._offsets)
         return self._values
 
+    @property
+    def is_ragged(self) -> bool:
+        """True if the values are stored as a flat array and offsets."""
+        return self._offsets is not None
+
+    @property
+    def offsets(self) -> numpy.ndarray:
+        """int64 array of where each event starts in flat_values.
+
+        The last element is the length of flat_values.
+        """
+        if self._offsets is not None:
+            return self._offsets - self._offsets[0]
+        n, width = self._values.shape
+        return numpy.arange(n + 1, dtype=numpy.int64) * width
+
+    @property
+    def flat_values(self) -> numpy.ndarray:
+        """1d array of the values of all events, one after another.
+
+        For an object that is not ragged, this includes any zero padding.
+        """
+        if self._offsets is not None:
+            return self._values[self._offsets[0] : self._offsets[-1]]
+        return self._values.reshape(-1)
+
+    @property
+    def lengths(self) -> numpy.ndarray:
+        """int64 array of the number of elements in the value of each event."""
+        return numpy.diff(self.offsets)
+
+    def _value_at(self, index: int) -> numpy.ndarray:
+        if self._offsets is None:
+            return self._values[index]
+        return self._values[self._offsets[index] : self._offsets[index + 1]]
+
+    def to_ragged(self, lengths: Optional[Sequence[int]] = None) -> ArchiveData:
+        """Returns an ArchiveData object with ragged storage.
+
+        Args:
+            lengths: the number of elements of each event to keep, such as
+                the NORD of a waveform. If None, keep all of every row.
+
+        Returns:
+            ragged ArchiveData object sharing the timestamps of this one
+        """
+        if lengths is None:
+            if self._offsets is not None:
+                return self
+            flat_values, offsets = self.flat_values, self.offsets
+        else:
+            lengths = numpy.asarray(lengths, dtype=numpy.int64)
+            assert len(lengths) == len(self)
+            values = self.values
+            assert numpy.all(lengths <= values.shape[1])
+            flat_values = values[numpy.arange(values.shape[1]) < lengths[:, None]]
+            offsets = numpy.concatenate([[0], numpy.cumsum(lengths)])
+        return self._replace_values(flat_values, offsets)
+
+    def to_dense(self) -> ArchiveData:
+        """Returns an ArchiveData object with zero-padded 2d values."""
+        if self._offsets is None:
+            return self
+        return self._replace_values(self.values, None)
+
+    def _replace_values(self, values, offsets) -> ArchiveData:
+        return ArchiveData(
+            self.pv,
+            values,
+            self._timestamps,
+            self.severities,
+            self.enum_options,
+            self._timestamps_ns,
+            offsets,
+        )
+
     @property
     def timestamps(self) -> numpy.ndarray:
+        if self._timestamps is None:
+            self._timestamps = self._timestamps_ns / 1e9
         return self._timestamps
 
+    @property
+    def has_exact_timestamps(self) -> bool:
+        """True if the object holds int64 nanosecond timestamps."""
+        return self._timestamps_ns is not None
+
+    @property
+    def timestamps_ns(self) -> numpy.ndarray:
+        """int64 nanoseconds since the epoch.
+
+        If the object does not hold exact timestamps, they are rounded
+        from the float timestamps.
+        """
+        if self._timestamps_ns is not None:
+            return self._timestamps_ns
+        return numpy.round(self._timestamps * 1e9).astype(numpy.int64)
+
     @property
     def enum_options(self) -> OrderedDict[int, str]:
         return self._enum_options
@@ -215,9 +411,24 @@ class ArchiveData(object):
             else None
         )
 
+    @property
+    def enum_codes(self) -> Optional[EnumCodes]:
+        """The values as indices into the array of enum labels, if any.
+
+        This avoids making a string for every event.
+        """
+        return (
+            enum_codes(self.values, self.enum_options)
+            if self.has_enum_options
+            else None
+        )
+
     def datetimes(self, tz: datetime_module.tzinfo) -> numpy.ndarray:
         """Returns a numpy array of timezone-aware datetimes for the events.
 
+        The conversion is done in bulk, by pandas if it is installed. For
+        large arrays, datetime64s or datetime_index() are much faster.
+
         Args:
             tz: the timezone for the datetime objects
 
@@ -225,9 +436,36 @@ class ArchiveData(object):
             numpy array of datetime objects
 
         """
-        return numpy.array(
-            [utils.epoch_to_datetime(ts).astimezone(tz) for ts in self._timestamps]
-        )
+        if pandas is not None:
+            # Rounded to microseconds, as by ArchiveEvent.datetime().
+            utc_times = utils.epoch_to_datetime64(self.timestamps, "us")
+            index = pandas.DatetimeIndex(utc_times).tz_localize(pytz.utc)
+            return index.tz_convert(tz).to_pydatetime()
+        return utils.epoch_to_datetimes(self.timestamps, tz)
+
+    @property
+    def datetime64s(self) -> numpy.ndarray:
+        """Returns a numpy datetime64[ns] array of the UTC times of the events."""
+        if self._timestamps_ns is not None:
+            return self._timestamps_ns.view("datetime64[ns]")
+        return utils.epoch_to_datetime64(self._timestamps)
+
+    def datetime_index(self, tz: datetime_module.tzinfo = pytz.utc):
+        """Returns a pandas DatetimeIndex of the times of the events.
+
+        This requires pandas to be installed.
+
+        Args:
+            tz: the timezone of the index
+
+        Returns:
+            timezone-aware pandas.DatetimeIndex
+
+        """
+        if pandas is None:
+            raise ImportError("pandas is required for datetime_index()")
+        index = pandas.DatetimeIndex(self.datetime64s).tz_localize(pytz.utc)
+        return index.tz_convert(tz)
 
     @property
     def utc_datetimes(self) -> numpy.ndarray:
@@ -245,19 +483,93 @@ class ArchiveData(object):
 
     def get_event(self, index: int) -> ArchiveEvent:
         """Returns an ArchiveEvent for the event at the given index"""
-        return ArchiveEvent(
-            self.pv,
-            self.values[index],
-            self.timestamps[index],
-            self.severities[index],
-            self.enum_options,
+        return self[index]
+
+    def _search(self, instant: datetime_module.datetime, side: str) -> int:
+        """Returns where instant would be inserted into the timestamps.
+
+        Float timestamps are not exact, so they are compared with instant
+        to the microsecond, as when converted by ArchiveEvent.datetime().
+        """
+        if instant.tzinfo is None:
+            instant = utils.add_local_timezone(instant)
+        target = utils.datetime_to_epoch_ns(instant)
+        if self._timestamps_ns is not None:
+            return int(numpy.searchsorted(self._timestamps_ns, target, side))
+        # Only events within a microsecond may round to the same microsecond.
+        lo, hi = numpy.searchsorted(
+            self._timestamps, [(target - 1000) / 1e9, (target + 1000) / 1e9], side
         )
+        micros = utils.epoch_to_datetime64(self._timestamps[lo:hi], "us")
+        index = numpy.searchsorted(micros.view(numpy.int64), target // 1000, side)
+        return int(lo + index)
+
+    def index_of(self, instant: datetime_module.datetime) -> int:
+        """Returns the index of the last event at or before instant.
+
+        Timestamps must be in time order, as they are when retrieved.
+
+        Args:
+            instant: datetime. If naive, it is assumed to be local time.
+
+        Returns:
+            index of the event, or -1 if all events are after instant
+        """
+        return self._search(instant, "right") - 1
+
+    def at(self, instant: datetime_module.datetime) -> ArchiveEvent:
+        """Returns the last event at or before instant.
+
+        Args:
+            instant: datetime. If naive, it is assumed to be local time.
+
+        Returns:
+            ArchiveEvent object
+
+        Raises:
+            ValueError: if there is no event at or before instant
+        """
+        index = self.index_of(instant)
+        if index < 0:
+            error_msg = "No data found for pv {} at timestamp {}"
+            raise ValueError(error_msg.format(self.pv, instant))
+        return self[index]
+
+    def between(
+        self,
+        start: datetime_module.datetime,
+        end: Optional[datetime_module.datetime] = None,
+        include_preceding: bool = False,
+    ) -> ArchiveData:
+        """Returns the events from start to end inclusive.
+
+        The arrays of the result are views of those of this object, so
+        that many ranges can be taken from data retrieved once.
+
+        Args:
+            start: datetime of start of range. If naive, it is assumed to be
+                local time.
+            end: datetime of end of range. If None, include all events after
+                start.
+            include_preceding: if True, also include the last event before
+                start, as the Archiver Appliance does
+
+        Returns:
+            ArchiveData object
+        """
+        if include_preceding:
+            first = max(self.index_of(start), 0)
+        else:
+            first = self._search(start, "left")
+        last = len(self) if end is None else self._search(end, "right")
+        return self.subset(slice(first, max(first, last)))
 
     def concatenate(self, other: ArchiveData, zero_pad: bool = False) -> ArchiveData:
         """Combine two ArchiveData objects.
 
         Create a new object so that ArchiveData objects can be treated as
-        immutable.
+        immutable. To combine more than two objects use concat(), which
+        copies each event only once.
 
         Args:
             other: ArchiveData object with later timestamps
@@ -268,35 +580,105 @@ class ArchiveData(object):
         Returns:
             new ArchiveData object combining self and other
         """
-        assert other.pv == self.pv, DIFFERENT_PV_ERROR
-        timestamps = numpy.concatenate([self.timestamps, other.timestamps])
-        self._check_timestamps(timestamps)
-        if zero_pad:
-            first_length, first_size = self.values.shape
-            second_length, second_size = other.values.shape
-
-            target_shape = (first_length + second_length, max(first_size, second_size))
-            new_values = numpy.zeros(target_shape)
-            new_values[:first_length, :first_size] = self.values
-            new_values[first_length:, :second_size] = other.values
+        return ArchiveData.concat([self, other], zero_pad)
+
+    @classmethod
+    def concat(
+        cls, data_list: Sequence[ArchiveData], zero_pad: bool = False
+    ) -> ArchiveData:
+        """Combine a sequence of ArchiveData objects in time order.
+
+        The result is allocated once and its timestamps are checked once
+        when it is constructed, so the cost is linear in the total number
+        of events however many objects are combined.
+
+        Args:
+            data_list: non-empty sequence of ArchiveData objects for the same
+                       PV, each with later timestamps than the one before
+            zero_pad: if the values arrays differ in their second dimension,
+                      expand the smaller ones to the size of the largest,
+                      padding with zeros.
+
+        Returns:
+            new ArchiveData object combining all of data_list. If any
+            object is ragged, so is the result and nothing is padded.
+        """
+        assert len(data_list) > 0, "No ArchiveData objects to concatenate"
+        first = data_list[0]
+        assert all(d.pv == first.pv for d in data_list), DIFFERENT_PV_ERROR
+        if all(d.has_exact_timestamps for d in data_list):
+            timestamps = None
+            timestamps_ns = numpy.concatenate([d.timestamps_ns for d in data_list])
         else:
-            new_values = numpy.concatenate([self.values, other.values])
-        severities = numpy.concatenate([self.severities, other.severities])
-        if self.enum_options != other.enum_options:
+            timestamps = numpy.concatenate([d.timestamps for d in data_list])
+            timestamps_ns = None
+        severities = numpy.concatenate([d.severities for d in data_list])
+        if any(d.is_ragged for d in data_list):
+            lengths = numpy.concatenate([d.lengths for d in data_list])
+            offsets = numpy.concatenate([[0], numpy.cumsum(lengths)])
+            new_values = numpy.concatenate([d.flat_values for d in data_list])
+        else:
+            offsets = None
+            new_values = concat_values([d.values for d in data_list], zero_pad)
+        if any(d.enum_options != first.enum_options for d in data_list[1:]):
             logging.warning("Enum options are not the same. Using mine.")
+        return cls(
+            first.pv,
+            new_values,
+            timestamps,
+            severities,
+            first.enum_options,
+            timestamps_ns,
+            offsets,
+        )
+
+    def subset(self, key) -> ArchiveData:
+        """Returns the events selected by a slice, mask or index array.
+
+        A slice gives an object whose arrays are views of those of this
+        object.
+
+        Args:
+            key: slice, boolean mask or array of indices of the events
+
+        Returns:
+            ArchiveData object
+        """
+        timestamps_ns = self._timestamps_ns
+        values, offsets = self._values, self._offsets
+        if offsets is None:
+            values = values[key]
+        elif isinstance(key, slice) and key.step in (None, 1):
+            # Share the flat values, which offsets index into.
+            start, stop, _ = key.indices(len(self))
+            offsets = offsets[start : max(start, stop) + 1]
+        else:
+            starts = offsets[:-1][key]
+            lengths = numpy.diff(offsets)[key]
+            new_offsets = numpy.concatenate([[0], numpy.cumsum(lengths)])
+            positions = numpy.arange(new_offsets[-1]) + numpy.repeat(
+                starts - new_offsets[:-1], lengths
+            )
+            values, offsets = values[positions], new_offsets
         return ArchiveData(
-            self.pv, new_values, timestamps, severities, self.enum_options
+            self.pv,
+            values,
+            None if timestamps_ns is not None else self.timestamps[key],
+            self.severities[key],
+            self.enum_options,
+            None if timestamps_ns is None else timestamps_ns[key],
+            offsets,
         )
 
     def __str__(self):
-        if not self.values.size:
+        if not len(self):
             return "Empty archive data for PV '{}'".format(self.pv)
         else:
             return ArchiveData.DESC.format(
                 self.pv,
-                len(self.values),
-                utils.epoch_to_datetime(self._timestamps[0]),
-                utils.epoch_to_datetime(self._timestamps[-1]),
+                len(self),
+                utils.epoch_to_datetime(self.timestamps[0]),
+                utils.epoch_to_datetime(self.timestamps[-1]),
             )
 
     __repr__ = __str__
@@ -305,30 +687,434 @@ class ArchiveData(object):
         equal = isinstance(other, ArchiveData)
         equal = equal and self.pv == other.pv
         equal = equal and numpy.allclose(self.values, other.values)
-        equal = equal and numpy.allclose(self.timestamps, other.timestamps)
+        if self.has_exact_timestamps and other.has_exact_timestamps:
+            equal = equal and numpy.array_equal(self.timestamps_ns, other.timestamps_ns)
+        else:
+            equal = equal and numpy.allclose(self.timestamps, other.timestamps)
         equal = equal and numpy.array_equal(self.severities, other.severities)
         equal = equal and self.enum_options == other.enum_options
         return equal
 
     def __iter__(self):
-        for value, timestamp, severity in zip(
-            self.values, self.timestamps, self.severities
-        ):
-            yield ArchiveEvent(self.pv, value, timestamp, severity, self.enum_options)
+        return map(functools.partial(_ArchiveDataRow, self), range(len(self)))
 
     def __len__(self):
-        return len(self.values)
+        return len(self.severities)
 
     def __getitem__(self, i):
+        if not isinstance(i, slice):
+            # Raises IndexError if out of range.
+            return _ArchiveDataRow(self, range(len(self))[i])
         return ArchiveEvent(
             self.pv,
-            self.values[i],
+            self.subset(i).values if self.is_ragged else self.values[i],
             self.timestamps[i],
             self.severities[i],
             self.enum_options,
         )
 
 
+class StatisticsData(object):
+    """Statistics of the events in each bin of a retrieval.
+
+    These are returned by AA post-processors such as optimized_N, which
+    give a vector of statistics for each bin rather than a single value.
+    Statistics that the post-processor does not provide are NaN.
+    """
+
+    STATISTICS = ("mean", "std", "minimum", "maximum", "count")
+
+    def __init__(
+        self,
+        pv: str,
+        timestamps: numpy.ndarray,
+        mean: numpy.ndarray,
+        std: numpy.ndarray,
+        minimum: numpy.ndarray,
+        maximum: numpy.ndarray,
+        count: numpy.ndarray,
+        severities: numpy.ndarray,
+    ):
+        assert (
+            len(timestamps)
+            == len(mean)
+            == len(std)
+            == len(minimum)
+            == len(maximum)
+            == len(count)
+            == len(severities)
+        )
+        self._pv = pv
+        self._timestamps = timestamps
+        self._mean = mean
+        self._std = std
+        self._minimum = minimum
+        self._maximum = maximum
+        self._count = count
+        self._severities = severities
+
+    @staticmethod
+    def from_archive_data(
+        archive_data: ArchiveData, statistics: List[str], pv: Optional[str] = None
+    ) -> StatisticsData:
+        """Split the values returned by a post-processor into statistics.
+
+        If each value has a single element, the post-processor returned the
+        raw events, as optimized_N does when there are fewer than N events.
+        Each event then counts as a bin of one event.
+
+        Args:
+            archive_data: ArchiveData returned by the post-processor
+            statistics: names from STATISTICS of the elements of each value
+            pv: PV name to use. If None, use that of archive_data.
+
+        Returns:
+            StatisticsData object
+        """
+        pv = archive_data.pv if pv is None else pv
+        values = archive_data.values.astype(numpy.float64)
+        n = len(values)
+        if values.shape[1] == 1 and len(statistics) > 1:
+            raw = values[:, 0]
+            columns = {
+                "mean": raw,
+                "std": numpy.zeros((n,)),
+                "minimum": raw,
+                "maximum": raw,
+                "count": numpy.ones((n,)),
+            }
+        else:
+            columns = {name: values[:, i] for i, name in enumerate(statistics)}
+        arrays = [
+            columns.get(name, numpy.full((n,), numpy.nan))
+            for name in StatisticsData.STATISTICS
+        ]
+        return StatisticsData(
+            pv, archive_data.timestamps, *arrays, archive_data.severities
+        )
+
+    @property
+    def pv(self) -> str:
+        return self._pv
+
+    @property
+    def timestamps(self) -> numpy.ndarray:
+        return self._timestamps
+
+    @property
+    def mean(self) -> numpy.ndarray:
+        return self._mean
+
+    @property
+    def std(self) -> numpy.ndarray:
+        return self._std
+
+    @property
+    def minimum(self) -> numpy.ndarray:
+        return self._minimum
+
+    @property
+    def maximum(self) -> numpy.ndarray:
+        return self._maximum
+
+    @property
+    def count(self) -> numpy.ndarray:
+        return self._count
+
+    @property
+    def severities(self) -> numpy.ndarray:
+        return self._severities
+
+    def __len__(self):
+        return len(self._timestamps)
+
+    def __str__(self):
+        return "Statistics for PV {}: {} bins".format(self.pv, len(self))
+
+    __repr__ = __str__
+
+
+class Snapshot(object):
+    """The event preceding one instant for each of many PVs.
+
+    The events are stored as columns, with row i holding the event for
+    pvs[i]. Waveforms are zero-padded to the widest one. PVs for which no
+    event was found have a NaN timestamp and are False in found. Any
+    exceptions raised while retrieving PVs are in the errors dict.
+    """
+
+    DESC = "Snapshot of {} PVs at {:%Y-%m-%d %H:%M:%S.%f %Z}: {} found"
+
+    def __init__(
+        self,
+        instant: datetime_module.datetime,
+        pvs: List[str],
+        values: numpy.ndarray,
+        timestamps: numpy.ndarray,
+        severities: numpy.ndarray,
+        enum_options: Optional[Dict[str, OrderedDict[int, str]]] = None,
+    ):
+        assert len(pvs) == len(values) == len(timestamps) == len(severities)
+        self._instant = instant
+        self._pvs = list(pvs)
+        self._rows = {pv: i for i, pv in enumerate(self._pvs)}
+        self._values = values
+        self._timestamps = timestamps
+        self._severities = severities
+        self._enum_options = {} if enum_options is None else enum_options
+        self.errors: Dict[str, Exception] = {}
+
+    @staticmethod
+    def from_rows(
+        instant: datetime_module.datetime,
+        pvs: List[str],
+        rows: Dict[str, tuple],
+        enum_options: Optional[Dict[str, OrderedDict[int, str]]] = None,
+    ) -> Snapshot:
+        """Build a Snapshot from the event found for each PV.
+
+        Args:
+            instant: datetime of the snapshot
+            pvs: names of all the PVs requested
+            rows: dict of (value, timestamp, severity) keyed by the name of
+                each PV for which an event was found
+            enum_options: dict of the enum options of each enum PV
+
+        Returns:
+            Snapshot object
+        """
+        values = [numpy.atleast_1d(rows[pv][0]) for pv in pvs if pv in rows]
+        width = max([len(value) for value in values], default=1)
+        strings = [value.dtype.kind in "SU" for value in values]
+        if any(strings) and not all(strings):
+            dtype = numpy.dtype(object)
+        else:
+            dtype = numpy.result_type(*values) if values else numpy.float64
+        value_array = numpy.zeros((len(pvs), width), dtype=dtype)
+        timestamps = numpy.full((len(pvs),), numpy.nan)
+        severities = numpy.zeros((len(pvs),))
+        for i, pv in enumerate(pvs):
+            if pv in rows:
+                value, timestamp, severity = rows[pv]
+                value = numpy.atleast_1d(value)
+                value_array[i, : len(value)] = value
+                timestamps[i] = timestamp
+                severities[i] = severity
+        return Snapshot(instant, pvs, value_array, timestamps, severities, enum_options)
+
+    @property
+    def instant(self) -> datetime_module.datetime:
+        return self._instant
+
+    @property
+    def pvs(self) -> List[str]:
+        return self._pvs
+
+    @property
+    def values(self) -> numpy.ndarray:
+        return self._values
+
+    @property
+    def timestamps(self) -> numpy.ndarray:
+        return self._timestamps
+
+    @property
+    def severities(self) -> numpy.ndarray:
+        return self._severities
+
+    @property
+    def enum_options(self) -> Dict[str, OrderedDict[int, str]]:
+        """Dict of the enum options of each enum PV, where available."""
+        return self._enum_options
+
+    @property
+    def found(self) -> numpy.ndarray:
+        """Boolean array which is True for PVs with an event."""
+        return ~numpy.isnan(self._timestamps)
+
+    def get_event(self, pv: str) -> ArchiveEvent:
+        """Returns the ArchiveEvent for a PV.
+
+        Raises:
+            KeyError if pv is not in the snapshot
+            ValueError if no event was found for pv
+        """
+        i = self._rows[pv]
+        if numpy.isnan(self._timestamps[i]):
+            raise ValueError("No data found for pv {} at {}".format(pv, self.instant))
+        return ArchiveEvent(
+            pv,
+            self._values[i],
+            self._timestamps[i],
+            self._severities[i],
+            self._enum_options.get(pv, OrderedDict()),
+        )
+
+    def __len__(self):
+        return len(self._pvs)
+
+    def __contains__(self, pv):
+        return pv in self._rows
+
+    def __str__(self):
+        return Snapshot.DESC.format(
+            len(self), self.instant, int(numpy.count_nonzero(self.found))
+        )
+
+    __repr__ = __str__
+
+
+def concat_values(
+    value_arrays: Sequence[numpy.ndarray], zero_pad: bool = False
+) -> numpy.ndarray:
+    """Concatenate the values arrays of consecutive events.
+
+    Args:
+        value_arrays: non-empty sequence of 2d arrays with one row per event
+        zero_pad: if the arrays differ in their second dimension, expand the
+            smaller ones to the size of the largest, padding with zeros.
+            Empty arrays then do not affect the width or type of the result.
+
+    Returns:
+        array with the rows of all of value_arrays, of a type that can hold
+        all their values
+
+    Raises:
+        ValueError: if the arrays differ in width and zero_pad is False
+    """
+    if zero_pad:
+        # Empty objects do not affect the width or type of the result.
+        value_arrays = [v for v in value_arrays if len(v)] or value_arrays
+    width = max(v.shape[1] for v in value_arrays)
+    if all(v.shape[1] == width for v in value_arrays):
+        return numpy.concatenate(value_arrays)
+    if not zero_pad:
+        raise ValueError(
+            "Values of widths {} cannot be concatenated without zero_pad".format(
+                sorted(set(v.shape[1] for v in value_arrays))
+            )
+        )
+    dtype = numpy.result_type(*value_arrays)
+    new_values = numpy.zeros((sum(map(len, value_arrays)), width), dtype=dtype)
+    row = 0
+    for v in value_arrays:
+        new_values[row : row + len(v), : v.shape[1]] = v
+        row += len(v)
+    return new_values
+
+
+def ragged_values(
+    flat_values: numpy.ndarray, offsets: numpy.ndarray, dtype=None
+) -> numpy.ndarray:
+    """Convert waveforms stored end to end into a zero-padded 2d array.
+
+    Args:
+        flat_values: 1d array of the values of all events, one after another
+        offsets: array of n + 1 positions in flat_values at which each of n
+            events starts, the last being where the final event ends
+        dtype: dtype of the result. If None, that of flat_values.
+
+    Returns:
+        array with one row per event, as wide as the longest waveform
+    """
+    flat_values = numpy.asarray(flat_values)
+    offsets = numpy.asarray(offsets, dtype=numpy.int64)
+    lengths = numpy.diff(offsets)
+    width = max(int(lengths.max(initial=0)), 1)
+    values = numpy.zeros((len(lengths), width), dtype=dtype or flat_values.dtype)
+    rows = numpy.repeat(numpy.arange(len(lengths)), lengths)
+    starts = numpy.repeat(offsets[:-1] - offsets[0], lengths)
+    columns = numpy.arange(len(rows)) - starts
+    values[rows, columns] = flat_values[offsets[0] : offsets[-1]]
+    return values
+
+
+def _is_string(value) -> bool:
+    return isinstance(value, (str, bytes))
+
+
+def values_array(values: Sequence) -> numpy.ndarray:
+    """Convert the values of many events into an array of values.
+
+    The type of the array is chosen from all of the values, not just the
+    first. Strings mixed with numbers give an array of objects.
+
+    Args:
+        values: sequence with the value of each event, each either a
+            scalar, a string or a sequence of them. Sequences may differ in
+            length, in which case the shorter are padded with zeros.
+
+    Returns:
+        array with one row per event
+    """
+    if not len(values):
+        return numpy.zeros((0, 1))
+    try:
+        array = numpy.array(values)
+    except ValueError:  # Waveforms of different lengths
+        array = None
+    if array is not None and array.dtype != object and array.ndim <= 2:
+        if array.dtype.kind not in "SU" or all(map(_is_string, values)):
+            return array.reshape((len(values), -1))
+    return ragged_values(*_flatten_values(values))
+
+
+def _flatten_values(values: Sequence) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Returns the values of all events end to end and their offsets."""
+    flat = []
+    lengths = numpy.ones((len(values),), dtype=numpy.int64)
+    for i, value in enumerate(values):
+        if _is_string(value) or numpy.ndim(value) == 0:
+            flat.append(value)
+        else:
+            flat.extend(value)
+            lengths[i] = len(value)
+    strings = [_is_string(value) for value in flat]
+    dtype = object if any(strings) and not all(strings) else None
+    offsets = numpy.concatenate([[0], numpy.cumsum(lengths)])
+    return numpy.array(flat, dtype=dtype), offsets
+
+
+def data_from_values(
+    pv: str,
+    values: Sequence,
+    timestamps: numpy.ndarray,
+    severities: numpy.ndarray,
+    enum_options: OrderedDict = OrderedDict(),
+    timestamps_ns: Optional[numpy.ndarray] = None,
+    ragged: bool = False,
+) -> ArchiveData:
+    """Create an ArchiveData object from the columns of many events.
+
+    Args:
+        pv: pv name for all events
+        values: sequence of the value of each event, as for values_array()
+        timestamps: float seconds since the epoch of each event. May be None
+            if timestamps_ns is given.
+        severities: EPICS alarm severity of each event
+        enum_options: enum options of the PV, if any
+        timestamps_ns: int64 nanoseconds since the epoch of each event, or
+            None
+        ragged: if True, store the values without padding them
+
+    Returns:
+        ArchiveData object
+    """
+    if ragged:
+        array, offsets = _flatten_values(values)
+    else:
+        array, offsets = values_array(values), None
+    return ArchiveData(
+        pv,
+        array,
+        None if timestamps is None else numpy.asarray(timestamps, dtype=float),
+        numpy.asarray(severities, dtype=float),
+        enum_options,
+        timestamps_ns,
+        offsets,
+    )
+
+
 def data_from_events(
     pv: str,
     events: List[ArchiveEvent],
@@ -341,38 +1127,19 @@ def data_from_events(
         pv: pv name for all archive events
         events: sequence of ArchiveEvent objects
         count: maximum number of events to include.  If None, return all events
+        enum_options: enum options of the PV, if any
 
     Returns:
         ArchiveData object
     """
-    event_count = min(count, len(events)) if count is not None else len(events)
-
-    # Use the first event to determine the type of array to use.
-    dt: numpy.dtype
-    try:
-        first_event = events[0]
-        if isinstance(first_event.value, str):
-            wf_length = 1
-            dt = numpy.dtype("U100")
-        else:
-            wf_length = len(first_event.value)
-            dt = numpy.dtype(type(first_event.value[0]))
-    except TypeError:  # Event value is not a waveform
-        wf_length = 1
-        dt = numpy.dtype(type(first_event.value))
-    except IndexError:  # No events
-        wf_length = 1
-        dt = numpy.dtype(numpy.float64)
-
-    values = numpy.zeros((event_count, wf_length), dtype=dt)
-    timestamps = numpy.zeros((event_count,))
-    severities = numpy.zeros((event_count,))
-    for i, event in enumerate(events[:event_count]):
-        values[i] = event.value
-        timestamps[i] = event.timestamp
-        severities[i] = event.severity
-
-    return ArchiveData(pv, values, timestamps, severities, enum_options)
+    events = events[:count] if count is not None else events
+    return data_from_values(
+        pv,
+        [event.value for event in events],
+        [event.timestamp for event in events],
+        [event.severity for event in events],
+        enum_options,
+    )
 
 
 def parse_enum_options(meta_dict: Dict[str, str]) -> OrderedDict[int, str]:
@@ -392,9 +1159,55 @@ def parse_enum_options(meta_dict: Dict[str, str]) -> OrderedDict[int, str]:
     return OrderedDict([(key, output_dict[key]) for key in sorted(output_dict.keys())])
 
 
-def _lookup_enum_string(int_value: int, enum_options: OrderedDict[int, str]) -> str:
-    """Look up the enum string for an int value; defaults to empty string."""
-    return enum_options.get(int_value, "")
+class EnumCodes(NamedTuple):
+    """Enum values as indices into an array of their string labels.
+
+    Values that have no label have a code of -1. This is the layout of a
+    pandas Categorical, which can be made with
+    pandas.Categorical.from_codes(codes.ravel(), labels).
+    """
+
+    codes: numpy.ndarray
+    labels: numpy.ndarray
+
+    def strings(self) -> numpy.ndarray:
+        """Returns the label of each value, or an empty string if none."""
+        # Code -1 selects the empty string appended to the labels.
+        return numpy.append(self.labels, "").take(self.codes)
+
+
+def enum_codes(values, enum_options: OrderedDict[int, str]) -> EnumCodes:
+    """Look up the labels of many enum values at once.
 
+    A table of the code for every possible value is built from enum_options,
+    so the values are converted with a single take() rather than a dict
+    lookup each.
 
-lookup_enum_string = numpy.vectorize(_lookup_enum_string, otypes=[DTYPE_ENUM_STR])
+    Args:
+        values: array of int enum values of any shape
+        enum_options: string label of each int value
+
+    Returns:
+        EnumCodes with codes of the same shape as values
+    """
+    values = numpy.asarray(values)
+    keys = numpy.array(list(enum_options.keys()), dtype=numpy.int64)
+    labels = numpy.array(list(enum_options.values()), dtype=str)
+    lowest = min(keys.min(initial=0), 0)
+    table = numpy.full((keys.max(initial=0) - lowest + 1,), -1, dtype=numpy.int64)
+    table[keys - lowest] = numpy.arange(len(keys))
+    if values.dtype.kind not in "iub":
+        # Values that are not whole numbers in the table have no label.
+        with numpy.errstate(invalid="ignore"):
+            whole = (numpy.floor(values) == values) & (values >= lowest)
+            whole &= values < lowest + len(table)
+        values = numpy.where(whole, values, lowest - 1)
+    index = values.astype(numpy.int64) - lowest
+    valid = (index >= 0) & (index < len(table))
+    codes = numpy.where(valid, table.take(numpy.where(valid, index, 0)), -1)
+    return EnumCodes(codes, labels)
+
+
+def lookup_enum_string(values, enum_options: OrderedDict[int, str]) -> numpy.ndarray:
+    """Look up the enum string for int values; defaults to empty string."""
+    return enum_codes(values, enum_options).strings()
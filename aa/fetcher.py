@@ -1,17 +1,193 @@
 """Base classes for use in fetching data from archivers."""
+import collections
+import concurrent.futures
+import json
+import logging as log
+import math
+import urllib.parse
 from datetime import datetime
 
 import pytz
 import requests
 
-from . import utils
+from . import align as align_module
+from . import data, utils
 
 __all__ = [
+    "DEFAULT_MAX_WORKERS",
+    "DEFAULT_BATCH_SIZE",
+    "SNAPSHOT_BATCH_SIZE",
+    "MultiPvData",
+    "BIN_OPERATORS",
+    "POINTS_OPERATORS",
+    "SAMPLES_OPERATORS",
+    "STATISTICS_OPERATORS",
+    "processed_pv",
+    "auto_bin_size",
     "Fetcher",
     "AaFetcher",
 ]
 
 
+# Number of PVs retrieved at the same time by Fetcher.get_values_many().
+DEFAULT_MAX_WORKERS = 8
+# Number of events in each ArchiveData yielded by Fetcher.iter_values().
+DEFAULT_BATCH_SIZE = 10000
+# Number of PVs in each request made by AaFetcher.get_events_at().
+SNAPSHOT_BATCH_SIZE = 1000
+
+
+def _slice_data(archive_data, start=None, end=None):
+    return archive_data.subset(slice(start, end))
+
+
+def _batches(blocks, batch_size):
+    """Regroup ArchiveData objects into ones of batch_size events.
+
+    The last batch may be smaller. Values of different widths within a
+    batch are zero-padded.
+    """
+    pending = []
+    n_pending = 0
+    for block in blocks:
+        if not len(block):
+            continue
+        pending.append(block)
+        n_pending += len(block)
+        if n_pending >= batch_size:
+            combined = data.ArchiveData.concat(pending, zero_pad=True)
+            offset = 0
+            while n_pending - offset >= batch_size:
+                yield _slice_data(combined, offset, offset + batch_size)
+                offset += batch_size
+            pending = [_slice_data(combined, offset)] if offset < n_pending else []
+            n_pending -= offset
+    if pending:
+        yield data.ArchiveData.concat(pending, zero_pad=True)
+
+
+def _snapshot_from_data(instant, pvs, results):
+    """Build a data.Snapshot from the MultiPvData of one event per PV."""
+    rows = {}
+    enum_options = {}
+    for pv, archive_data in results.items():
+        if len(archive_data):
+            rows[pv] = (
+                archive_data.values[0],
+                archive_data.timestamps[0],
+                archive_data.severities[0],
+            )
+        if archive_data.has_enum_options:
+            enum_options[pv] = archive_data.enum_options
+    snapshot = data.Snapshot.from_rows(instant, pvs, rows, enum_options)
+    snapshot.errors.update(results.errors)
+    return snapshot
+
+
+def _snapshot_from_json(instant, pvs, pv_events):
+    """Build a data.Snapshot from the JSON returned by getDataAtTime.
+
+    Args:
+        instant: datetime of the snapshot
+        pvs: names of all the PVs requested
+        pv_events: dict keyed by PV name of dicts with secs, nanos, val
+            and severity keys. PVs without an event are missing.
+    """
+    rows = {}
+    for pv in pvs:
+        event = pv_events.get(pv)
+        if event:
+            timestamp = event["secs"] + 1e-9 * event.get("nanos", 0)
+            rows[pv] = (event["val"], timestamp, event.get("severity", 0))
+    return data.Snapshot.from_rows(instant, pvs, rows)
+
+
+class MultiPvData(dict):
+    """Dict of ArchiveData objects keyed by PV name.
+
+    PVs that could not be retrieved are not in the dict. Instead, the
+    exception raised when retrieving each of them is in the errors dict.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(MultiPvData, self).__init__(*args, **kwargs)
+        self.errors = {}
+
+    def align(self, timestamps=None, method=align_module.ASOF, tolerance=None):
+        """Put the values of all the PVs onto the same timestamps.
+
+        The arguments and result are as for aa.align.align().
+        """
+        return align_module.align(self, timestamps, method, tolerance)
+
+
+# AA post-processors whose parameter is the bin size in seconds.
+BIN_OPERATORS = {
+    "firstSample",
+    "lastSample",
+    "firstFill",
+    "lastFill",
+    "mean",
+    "min",
+    "max",
+    "count",
+    "ncount",
+    "median",
+    "std",
+    "jitter",
+    "variance",
+    "popvariance",
+    "kurtosis",
+    "skewness",
+    "linear",
+    "loess",
+    "errorbar",
+}
+# AA post-processors whose parameter is the number of points to return.
+POINTS_OPERATORS = {"optimized", "optimLastSample"}
+# AA post-processors whose parameter is a number of events.
+SAMPLES_OPERATORS = {"nth"}
+# The statistics in each value returned by post-processors that return
+# more than one, named as in data.StatisticsData.STATISTICS.
+STATISTICS_OPERATORS = {
+    "optimized": ("mean", "std", "minimum", "maximum", "count"),
+    "errorbar": ("mean", "std"),
+}
+
+
+def processed_pv(pv, operator, parameter):
+    """Return the name requesting a post-processed PV from the AA.
+
+    Args:
+        pv: PV name
+        operator: name of the post-processor, such as "mean"
+        parameter: bin size, number of points or number of events
+            depending on the operator
+
+    Returns:
+        name such as "mean_600(PV)"
+    """
+    operators = BIN_OPERATORS | POINTS_OPERATORS | SAMPLES_OPERATORS
+    if operator not in operators:
+        raise ValueError("Operator {} not valid".format(operator))
+    return "{}_{}({})".format(operator, int(parameter), pv)
+
+
+def auto_bin_size(start, end, points):
+    """Return the bin size in seconds giving at most points bins.
+
+    Args:
+        start: datetime at start of requested period
+        end: datetime at end of requested period
+        points: target number of bins
+
+    Returns:
+        bin size in whole seconds, at least one
+    """
+    seconds = (end - start).total_seconds()
+    return max(int(math.ceil(seconds / points)), 1)
+
+
 class Fetcher(object):
     """Abstract base class for fetching data from an archiver."""
 
@@ -37,6 +213,45 @@ class Fetcher(object):
             ArchiveData object representing all events
 
         """
+        start, end = self._localize_range(start, end)
+        return self._get_values(pv, start, end, count, request_params)
+
+    def _iter_values(self, pv, start, end, request_params):
+        """Yield ArchiveData objects of any size for the events in order.
+
+        Subclasses override this to avoid retrieving all the events at
+        once.
+        """
+        yield self._get_values(pv, start, end, None, request_params)
+
+    def iter_values(
+        self, pv, start, end=None, batch_size=DEFAULT_BATCH_SIZE, request_params=None
+    ):
+        """Retrieve archive data in batches, without holding it all in memory.
+
+        The arguments are as for get_values(). Concatenating the batches
+        gives the same events as get_values(), except that waveforms are
+        only zero-padded to the widest waveform in each batch.
+
+        Args:
+            pv: PV to request data for
+            start: datetime at start of requested period
+            end: datetime at end of requested period. If None, request all
+                events to the current time
+            batch_size: number of events in each batch. The last batch may
+                be smaller.
+            request_params: Settings dictionary used for archiver request
+
+        Yields:
+            ArchiveData objects in time order
+
+        """
+        start, end = self._localize_range(start, end)
+        blocks = self._iter_values(pv, start, end, request_params)
+        return _batches(blocks, batch_size)
+
+    @staticmethod
+    def _localize_range(start, end):
         if start.tzinfo is None:
             start = utils.add_local_timezone(start)
         if end is not None:
@@ -44,7 +259,83 @@ class Fetcher(object):
                 end = utils.add_local_timezone(end)
         else:
             end = utils.add_local_timezone(datetime.now())
-        return self._get_values(pv, start, end, count, request_params)
+        return start, end
+
+    def get_values_many(
+        self,
+        pvs,
+        start,
+        end=None,
+        count=None,
+        request_params=None,
+        max_workers=DEFAULT_MAX_WORKERS,
+    ):
+        """Retrieve archive data for several PVs at the same time.
+
+        The arguments are as for get_values(), which is called for each PV
+        using a pool of max_workers threads. A failure to retrieve one PV
+        does not stop the others from being retrieved.
+
+        Args:
+            pvs: iterable of PV names
+            start: datetime at start of requested period
+            end: datetime at end of requested period. If None, request all
+                events to the current time
+            count: maximum number of events to return for each PV
+            request_params: Settings dictionary used for archiver request
+            max_workers: maximum number of PVs to retrieve at once
+
+        Returns:
+            MultiPvData of ArchiveData objects in the order of pvs, with
+            the exception raised for any PV that failed in its errors dict
+
+        """
+        start, end = self._localize_range(start, end)
+        pvs = list(collections.OrderedDict.fromkeys(pvs))
+
+        def get_pv(pv):
+            # Each request may modify its request_params.
+            params = None if request_params is None else dict(request_params)
+            return self._get_values(pv, start, end, count, params)
+
+        results = MultiPvData()
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            futures = [executor.submit(get_pv, pv) for pv in pvs]
+            for pv, future in zip(pvs, futures):
+                try:
+                    results[pv] = future.result()
+                except Exception as e:
+                    log.warning("Failed to retrieve {}: {}".format(pv, e))
+                    results.errors[pv] = e
+        return results
+
+    def get_events_at(
+        self, pvs, instant, request_params=None, max_workers=DEFAULT_MAX_WORKERS
+    ):
+        """Retrieve the event preceding the specified datetime for many PVs.
+
+        This is the equivalent of calling get_event_at() for each PV, but
+        the PVs are retrieved at the same time and the events are returned
+        as columns. PVs for which there is no event are marked as not found
+        rather than raising.
+
+        Args:
+            pvs: iterable of PV names
+            instant: datetime of the requested events
+            request_params: Settings dictionary used for archiver request
+            max_workers: maximum number of PVs to retrieve at once
+
+        Returns:
+            data.Snapshot of the events, with the exception raised for any
+            PV that failed in its errors dict
+
+        """
+        instant, _ = self._localize_range(instant, instant)
+        pvs = list(collections.OrderedDict.fromkeys(pvs))
+        results = self.get_values_many(
+            pvs, instant, instant, 1, request_params, max_workers
+        )
+        return _snapshot_from_data(instant, pvs, results)
 
     def get_event_at(self, pv, instant, request_params=None):
         """Retrieve the event preceding the specified datetime.
@@ -74,12 +365,35 @@ class Fetcher(object):
 class AaFetcher(Fetcher):
     """Abstract base class for fetching data from the Archiver Appliance."""
 
-    def __init__(self, hostname, port, binary=False):
+    def __init__(self, hostname, port, binary=False, session=None, timeout=None):
+        """
+
+        Args:
+            hostname: hostname of Archiver Appliance
+            port: port to connect to
+            binary: if True, stream the response rather than reading it
+                all at once
+            session: requests Session to use, which may be shared with
+                other fetchers. If None, the fetcher creates its own
+                using utils.create_session().
+            timeout: timeout in seconds for each request, or a tuple of
+                connect and read timeouts. If None, wait forever.
+        """
         self._host = hostname
         self._port = port
         self._endpoint = "http://{}:{}".format(self._host, self._port)
         self._url = None
         self._binary = binary
+        self._owns_session = session is None
+        self._session = utils.create_session() if session is None else session
+        self._timeout = timeout
+        # Set to False if the AA does not support getDataAtTime.
+        self._snapshot_supported = True
+
+    def close(self):
+        """Close the connections of the session if the fetcher created it."""
+        if self._owns_session:
+            self._session.close()
 
     @staticmethod
     def _format_datetime(dt):
@@ -105,7 +419,9 @@ class AaFetcher(Fetcher):
         request_params["fetchLatestMetadata"] = "true"
 
         suffix = "?pv={}&from={}&to={}".format(
-            pv, self._format_datetime(start), self._format_datetime(end)
+            urllib.parse.quote(pv, safe=":"),
+            self._format_datetime(start),
+            self._format_datetime(end),
         )
 
         for key, value in request_params.items():
@@ -113,9 +429,124 @@ class AaFetcher(Fetcher):
 
         return "{}{}".format(self._url, suffix)
 
+    def _construct_snapshot_url(self, instant, request_params):
+        suffix = "?at={}&includeProxies=true".format(self._format_datetime(instant))
+        for key, value in (request_params or {}).items():
+            suffix += "&{}={}".format(key, value)
+        return "{}/retrieval/data/getDataAtTime{}".format(self._endpoint, suffix)
+
+    def _fetch_snapshot(self, pvs, instant, request_params, max_workers):
+        """Retrieve the events for pvs from getDataAtTime.
+
+        The PVs are requested in batches of SNAPSHOT_BATCH_SIZE, up to
+        max_workers batches at a time.
+
+        Returns:
+            dict of the event found for each PV, as returned by the AA
+        """
+        url = self._construct_snapshot_url(instant, request_params)
+        headers = {"Content-Type": "application/json"}
+
+        def post(batch):
+            response = self._session.post(
+                url, json.dumps(batch), headers=headers, timeout=self._timeout
+            )
+            response.raise_for_status()
+            return response.json()
+
+        batches = [
+            pvs[i : i + SNAPSHOT_BATCH_SIZE]
+            for i in range(0, len(pvs), SNAPSHOT_BATCH_SIZE)
+        ]
+        pv_events = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            for result in executor.map(post, batches):
+                pv_events.update(result)
+        return pv_events
+
+    def get_events_at(
+        self, pvs, instant, request_params=None, max_workers=DEFAULT_MAX_WORKERS
+    ):
+        """Retrieve the event preceding the specified datetime for many PVs.
+
+        Many PVs are retrieved in each request using the getDataAtTime
+        endpoint of the AA. If the AA does not provide it, fall back to
+        retrieving the PVs separately. Events from getDataAtTime do not
+        include enum options.
+
+        The arguments and result are as for Fetcher.get_events_at().
+        """
+        instant, _ = self._localize_range(instant, instant)
+        pvs = list(collections.OrderedDict.fromkeys(pvs))
+        if self._snapshot_supported:
+            try:
+                pv_events = self._fetch_snapshot(
+                    pvs, instant, request_params, max_workers
+                )
+                return _snapshot_from_json(instant, pvs, pv_events)
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code != 404:
+                    raise
+                log.info("getDataAtTime not available; retrieving PVs separately")
+                self._snapshot_supported = False
+        return super(AaFetcher, self).get_events_at(
+            pvs, instant, request_params, max_workers
+        )
+
     def _fetch_data(self, pv, start, end, request_params):
         url = self._construct_url(pv, start, end, request_params)
-        return requests.get(url, stream=self._binary)
+        return self._session.get(url, stream=self._binary, timeout=self._timeout)
+
+    def get_processed_values(
+        self,
+        pv,
+        start,
+        end=None,
+        operator="mean",
+        bin_size=None,
+        points=None,
+        request_params=None,
+    ):
+        """Retrieve data reduced by an AA post-processor.
+
+        The post-processor runs on the server so much less data is
+        transferred. Exactly one of bin_size or points should be given,
+        except that nth requires bin_size.
+
+        Args:
+            pv: PV to request data for
+            start: datetime at start of requested period
+            end: datetime at end of requested period. If None, request all
+                events to the current time
+            operator: name of the post-processor; one of BIN_OPERATORS,
+                POINTS_OPERATORS or SAMPLES_OPERATORS
+            bin_size: the parameter of the post-processor: the bin size in
+                seconds, number of points or number of events
+            points: target number of points, from which the bin size is
+                chosen if bin_size is None
+            request_params: Settings dictionary used for archiver request
+
+        Returns:
+            data.StatisticsData for STATISTICS_OPERATORS, otherwise an
+            ArchiveData object whose PV name includes the operator
+
+        """
+        start, end = self._localize_range(start, end)
+        if bin_size is None:
+            if points is None or operator in SAMPLES_OPERATORS:
+                raise ValueError("bin_size is required for {}".format(operator))
+            if operator in POINTS_OPERATORS:
+                bin_size = points
+            else:
+                bin_size = auto_bin_size(start, end, points)
+        archive_data = self._get_values(
+            processed_pv(pv, operator, bin_size), start, end, None, request_params
+        )
+        if operator in STATISTICS_OPERATORS:
+            return data.StatisticsData.from_archive_data(
+                archive_data, STATISTICS_OPERATORS[operator], pv
+            )
+        return archive_data
 
     def _get_values(self, pv, start, end, count, request_params):
         response = self._fetch_data(pv, start, end, request_params)
@@ -1,43 +1,70 @@
 """Class for fetching data from the Archiver Appliance using JSON."""
+import numpy
+
 from . import data, fetcher
 
-__all__ = ["JsonFetcher"]
+__all__ = ["parse_json_data", "JsonFetcher"]
+
+
+def parse_json_data(json_data, pv, nanoseconds=False):
+    """Turn the decoded JSON returned by getData.json into an ArchiveData object
+
+    Args:
+        json_data: list decoded from the JSON response
+        pv: name of PV
+        nanoseconds: if True, keep exact int64 nanosecond timestamps
+
+    Returns:
+        An ArchiveData object
+    """
+    archive_data = data.ArchiveData.empty(pv)
+
+    if json_data and "data" in json_data[0]:
+        json_events = json_data[0]["data"]
+        enum_options = (
+            data.parse_enum_options(json_data[0]["meta"])
+            if "meta" in json_data[0]
+            else {}
+        )
+        secs = numpy.array([e["secs"] for e in json_events], dtype=numpy.int64)
+        nanos = numpy.array([e["nanos"] for e in json_events], dtype=numpy.int64)
+        if nanoseconds:
+            timestamps, timestamps_ns = None, secs * 1000000000 + nanos
+        else:
+            timestamps, timestamps_ns = secs + 1e-9 * nanos, None
+        archive_data = data.data_from_values(
+            pv,
+            [e["val"] for e in json_events],
+            timestamps,
+            [e["severity"] for e in json_events],
+            enum_options,
+            timestamps_ns,
+        )
+
+    return archive_data
 
 
 class JsonFetcher(fetcher.AaFetcher):
     """Class to fetch data from the Archiver Appliance using JSON."""
 
-    def __init__(self, hostname, port):
+    def __init__(
+        self, hostname, port, session=None, timeout=None, nanoseconds=False
+    ):
         """
 
         Args:
             hostname: hostname of Archiver Appliance
             port: port to connect to
+            session: requests Session to use. If None, create one.
+            timeout: timeout in seconds for each request
+            nanoseconds: if True, return ArchiveData with exact int64
+                nanosecond timestamps
         """
-        super(JsonFetcher, self).__init__(hostname, port)
+        super(JsonFetcher, self).__init__(
+            hostname, port, session=session, timeout=timeout
+        )
         self._url = "{}/retrieval/data/getData.json".format(self._endpoint)
+        self._nanoseconds = nanoseconds
 
     def _parse_raw_data(self, response, pv, start, end, count):
-        json_data = response.json()
-        archive_data = data.ArchiveData.empty(pv)
-
-        if json_data and "data" in json_data[0]:
-            events = []
-            json_events = json_data[0]["data"]
-            for json_event in json_events:
-                timestamp = json_event["secs"] + 1e-9 * json_event["nanos"]
-                events.append(
-                    data.ArchiveEvent(
-                        pv, json_event["val"], timestamp, json_event["severity"]
-                    )
-                )
-
-            enum_options = (
-                data.parse_enum_options(json_data[0]["meta"])
-                if "meta" in json_data[0]
-                else {}
-            )
-
-            archive_data = data.data_from_events(pv, events, enum_options=enum_options)
-
-        return archive_data
+        return parse_json_data(response.json(), pv, self._nanoseconds)
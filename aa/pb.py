@@ -23,18 +23,25 @@ correctly deduce some properties, so I have manually disabled some warnings.
 from __future__ import annotations
 
 import collections
+import collections.abc
+import concurrent.futures
 import datetime
 import logging as log
+import mmap
 import os
+import queue
 import re
-from typing import Any
+import threading
+import zipfile
+from typing import Any, List, NamedTuple, Optional, Sequence, Tuple
 
+import numpy
 import pytz
 import requests
 
 from . import data
 from . import epics_event_pb2 as ee
-from . import fetcher, utils
+from . import fetcher, utils, wire
 
 __all__ = [
     "unescape_bytes",
@@ -42,9 +49,31 @@ __all__ = [
     "event_timestamp",
     "search_events",
     "break_up_chunks",
+    "BufferLines",
+    "split_lines",
+    "unescape_lines",
     "event_from_line",
+    "EventColumns",
+    "decode_lines",
+    "column_timestamps",
+    "data_from_columns",
     "parse_pb_data",
+    "PbStreamParser",
+    "stream_blocks",
+    "parse_pb_stream",
     "PbFetcher",
+    "PbChunk",
+    "PbFile",
+    "PbIndex",
+    "open_pb_file",
+    "PARTITION_GRANULARITIES",
+    "partition_start",
+    "next_partition_start",
+    "partition_boundaries",
+    "Partition",
+    "parse_partition_name",
+    "list_partitions",
+    "find_partitions",
     "PbFileFetcher",
     "get_iso_timestamp_for_event",
 ]
@@ -74,6 +103,31 @@ TYPE_MAPPINGS = {
 INVERSE_TYPE_MAPPINGS = {cls: numeric for numeric, cls in TYPE_MAPPINGS.items()}
 
 
+# The numpy dtype used to store the values of each type. A dtype of None
+# means that the values are strings and the width of the string dtype is
+# determined by the data. Byte sequences are stored as arrays of uint8.
+SCALAR_TYPES = {0, 1, 2, 3, 4, 5, 6}
+BYTES_TYPES = {4, 11, 14}
+STRING_TYPES = {0, 7}
+TYPE_DTYPES = {
+    0: None,
+    1: numpy.int64,
+    2: numpy.float64,
+    3: numpy.int64,
+    4: numpy.uint8,
+    5: numpy.int64,
+    6: numpy.float64,
+    7: None,
+    8: numpy.int64,
+    9: numpy.float64,
+    10: numpy.int64,
+    11: numpy.uint8,
+    12: numpy.int64,
+    13: numpy.float64,
+    14: numpy.uint8,
+}
+
+
 ESC_BYTE = b"\x1B"
 NL_BYTE = b"\x0A"
 CR_BYTE = b"\x0D"
@@ -99,20 +153,33 @@ PB_REPLACEMENTS_UNESCAPING = collections.OrderedDict(
 )
 
 
+# Matches any escape sequence so that a line can be unescaped in one pass.
+PB_ESCAPE_PATTERN = re.compile(re.escape(ESC_BYTE) + b"[\x01\x02\x03]")
+
+
+def _unescape_match(match):
+    return PB_REPLACEMENTS_ESCAPING[match.group()]
+
+
 def unescape_bytes(byte_seq):
     """Replace specific sub-sequences in a bytes sequence.
 
     This escaping is defined as part of the Archiver Appliance raw file
     format: https://slacmshankar.github.io/epicsarchiver_docs/pb_pbraw.html
 
+    Most lines contain no escape byte at all and are returned unchanged.
+    Otherwise all the escape sequences are replaced in a single pass,
+    which gives the same result as applying PB_REPLACEMENTS_UNESCAPING
+    in order.
+
     Args:
         byte_seq: any byte sequence
     Returns:
         the byte sequence unescaped according to the AA file format rules
     """
-    for key, value in PB_REPLACEMENTS_UNESCAPING.items():
-        byte_seq = byte_seq.replace(key, value)
-    return byte_seq
+    if ESC_BYTE not in byte_seq:
+        return byte_seq
+    return PB_ESCAPE_PATTERN.sub(_unescape_match, byte_seq)
 
 
 def escape_bytes(byte_seq):
@@ -156,6 +223,108 @@ def search_events(dt, chunk_info, lines):
     return utils.binary_search(lines, timestamp_from_line, target_time)
 
 
+class BufferLines(collections.abc.Sequence):
+    """A sequence of lines stored in a buffer, identified by their offsets.
+
+    This avoids splitting a buffer into a list of bytes objects. Indexing
+    returns the bytes of one line; slicing returns another BufferLines
+    sharing the same buffer.
+    """
+
+    def __init__(self, buffer, starts, ends):
+        """
+
+        Args:
+            buffer: bytes-like object containing the lines
+            starts: numpy int64 array of the offset of the start of each line
+            ends: numpy int64 array of the offset of the end of each line
+        """
+        self.buffer = buffer
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return BufferLines(self.buffer, self.starts[i], self.ends[i])
+        return self.buffer[self.starts[i] : self.ends[i]]
+
+
+def split_lines(buffer, start=0, end=None):
+    """Find the lines in part of a buffer without copying them.
+
+    A newline at the end of the region does not produce an empty line.
+
+    Args:
+        buffer: bytes-like object
+        start: offset at which to start
+        end: offset at which to stop. If None, the end of the buffer
+
+    Returns:
+        BufferLines for the lines in the region
+    """
+    end = len(buffer) if end is None else end
+    if end <= start:
+        empty = numpy.zeros((0,), dtype=numpy.int64)
+        return BufferLines(buffer, empty, empty)
+    region = numpy.frombuffer(buffer, numpy.uint8, end - start, start)
+    ends = numpy.flatnonzero(region == ord(NL_BYTE)) + start
+    if not ends.size or ends[-1] != end - 1:
+        ends = numpy.append(ends, end)
+    starts = numpy.empty_like(ends)
+    starts[0] = start
+    starts[1:] = ends[:-1] + 1
+    return BufferLines(buffer, starts, ends)
+
+
+def unescape_lines(lines):
+    """Unescape all the lines in a buffer in one go.
+
+    A single scan finds the lines containing the escape byte. If there
+    are none, the lines are returned unchanged. Otherwise, only those
+    lines are unescaped and a new buffer is built for the region covered
+    by the lines.
+
+    Args:
+        lines: BufferLines of escaped lines, in order of offset
+
+    Returns:
+        BufferLines of unescaped lines
+    """
+    if not len(lines):
+        return lines
+    lo, hi = int(lines.starts[0]), int(lines.ends[-1])
+    region = numpy.frombuffer(lines.buffer, numpy.uint8, hi - lo, lo)
+    escapes = numpy.flatnonzero(region == ord(ESC_BYTE)) + lo
+    del region
+    if not escapes.size:
+        return lines
+    # The region may contain bytes that are not part of any line, such as
+    # chunk headers. Escape bytes there just cause the following line to
+    # be unescaped unnecessarily, which does not change it.
+    rows = numpy.unique(numpy.searchsorted(lines.ends, escapes, side="right"))
+    rows = rows[rows < len(lines)]
+    pieces = []
+    deltas = numpy.zeros(len(lines), dtype=numpy.int64)
+    position = lo
+    for row in rows.tolist():
+        start, end = int(lines.starts[row]), int(lines.ends[row])
+        unescaped = unescape_bytes(lines.buffer[start:end])
+        pieces.append(lines.buffer[position:start])
+        pieces.append(unescaped)
+        deltas[row] = len(unescaped) - (end - start)
+        position = end
+    pieces.append(lines.buffer[position:hi])
+    shifts = numpy.cumsum(deltas)
+    return BufferLines(
+        b"".join(pieces),
+        lines.starts - lo + shifts - deltas,
+        lines.ends - lo + shifts,
+    )
+
+
 def break_up_chunks(raw_data):
     """
     Break up raw data into chunks by year
@@ -204,23 +373,256 @@ def event_from_line(line, pv, year, event_type):
     )
 
 
-def parse_pb_data(raw_data, pv, start, end, count=None):
+class EventColumns(NamedTuple):
+    """The fields of a sequence of events, with one array per field.
+
+    values is always a 2d array with one row per event; the other fields
+    are 1d arrays.
+    """
+
+    values: numpy.ndarray
+    secondsintoyear: numpy.ndarray
+    nanos: numpy.ndarray
+    severities: numpy.ndarray
+    statuses: numpy.ndarray
+
+
+def _stack_rows(rows, dtype):
+    """Build a 2d array from a list of 1d rows, zero-padding short rows."""
+    if not rows:
+        return numpy.zeros((0, 1), dtype=dtype)
+    lengths = numpy.fromiter((len(row) for row in rows), numpy.int64, len(rows))
+    width = max(int(lengths.max()), 1)
+    if numpy.all(lengths == width):
+        return numpy.array(rows, dtype=dtype).reshape((len(rows), width))
+    values = numpy.zeros((len(rows), width), dtype=dtype)
+    for i, row in enumerate(rows):
+        values[i, : len(row)] = row
+    return values
+
+
+def _values_array(vals, event_type):
+    """Convert the val field of a sequence of events into a 2d array."""
+    dtype = TYPE_DTYPES[event_type]
+    if event_type in BYTES_TYPES:
+        rows = [numpy.frombuffer(val, dtype=numpy.uint8) for val in vals]
+        return _stack_rows(rows, dtype)
+    if event_type in SCALAR_TYPES:
+        if event_type in STRING_TYPES:
+            return numpy.array(vals, dtype=str).reshape((-1, 1))
+        return numpy.fromiter(vals, dtype, len(vals)).reshape((-1, 1))
+    if dtype is None:
+        width = max((len(item) for val in vals for item in val), default=1)
+        dtype = numpy.dtype("U{}".format(max(width, 1)))
+    return _stack_rows(vals, dtype)
+
+
+def _protobuf_columns(lines: Sequence[bytes], event_type: int) -> EventColumns:
+    """Decode unescaped lines using the protobuf library."""
+    n = len(lines)
+    secondsintoyear = numpy.empty((n,), dtype=numpy.int64)
+    nanos = numpy.empty((n,), dtype=numpy.int64)
+    severities = numpy.empty((n,), dtype=numpy.float64)
+    statuses = numpy.empty((n,), dtype=numpy.int32)
+    vals: List[Any] = [None] * n
+    repeated = event_type not in SCALAR_TYPES and event_type not in BYTES_TYPES
+    event = TYPE_MAPPINGS[event_type]()
+    for i, line in enumerate(lines):
+        event.ParseFromString(line)
+        secondsintoyear[i] = event.secondsintoyear
+        nanos[i] = event.nano
+        severities[i] = event.severity
+        statuses[i] = event.status
+        # Repeated fields belong to the message, which is reused.
+        vals[i] = list(event.val) if repeated else event.val
+    return EventColumns(
+        _values_array(vals, event_type), secondsintoyear, nanos, severities, statuses
+    )
+
+
+def _wire_columns(lines: BufferLines, event_type: int) -> EventColumns:
+    """Decode unescaped scalar events using aa.wire, falling back to protobuf."""
+    columns = wire.decode_scalar_events(
+        lines.buffer, lines.starts, lines.ends, event_type
+    )
+    values = columns.values.reshape((-1, 1))
+    severities = columns.severities.astype(numpy.float64)
+    statuses = columns.statuses
+    if numpy.any(columns.unhandled):
+        rows = numpy.flatnonzero(columns.unhandled)
+        log.debug("Decoding {} events using protobuf".format(len(rows)))
+        fallback = _protobuf_columns([lines[i] for i in rows], event_type)
+        width = fallback.values.shape[1]
+        if width > 1:
+            padded = numpy.zeros((len(values), width), dtype=values.dtype)
+            padded[:, :1] = values
+            values = padded
+        values[rows, :width] = fallback.values
+        columns.secondsintoyear[rows] = fallback.secondsintoyear
+        columns.nanos[rows] = fallback.nanos
+        severities[rows] = fallback.severities
+        statuses[rows] = fallback.statuses
+    return EventColumns(
+        values, columns.secondsintoyear, columns.nanos, severities, statuses
+    )
+
+
+def decode_lines(
+    lines: Sequence[bytes], event_type: int, wire_decoding: bool = False
+) -> EventColumns:
+    """Decode escaped lines of a PB chunk straight into arrays.
+
+    This avoids creating an ArchiveEvent for each line, and a single
+    protobuf message object is reused for all the lines. If lines is a
+    BufferLines, the lines are unescaped in one go using unescape_lines().
+
+    Args:
+        lines: escaped lines, each containing one event
+        event_type: the type of the events as key of TYPE_MAPPINGS
+        wire_decoding: if True, decode scalar types using aa.wire rather
+            than the protobuf library
+
+    Returns:
+        EventColumns containing the fields of all the events
+    """
+    use_wire = wire_decoding and event_type in wire.WIRE_TYPES
+    if use_wire and not isinstance(lines, BufferLines):
+        lengths = numpy.fromiter(map(len, lines), numpy.int64, len(lines))
+        ends = numpy.cumsum(lengths + 1) - 1
+        lines = BufferLines(b"\n".join(lines), ends - lengths, ends)
+    if isinstance(lines, BufferLines):
+        unescaped = unescape_lines(lines)
+        if use_wire:
+            return _wire_columns(unescaped, event_type)
+        return _protobuf_columns(unescaped, event_type)
+    return _protobuf_columns([unescape_bytes(line) for line in lines], event_type)
+
+
+def column_timestamps(year: int, columns: EventColumns) -> numpy.ndarray:
+    """Timestamps of decoded events in seconds since the epoch.
+
+    The arithmetic matches event_timestamp() so that the results are
+    identical.
+    """
+    year_start = utils.year_timestamp(year)
+    return year_start + columns.secondsintoyear + 1e-9 * columns.nanos
+
+
+def column_timestamps_ns(year: int, columns: EventColumns) -> numpy.ndarray:
+    """Exact timestamps of decoded events in int64 nanoseconds since the
+    epoch."""
+    year_start = int(utils.year_timestamp(year))
+    seconds = year_start + columns.secondsintoyear.astype(numpy.int64)
+    return seconds * 1000000000 + columns.nanos.astype(numpy.int64)
+
+
+def data_from_columns(
+    pv: str,
+    year_columns: List[Tuple[int, EventColumns]],
+    count: Optional[int] = None,
+    enum_options: collections.OrderedDict = collections.OrderedDict(),
+    nanoseconds: bool = False,
+) -> data.ArchiveData:
+    """Combine decoded events from one or more years into an ArchiveData object
+
+    Args:
+        pv: name of PV
+        year_columns: list of (year, EventColumns) in time order
+        count: maximum number of events to include. If None, return all events
+        enum_options: enum options for the PV, if any
+        nanoseconds: if True, the ArchiveData holds exact int64 nanosecond
+            timestamps
+
+    Returns:
+        ArchiveData object
+    """
+    year_columns = [(y, c) for y, c in year_columns if len(c.values)]
+    to_timestamps = column_timestamps_ns if nanoseconds else column_timestamps
+    if not year_columns:
+        empty = numpy.zeros((0,))
+        timestamps_ns = numpy.zeros((0,), dtype=numpy.int64) if nanoseconds else None
+        return data.ArchiveData(
+            pv, empty, empty, empty, enum_options, timestamps_ns=timestamps_ns
+        )
+    timestamps = numpy.concatenate([to_timestamps(y, c) for y, c in year_columns])
+    severities = numpy.concatenate([c.severities for _, c in year_columns])
+    # Strings in later pieces may be longer than those in the first.
+    values = data.concat_values([c.values for _, c in year_columns], zero_pad=True)
+    if nanoseconds:
+        return data.ArchiveData(
+            pv,
+            values[:count],
+            None,
+            severities[:count],
+            enum_options,
+            timestamps_ns=timestamps[:count],
+        )
+    return data.ArchiveData(
+        pv, values[:count], timestamps[:count], severities[:count], enum_options
+    )
+
+
+def _split_chunks(raw_data):
+    """Split raw data into chunks by year, like break_up_chunks().
+
+    Rather than splitting the data into a list of lines, the lines of
+    each year are described by a BufferLines.
+    """
+    lines = split_lines(raw_data)
+    empty = lines.starts == lines.ends
+    # Chunks are separated by empty lines and start with a header line.
+    headers = ~empty
+    headers[1:] &= empty[:-1]
+    header_rows = numpy.flatnonzero(headers)
+    bounds = numpy.append(header_rows, len(lines))
+    log.info("{} chunks in pb file".format(len(header_rows)))
+    year_chunks: collections.OrderedDict = collections.OrderedDict()
+    for i, row in enumerate(header_rows):
+        event_rows = numpy.arange(row + 1, bounds[i + 1])
+        event_rows = event_rows[~empty[event_rows]]
+        chunk_info = ee.PayloadInfo()
+        chunk_info.ParseFromString(unescape_bytes(lines[row]))
+        chunk_year = chunk_info.year  # pylint: disable=no-member
+        log.info("Year {}: {} events in chunk".format(chunk_year, len(event_rows)))
+        starts, ends = lines.starts[event_rows], lines.ends[event_rows]
+        try:
+            chunk_info, year_lines = year_chunks[chunk_year]
+            starts = numpy.concatenate([year_lines.starts, starts])
+            ends = numpy.concatenate([year_lines.ends, ends])
+        except KeyError:
+            pass
+        year_chunks[chunk_year] = chunk_info, BufferLines(raw_data, starts, ends)
+    return year_chunks
+
+
+def parse_pb_data(
+    raw_data, pv, start, end, count=None, wire_decoding=False, nanoseconds=False
+):
     """
     Turn raw PB data into an ArchiveData object
 
+    Events are decoded directly into arrays rather than building an
+    ArchiveEvent for each one. As the AA does, the latest event at or
+    before start is included, even if it is in an earlier year.
+
     Args:
         raw_data: The raw data
         pv: name of PV
         start: datetime.datetime for start of window
         end: datetime.datetime for end of window
         count: return up to this many events
+        wire_decoding: if True, decode scalar types using aa.wire
+        nanoseconds: if True, keep exact int64 nanosecond timestamps
 
     Returns:
         An ArchiveData object
     """
-    year_chunks = break_up_chunks(raw_data)
-    events = []
+    year_chunks = _split_chunks(raw_data)
     enum_options = {}
+    # The (year, chunk_info, lines) within the time range for each year,
+    # and the line of the latest event at or before start.
+    selections = []
+    preceding = None
     # Iterate over years
     for year, (chunk_info, lines) in year_chunks.items():
         # Look for enum options in the chunk info.
@@ -233,8 +635,8 @@ def parse_pb_data(raw_data, pv, start, end, count=None):
         # Find the index of the start event
         if start.year == year:  # search for the start
             s = search_events(start, chunk_info, lines)
-        elif start.year > year:  # ignore this chunk
-            s = len(lines) - 1
+        elif start.year > year:  # all events precede the start
+            s = len(lines)
         else:  # start.year < year: all events from the start of the year
             s = 0
         # Find the index of the end event
@@ -243,16 +645,358 @@ def parse_pb_data(raw_data, pv, start, end, count=None):
         elif end.year < year:  # ignore this chunk
             e = 0
         else:  # end.year > year: all events to the end of the year
-            e = None
-        # Include the event preceding the time range. This won't work over
-        # year boundaries for the time being.
+            e = len(lines)
+        # The event preceding the time range may be in an earlier year.
+        # It is only included if it is not after the end.
         if s > 0:
-            s -= 1
+            preceding = (year, chunk_info, lines[s - 1 : s]) if s <= e else None
         log.info("Year {} start {} end {}".format(year, s, e))
-        for line in lines[s:e]:
-            events.append(event_from_line(line, pv, year, chunk_info.type))
+        selections.append((year, chunk_info, lines[s:e]))
+    if preceding is not None:
+        selections.insert(0, preceding)
+
+    year_columns = []
+    decoded = 0
+    for year, chunk_info, selected in selections:
+        if count is not None:
+            # Only decode as many events as will be returned.
+            selected = selected[: max(count - decoded, 0)]
+        columns = decode_lines(selected, chunk_info.type, wire_decoding)
+        year_columns.append((year, columns))
+        decoded += len(selected)
+        if count is not None and decoded >= count:
+            break
+
+    return data_from_columns(pv, year_columns, count, enum_options, nanoseconds)
+
+
+# Size of the blocks read from a response by parse_pb_stream().
+STREAM_BLOCK_SIZE = 1 << 20
+# Number of blocks that may be read ahead of the parser.
+STREAM_READ_AHEAD = 8
+
+
+def _slice_columns(columns, start=None, end=None):
+    return EventColumns(*(field[start:end] for field in columns))
+
+
+def _fixed_width(values):
+    """Whether the width of decoded values does not depend on the events."""
+    return values.shape[1] == 1 and values.dtype.kind not in "SU"
+
+
+class PbStreamParser(object):
+    """Parse PB data incrementally, as it arrives.
+
+    Data may be passed to feed() in blocks of any size. Complete lines are
+    decoded straight away and only the events that parse_pb_data() would
+    return are kept, so the raw data never needs to be held in memory at
+    once. The result of finish() is identical to that of parse_pb_data()
+    for the concatenated blocks, provided the events of each year are in
+    time order.
+    """
+
+    def __init__(
+        self, pv, start, end, count=None, wire_decoding=False, nanoseconds=False
+    ):
+        """
+
+        Args:
+            pv: name of PV
+            start: datetime.datetime for start of window
+            end: datetime.datetime for end of window
+            count: return up to this many events
+            wire_decoding: if True, decode scalar types using aa.wire
+            nanoseconds: if True, keep exact int64 nanosecond timestamps
+        """
+        self._pv = pv
+        self._start = start
+        self._end = end
+        self._start_time = utils.datetime_to_epoch(start)
+        self._end_time = utils.datetime_to_epoch(end)
+        self._count = count
+        self._wire_decoding = wire_decoding
+        self._nanoseconds = nanoseconds
+        self._partial = b""
+        # Whether the next non-empty line is a chunk header.
+        self._after_empty = True
+        self._chunk_info = None
+        self._chunk_infos: dict = {}
+        self._enum_options: Any = {}
+        # The latest event at or before the start as (year, EventColumns),
+        # and for each year the events within the time range.
+        self._preceding: Optional[Tuple[int, EventColumns]] = None
+        self._within: collections.OrderedDict = collections.OrderedDict()
+        # Whether events after the start and after the end have been seen.
+        self._past_start = False
+        self._past_end = False
+        # The number of events already returned by pop_ready().
+        self._popped = 0
+
+    def feed(self, block):
+        """Parse the complete lines in block and any previous blocks.
+
+        Args:
+            block: bytes of the PB data following the previous block
+        """
+        buffer = self._partial + block if self._partial else bytes(block)
+        last_newline = buffer.rfind(NL_BYTE)
+        if last_newline < 0:
+            self._partial = buffer
+            return
+        self._partial = buffer[last_newline + 1 :]
+        self._parse_lines(split_lines(buffer, 0, last_newline + 1))
+
+    def _parse_lines(self, lines):
+        if not len(lines):
+            return
+        empty = lines.starts == lines.ends
+        # Chunks are separated by empty lines and start with a header line.
+        headers = ~empty
+        headers[0] &= self._after_empty
+        headers[1:] &= empty[:-1]
+        self._after_empty = bool(empty[-1])
+        header_rows = numpy.flatnonzero(headers)
+        # The lines before the first header continue the previous chunk.
+        segments = numpy.concatenate([[-1], header_rows, [len(lines)]])
+        for header, end in zip(segments[:-1], segments[1:]):
+            if header >= 0:
+                self._start_chunk(lines[header])
+            event_rows = numpy.arange(header + 1, end)
+            event_rows = event_rows[~empty[event_rows]]
+            if event_rows.size:
+                self._add_events(
+                    BufferLines(
+                        lines.buffer, lines.starts[event_rows], lines.ends[event_rows]
+                    )
+                )
+
+    def _start_chunk(self, line):
+        chunk_info = ee.PayloadInfo()
+        chunk_info.ParseFromString(unescape_bytes(line))
+        year = chunk_info.year  # pylint: disable=no-member
+        log.info("Year {}: new chunk".format(year))
+        # As in parse_pb_data(), chunks for the same year are merged and
+        # decoded using the header of the first one.
+        if year not in self._chunk_infos:
+            self._chunk_infos[year] = chunk_info
+            self._within[year] = []
+            if not self._enum_options:
+                self._enum_options = parse_enum_options_from_PayloadInfo(chunk_info)
+        self._chunk_info = self._chunk_infos[year]
+
+    def _add_events(self, lines):
+        year = self._chunk_info.year
+        event_type = self._chunk_info.type
+        columns = decode_lines(lines, event_type, self._wire_decoding)
+        timestamps = column_timestamps(year, columns)
+        # Split the events as parse_pb_data() does, keeping the latest
+        # event preceding the range.
+        if self._start.year > year:
+            before = len(timestamps)
+        elif self._start.year == year:
+            before = numpy.searchsorted(timestamps, self._start_time, side="right")
+        else:
+            before = 0
+        if before:
+            # Decoding the line again gives its own waveform length.
+            preceding = decode_lines(
+                lines[before - 1 : before], event_type, self._wire_decoding
+            )
+            self._preceding = (year, preceding)
+        self._past_start |= bool(before < len(timestamps))
+        if self._end.year < year:
+            self._past_end = True
+            return
+        end = len(timestamps)
+        if self._end.year == year:
+            end = before + numpy.searchsorted(
+                timestamps[before:], self._end_time, side="right"
+            )
+            self._past_end |= bool(end < len(timestamps))
+        if self._count is not None:
+            end = min(end, before + max(self._count - self._found(), 0))
+        if end <= before:
+            return
+        if end - before < len(timestamps) and not _fixed_width(columns.values):
+            # Waveforms and strings are as wide as the widest event decoded
+            # with them, so decode only the events kept, as parse_pb_data()
+            # does.
+            within = decode_lines(lines[before:end], event_type, self._wire_decoding)
+        else:
+            within = _slice_columns(columns, before, end)
+        self._within[year].append(within)
+
+    @property
+    def enum_options(self):
+        return self._enum_options
+
+    @property
+    def done(self):
+        """Whether count events have been found that later data cannot
+        change, or the end of the range has been passed, assuming that
+        chunks arrive in time order."""
+        if self._past_end:
+            return True
+        if self._count is None or not self._past_start:
+            return False
+        return self._found() >= self._count
+
+    def _found(self):
+        """The number of events returned so far or ready to be returned."""
+        return self._popped + sum(len(c.values) for _, c in self._ready_columns())
+
+    def _ready_columns(self):
+        year_columns = []
+        if self._preceding is not None:
+            year, columns = self._preceding
+            # The preceding event is excluded if it is after the end.
+            if column_timestamps(year, columns)[0] <= self._end_time:
+                year_columns.append(self._preceding)
+        for year, within in self._within.items():
+            year_columns.extend((year, columns) for columns in within)
+        return year_columns
+
+    def pop_ready(self, final=False):
+        """Remove and return the events that later data cannot change.
+
+        Until an event after the start of the time range has been found,
+        the preceding event may yet be replaced so nothing is returned.
+
+        Args:
+            final: if True, parse any incomplete last line and return all
+                the remaining events
+
+        Returns:
+            list of (year, EventColumns) in time order
+        """
+        if final and self._partial:
+            partial, self._partial = self._partial, b""
+            # If reading stopped early the partial line may be incomplete.
+            if not self.done:
+                self._parse_lines(split_lines(partial))
+        if not (final or self._past_start):
+            return []
+        ready = self._ready_columns()
+        self._popped += sum(len(c.values) for _, c in ready)
+        self._preceding = None
+        for year in self._within:
+            self._within[year] = []
+        return ready
+
+    def finish(self):
+        """Parse any remaining data and return the result.
+
+        Returns:
+            An ArchiveData object
+        """
+        year_columns = self.pop_ready(final=True)
+        return data_from_columns(
+            self._pv, year_columns, self._count, self._enum_options, self._nanoseconds
+        )
+
 
-    return data.data_from_events(pv, events, count, enum_options)
+def _read_blocks(stream, block_size, blocks, stop):
+    """Read a stream into a queue until it is exhausted or stop is set.
+
+    The queue receives each block, then an empty block at the end of the
+    stream or the exception raised while reading it.
+    """
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                blocks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        while True:
+            block = stream.read(block_size)
+            if not put(block) or not block:
+                return
+    except Exception as e:
+        put(e)
+
+
+def stream_blocks(stream, block_size=STREAM_BLOCK_SIZE):
+    """Yield the blocks of a stream, reading ahead in a separate thread.
+
+    At most STREAM_READ_AHEAD blocks are held waiting to be used, and the
+    thread stops when the generator is closed. If it is closed before the
+    end of the stream, the thread is not waited for, as it may be blocked
+    reading: it stops once that read returns, so close the stream to end
+    it promptly.
+
+    Args:
+        stream: file-like object with a read(size) method
+        block_size: number of bytes to read at a time
+    """
+    blocks: queue.Queue = queue.Queue(STREAM_READ_AHEAD)
+    stop = threading.Event()
+    reader = threading.Thread(
+        target=_read_blocks, args=(stream, block_size, blocks, stop), daemon=True
+    )
+    reader.start()
+    finished = False
+    try:
+        while True:
+            block = blocks.get()
+            if isinstance(block, Exception):
+                finished = True
+                raise block
+            if not block:
+                finished = True
+                break
+            yield block
+    finally:
+        stop.set()
+        if finished:
+            reader.join()
+
+
+def parse_pb_stream(
+    stream,
+    pv,
+    start,
+    end,
+    count=None,
+    wire_decoding=False,
+    block_size=STREAM_BLOCK_SIZE,
+    nanoseconds=False,
+):
+    """
+    Turn a stream of PB data into an ArchiveData object
+
+    The stream is read using stream_blocks() so that receiving the data
+    overlaps with parsing it using a PbStreamParser.
+
+    Args:
+        stream: file-like object with a read(size) method
+        pv: name of PV
+        start: datetime.datetime for start of window
+        end: datetime.datetime for end of window
+        count: return up to this many events
+        wire_decoding: if True, decode scalar types using aa.wire
+        block_size: number of bytes to read at a time
+        nanoseconds: if True, keep exact int64 nanosecond timestamps
+
+    Returns:
+        An ArchiveData object
+    """
+    parser = PbStreamParser(pv, start, end, count, wire_decoding, nanoseconds)
+    blocks = stream_blocks(stream, block_size)
+    try:
+        for block in blocks:
+            parser.feed(block)
+            if parser.done:
+                # Enough events have been found, so stop reading.
+                break
+    finally:
+        blocks.close()
+    return parser.finish()
 
 
 def parse_enum_options_from_PayloadInfo(
@@ -270,11 +1014,71 @@ def parse_enum_options_from_PayloadInfo(
 
 
 class PbFetcher(fetcher.AaFetcher):
-    def __init__(self, hostname, port):
-        super(PbFetcher, self).__init__(hostname, port, binary=True)
+    def __init__(
+        self,
+        hostname,
+        port,
+        wire_decoding=False,
+        session=None,
+        timeout=None,
+        window=None,
+        max_workers=fetcher.DEFAULT_MAX_WORKERS,
+        nanoseconds=False,
+    ):
+        """
+
+        Args:
+            hostname: hostname of Archiver Appliance
+            port: port to connect to
+            wire_decoding: if True, decode scalar types using aa.wire
+                rather than the protobuf library
+            session: requests Session to use. If None, create one.
+            timeout: timeout in seconds for each request
+            window: if one of PARTITION_GRANULARITIES, split requests
+                without a count at the partition boundaries and retrieve
+                the windows in parallel
+            max_workers: maximum number of windows to retrieve at once
+            nanoseconds: if True, return ArchiveData with exact int64
+                nanosecond timestamps
+        """
+        if window is not None and window not in PARTITION_GRANULARITIES:
+            raise ValueError("Window {} not valid".format(window))
+        super(PbFetcher, self).__init__(
+            hostname, port, binary=True, session=session, timeout=timeout
+        )
         self._url = "{}/retrieval/data/getData.raw".format(self._endpoint)
+        self._wire_decoding = wire_decoding
+        self._window = window
+        self._max_workers = max_workers
+        self._nanoseconds = nanoseconds
 
     def _get_values(self, pv, start, end, count, request_params):
+        boundaries = []
+        if self._window is not None and count is None:
+            boundaries = partition_boundaries(start, end, self._window)
+        if not boundaries:
+            return self._get_window(pv, start, end, count, request_params)
+        starts = [start] + boundaries
+        ends = boundaries + [end]
+
+        def get_window(window_start, window_end):
+            # Each request may modify its request_params.
+            params = None if request_params is None else dict(request_params)
+            return self._get_window(pv, window_start, window_end, None, params)
+
+        with concurrent.futures.ThreadPoolExecutor(self._max_workers) as executor:
+            windows = list(executor.map(get_window, starts, ends))
+        # Each window after the first includes the event preceding its
+        # start, which is already in the previous window.
+        parts = [windows[0]]
+        for window_start, window in zip(boundaries, windows[1:]):
+            later = window.timestamps > utils.datetime_to_epoch(window_start)
+            parts.append(window.subset(later))
+        return data.ArchiveData.concat(
+            [part for part in parts if len(part)] or parts[:1], zero_pad=True
+        )
+
+    def _get_window(self, pv, start, end, count, request_params):
         try:
             return super(PbFetcher, self)._get_values(
                 pv, start, end, count, request_params
@@ -286,43 +1090,898 @@ class PbFetcher(fetcher.AaFetcher):
             else:
                 raise e
 
+    def _iter_values(self, pv, start, end, request_params):
+        parser = PbStreamParser(
+            pv, start, end, None, self._wire_decoding, self._nanoseconds
+        )
+
+        def ready(final=False):
+            return [
+                data_from_columns(
+                    pv, [year_columns], None, parser.enum_options, self._nanoseconds
+                )
+                for year_columns in parser.pop_ready(final)
+            ]
+
+        response = self._fetch_data(pv, start, end, request_params)
+        # The response is streamed, so close it to release the connection
+        # however reading ends.
+        with response:
+            # Not found typically means no data for the PV in this time range.
+            if response.status_code == 404:
+                return
+            response.raise_for_status()
+            blocks = stream_blocks(response.raw, STREAM_BLOCK_SIZE)
+            try:
+                for block in blocks:
+                    parser.feed(block)
+                    yield from ready()
+            finally:
+                blocks.close()
+        yield from ready(final=True)
+
     def _parse_raw_data(self, response, pv, start, end, count):
-        raw_data = response.raw.read()
-        return parse_pb_data(raw_data, pv, start, end, count)
+        try:
+            return parse_pb_stream(
+                response.raw,
+                pv,
+                start,
+                end,
+                count,
+                self._wire_decoding,
+                nanoseconds=self._nanoseconds,
+            )
+        finally:
+            # The response may not have been read to the end.
+            response.close()
+
+
+class PbChunk(NamedTuple):
+    """A chunk within a PB file: a PayloadInfo header followed by events.
+
+    header is the byte offset of the header line; start and end are the
+    byte offsets of the region containing the lines of events.
+    """
+
+    info: Any
+    header: int
+    start: int
+    end: int
+
+
+class _ChunkBoundary(Exception):
+    """A PbFile assumed to have one chunk was found to have more."""
+
+
+class PbFile(object):
+    """A PB file on disk, memory-mapped so that only required lines are read.
+
+    Opening the file scans it once for the blank lines separating chunks,
+    which does not allocate memory. Events are located by binary search
+    on the byte offsets of the mapped file, so reading a time range only
+    touches the lines near its boundaries and the lines within it.
+
+    The AA writes one chunk to each file in its storage, and searches the
+    whole file as one chunk. With single_chunk, so does PbFile, avoiding
+    the scan: the file is only scanned for chunks if a blank line
+    separating them is come across.
+
+    If a PbIndex is provided, the chunks are taken from the index rather
+    than scanning the file, and the index narrows each binary search.
+
+    PbFile objects should be closed, or used as a context manager.
+    """
+
+    def __init__(self, filepath, index=None, single_chunk=False):
+        """
+
+        Args:
+            filepath: path to the PB file
+            index: PbIndex that is up to date with the file, or None
+            single_chunk: if True and there is no index, assume that the
+                file has one chunk rather than scanning it for chunks
+
+        Raises:
+            IOError: if the file cannot be opened
+        """
+        self.filepath = filepath
+        self.index = index
+        with open(filepath, "rb") as f:
+            if os.fstat(f.fileno()).st_size:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:  # Empty files cannot be mapped.
+                self._mmap = None
+        # Whether _chunks is known to contain every chunk in the file.
+        self._all_chunks = not single_chunk or index is not None
+        if index is None:
+            self._chunks = self._find_chunks(first_only=single_chunk)
+        else:
+            self._chunks = [
+                self._chunk_at(int(header), int(start), int(end))
+                for header, start, end in zip(
+                    index.chunk_headers, index.chunk_starts, index.chunk_ends
+                )
+            ]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    @property
+    def size(self):
+        return 0 if self._mmap is None else len(self._mmap)
+
+    @property
+    def chunks(self) -> List[PbChunk]:
+        """All the chunks in the file, scanning it for them if needed."""
+        self._find_all_chunks()
+        return self._chunks
+
+    def _find_all_chunks(self):
+        if not self._all_chunks:
+            log.info("Scanning {} for chunks".format(self.filepath))
+            self._chunks = self._find_chunks()
+            self._all_chunks = True
+
+    def _chunk_at(self, header, start, end) -> PbChunk:
+        chunk_info = ee.PayloadInfo()
+        header_end = self._mmap.find(NL_BYTE, header, start)
+        header_end = start if header_end < 0 else header_end
+        chunk_info.ParseFromString(unescape_bytes(self._mmap[header:header_end]))
+        return PbChunk(chunk_info, header, start, end)
+
+    def _find_chunks(self, first_only=False) -> List[PbChunk]:
+        """Scan the file for chunks.
+
+        Args:
+            first_only: if True, find only the first chunk and assume that
+                it continues to the end of the file
+        """
+        chunks = []
+        mm, size = self._mmap, self.size
+        pos = 0
+        while pos < size:
+            if mm[pos] == ord(NL_BYTE):  # Skip blank lines between chunks.
+                pos += 1
+                continue
+            header_end = mm.find(NL_BYTE, pos)
+            header_end = size if header_end < 0 else header_end
+            chunk_info = ee.PayloadInfo()
+            chunk_info.ParseFromString(unescape_bytes(mm[pos:header_end]))
+            separator = -1 if first_only else mm.find(NL_BYTE + NL_BYTE, header_end)
+            if separator < 0:
+                chunk_start = min(header_end + 1, size)
+                chunks.append(PbChunk(chunk_info, pos, chunk_start, size))
+                break
+            chunks.append(PbChunk(chunk_info, pos, header_end + 1, separator + 1))
+            pos = separator + 2
+        return chunks
+
+    def previous_line(self, chunk: PbChunk, offset: int) -> int:
+        """Returns the offset of the line before the one starting at offset."""
+        return max(self._mmap.rfind(NL_BYTE, chunk.start, offset - 1) + 1, chunk.start)
+
+    def _line(self, start: int, end: int) -> bytes:
+        """Returns the line from start to end, which must be an event."""
+        if start == end and not self._all_chunks:
+            raise _ChunkBoundary()
+        return self._mmap[start:end]
+
+    def timestamp_at(self, chunk: PbChunk, offset: int) -> float:
+        """Returns the timestamp of the event on the line starting at offset."""
+        line_end = self._mmap.find(NL_BYTE, offset, chunk.end)
+        line = self._line(offset, chunk.end if line_end < 0 else line_end)
+        return get_timestamp_from_line_function(chunk.info)(line)
+
+    def search(
+        self, chunk: PbChunk, dt: datetime.datetime, lo=None, hi=None
+    ) -> int:
+        """Find the first line in a chunk with a timestamp later than dt.
+
+        This is the equivalent of search_events() on the mapped file.
+
+        Args:
+            chunk: chunk to search
+            dt: datetime to search for
+            lo: offset of a line from which to start searching
+            hi: offset of a line at which to stop searching
+
+        Returns:
+            offset of the line, or the end of the chunk if there is none
+        """
+        target_time = utils.datetime_to_epoch(dt)
+        timestamp_from_line = get_timestamp_from_line_function(chunk.info)
+        lo = chunk.start if lo is None else lo
+        hi = chunk.end if hi is None else hi
+        while lo < hi:
+            mid = (lo + hi) // 2
+            line_start = max(self._mmap.rfind(NL_BYTE, lo, mid) + 1, lo)
+            line_end = self._mmap.find(NL_BYTE, line_start, hi)
+            line_end = hi if line_end < 0 else line_end
+            if timestamp_from_line(self._line(line_start, line_end)) > target_time:
+                hi = line_start
+            else:
+                lo = line_end + 1
+        return min(lo, hi)
+
+    def _bounds(self, chunk_number: int, dt: datetime.datetime) -> Tuple[int, int]:
+        """Offsets of lines between which to search for dt."""
+        if self.index is None:
+            chunk = self._chunks[chunk_number]
+            return chunk.start, chunk.end
+        return self.index.bounds(chunk_number, utils.datetime_to_epoch(dt))
+
+    def read_lines(self, start, end) -> List[Tuple[PbChunk, BufferLines]]:
+        """Read the lines of events between start and end from each chunk.
+
+        As for parse_pb_data(), the event preceding start is included.
+
+        Args:
+            start: datetime.datetime for start of window
+            end: datetime.datetime for end of window
+
+        Returns:
+            list of (PbChunk, BufferLines) for each chunk in the file
+        """
+        chunk_lines = []
+        for chunk, s, e in self._line_ranges(start, end):
+            # Copy the lines so that the file can be closed.
+            region = self._mmap[s:e] if e > s else b""
+            chunk_lines.append((chunk, split_lines(region)))
+        return chunk_lines
+
+    def _line_ranges(self, start, end, include_preceding=True):
+        """Each chunk and the byte offsets of its lines read by read_lines()."""
+        try:
+            return [
+                (chunk, *self._line_range(number, start, end, include_preceding))
+                for number, chunk in enumerate(self._chunks)
+            ]
+        except _ChunkBoundary:
+            self._find_all_chunks()
+            return self._line_ranges(start, end, include_preceding)
+
+    def _line_range(self, chunk_number, start, end, include_preceding=True):
+        """Byte offsets of the lines of a chunk read by read_lines()."""
+        chunk = self._chunks[chunk_number]
+        s = self.search(chunk, start, *self._bounds(chunk_number, start))
+        e_lo, e_hi = self._bounds(chunk_number, end)
+        e = self.search(chunk, end, max(s, e_lo), e_hi)
+        if include_preceding and s > chunk.start:
+            s = self.previous_line(chunk, s)
+        # The lines read must not include the end of the chunk.
+        if not self._all_chunks and self._mmap.find(NL_BYTE * 2, s - 1, e) >= 0:
+            raise _ChunkBoundary()
+        log.info("{} bytes {} to {}".format(self.filepath, s, e))
+        return s, e
+
+    def iter_lines(
+        self, start, end, block_size=STREAM_BLOCK_SIZE, include_preceding=True
+    ):
+        """Like read_lines(), but yield the lines a block at a time.
+
+        Args:
+            start: datetime.datetime for start of window
+            end: datetime.datetime for end of window
+            block_size: approximate number of bytes in each block. Blocks
+                are extended to the end of a line.
+            include_preceding: if False, omit the event preceding start
+
+        Yields:
+            (PbChunk, BufferLines) for consecutive lines of each chunk
+        """
+        for chunk, s, e in self._line_ranges(start, end, include_preceding):
+            while s < e:
+                block_end = min(s + block_size, e)
+                if block_end < e:
+                    newline = self._mmap.find(NL_BYTE, block_end - 1, e)
+                    block_end = e if newline < 0 else newline + 1
+                yield chunk, split_lines(self._mmap[s:block_end])
+                s = block_end
+
+    def preceding_line(self, dt) -> Optional[Tuple[PbChunk, BufferLines]]:
+        """Find the line of the latest event at or before dt.
+
+        The chunks are searched from the last, assuming that they are in
+        time order. If the last event of a chunk is before dt, only that
+        line is read.
+
+        Args:
+            dt: datetime.datetime to search for
+
+        Returns:
+            (PbChunk, BufferLines) containing the line, or None if no
+            event in the file is at or before dt
+        """
+        target_time = utils.datetime_to_epoch(dt)
+        try:
+            for number in reversed(range(len(self._chunks))):
+                chunk = self._chunks[number]
+                if chunk.start >= chunk.end:
+                    continue
+                last = self.previous_line(chunk, chunk.end)
+                if self.timestamp_at(chunk, last) <= target_time:
+                    s = chunk.end
+                else:
+                    s = self.search(chunk, dt, *self._bounds(number, dt))
+                if s > chunk.start:
+                    line_start = self.previous_line(chunk, s)
+                    return chunk, split_lines(self._mmap[line_start:s])
+        except _ChunkBoundary:
+            self._find_all_chunks()
+            return self.preceding_line(dt)
+        return None
+
+
+DEFAULT_INDEX_STRIDE = 1000
+INDEX_SUFFIX = ".idx"
+# Number of bytes of a PB file to scan for newlines at a time.
+INDEX_BLOCK_SIZE = 1 << 24
+
+
+def _every_nth_line(pb_file, chunk, offset, stride):
+    """Offsets of the line starting at offset and every stride-th line after.
+
+    The chunk is scanned a block at a time so that memory use does not
+    depend on the size of the file.
+    """
+    offsets = [numpy.array([offset], dtype=numpy.int64)]
+    count = 0  # Lines seen since offset.
+    while offset < chunk.end:
+        block_end = min(offset + INDEX_BLOCK_SIZE, chunk.end)
+        block = numpy.frombuffer(pb_file._mmap, numpy.uint8, block_end - offset, offset)
+        line_starts = numpy.flatnonzero(block == ord(NL_BYTE)) + offset + 1
+        del block
+        line_starts = line_starts[line_starts < chunk.end]
+        numbers = numpy.arange(count + 1, count + 1 + len(line_starts))
+        offsets.append(line_starts[numbers % stride == 0])
+        count += len(line_starts)
+        offset = block_end
+    return numpy.concatenate(offsets)
+
+
+class PbIndex(object):
+    """Index of the timestamp and byte offset of every Nth event in a PB file.
+
+    An index is stored in a sidecar file and is valid for as long as the
+    size and modification time of the PB file are unchanged. Since the AA
+    only appends to PB files, an index for a smaller version of the file
+    can be extended rather than rebuilt.
+    """
+
+    VERSION = 1
+
+    def __init__(
+        self,
+        size,
+        mtime_ns,
+        stride,
+        chunk_headers,
+        chunk_starts,
+        chunk_ends,
+        entry_chunks,
+        entry_offsets,
+        entry_timestamps,
+    ):
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.stride = stride
+        self.chunk_headers = chunk_headers
+        self.chunk_starts = chunk_starts
+        self.chunk_ends = chunk_ends
+        self.entry_chunks = entry_chunks
+        self.entry_offsets = entry_offsets
+        self.entry_timestamps = entry_timestamps
+
+    @staticmethod
+    def sidecar_path(filepath, index_dir=None):
+        """Path of the index for a PB file.
+
+        Args:
+            filepath: path to the PB file
+            index_dir: directory in which to store indices, mirroring the
+                absolute path of the PB file. If None, the index is stored
+                alongside the PB file.
+        """
+        if index_dir is None:
+            return filepath + INDEX_SUFFIX
+        relative = os.path.abspath(filepath).lstrip(os.path.sep)
+        return os.path.join(index_dir, relative + INDEX_SUFFIX)
+
+    @classmethod
+    def build(cls, pb_file, stride=DEFAULT_INDEX_STRIDE, previous=None):
+        """Index an open PB file.
+
+        Args:
+            pb_file: PbFile to index
+            stride: number of events between index entries
+            previous: index of an earlier, smaller version of the file. If
+                provided, only the part of the file appended since is read.
+
+        Returns:
+            PbIndex for the file
+        """
+        stat = os.stat(pb_file.filepath)
+        chunk_numbers, offsets, timestamps = [], [], []
+        for number, chunk in enumerate(pb_file.chunks):
+            start = chunk.start
+            if previous is not None and number < len(previous.chunk_starts):
+                # Keep the entries for this chunk, except for the last
+                # one which is where indexing resumes.
+                kept = numpy.flatnonzero(previous.entry_chunks == number)
+                if len(kept):
+                    start = int(previous.entry_offsets[kept[-1]])
+                    kept = kept[:-1]
+                chunk_numbers.append(previous.entry_chunks[kept])
+                offsets.append(previous.entry_offsets[kept])
+                timestamps.append(previous.entry_timestamps[kept])
+            if start >= chunk.end:
+                continue
+            chunk_offsets = _every_nth_line(pb_file, chunk, start, stride)
+            chunk_numbers.append(numpy.full(len(chunk_offsets), number))
+            offsets.append(chunk_offsets)
+            timestamps.append(
+                numpy.array([pb_file.timestamp_at(chunk, o) for o in chunk_offsets])
+            )
+        chunks = pb_file.chunks
+        return cls(
+            pb_file.size,
+            stat.st_mtime_ns,
+            stride,
+            numpy.array([c.header for c in chunks], dtype=numpy.int64),
+            numpy.array([c.start for c in chunks], dtype=numpy.int64),
+            numpy.array([c.end for c in chunks], dtype=numpy.int64),
+            numpy.concatenate(chunk_numbers or [[]]).astype(numpy.int64),
+            numpy.concatenate(offsets or [[]]).astype(numpy.int64),
+            numpy.concatenate(timestamps or [[]]).astype(numpy.float64),
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Load an index from a sidecar file.
+
+        Returns:
+            PbIndex, or None if the file does not exist or is not readable
+        """
+        try:
+            with numpy.load(path) as npz:
+                version, size, mtime_ns, stride = npz["meta"].tolist()
+                if version != cls.VERSION:
+                    return None
+                return cls(
+                    size,
+                    mtime_ns,
+                    stride,
+                    npz["chunk_headers"],
+                    npz["chunk_starts"],
+                    npz["chunk_ends"],
+                    npz["entry_chunks"],
+                    npz["entry_offsets"],
+                    npz["entry_timestamps"],
+                )
+        except (IOError, EOFError, ValueError, KeyError, zipfile.BadZipFile):
+            # A missing, truncated or corrupt index is rebuilt.
+            return None
+
+    def save(self, path):
+        """Save the index to a sidecar file, replacing it atomically."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            numpy.savez(
+                f,
+                meta=numpy.array(
+                    [self.VERSION, self.size, self.mtime_ns, self.stride],
+                    dtype=numpy.int64,
+                ),
+                chunk_headers=self.chunk_headers,
+                chunk_starts=self.chunk_starts,
+                chunk_ends=self.chunk_ends,
+                entry_chunks=self.entry_chunks,
+                entry_offsets=self.entry_offsets,
+                entry_timestamps=self.entry_timestamps,
+            )
+        os.replace(tmp_path, path)
+
+    def is_current(self, stat):
+        """True if the index matches the file with the given os.stat result."""
+        return self.size == stat.st_size and self.mtime_ns == stat.st_mtime_ns
+
+    def bounds(self, chunk_number, target_time):
+        """Offsets of lines between which the first event after target_time lies.
+
+        Args:
+            chunk_number: index of the chunk in the file
+            target_time: seconds since the epoch
+
+        Returns:
+            tuple (lo, hi) of line offsets to pass to PbFile.search()
+        """
+        entries = numpy.flatnonzero(self.entry_chunks == chunk_number)
+        i = numpy.searchsorted(
+            self.entry_timestamps[entries], target_time, side="right"
+        )
+        lo = self.entry_offsets[entries[i - 1]] if i > 0 else None
+        hi = self.entry_offsets[entries[i]] if i < len(entries) else None
+        return (
+            int(self.chunk_starts[chunk_number] if lo is None else lo),
+            int(self.chunk_ends[chunk_number] if hi is None else hi),
+        )
+
+
+def open_pb_file(
+    filepath, index_dir=None, stride=DEFAULT_INDEX_STRIDE, cache=None
+) -> PbFile:
+    """Open a PB file using its sidecar index, building the index if needed.
+
+    If the index is missing or out of date, it is built or extended and
+    saved. If it cannot be saved, a warning is logged and the index is
+    still used for this PbFile.
+
+    Args:
+        filepath: path to the PB file
+        index_dir: directory in which to store indices. See
+            PbIndex.sidecar_path().
+        stride: number of events between index entries
+        cache: optional dict in which to keep loaded indices, keyed by path
+
+    Returns:
+        PbFile using the index
+
+    Raises:
+        IOError: if the file cannot be opened
+    """
+    stat = os.stat(filepath)
+    index_path = PbIndex.sidecar_path(filepath, index_dir)
+    index = None if cache is None else cache.get(filepath)
+    if index is None or not index.is_current(stat):
+        index = PbIndex.load(index_path)
+    if index is not None and index.stride == stride and index.is_current(stat):
+        pb_file = PbFile(filepath, index)
+    else:
+        pb_file = PbFile(filepath)
+        previous = None
+        if index is not None and index.stride == stride:
+            # The AA only appends, so an index for a smaller file can be
+            # extended. Otherwise the file has been rewritten.
+            if index.size < pb_file.size:
+                previous = index
+        log.info("Indexing pb file {}".format(filepath))
+        index = PbIndex.build(pb_file, stride, previous)
+        pb_file.index = index
+        try:
+            index.save(index_path)
+        except OSError as e:
+            log.warning("Could not save index {}: {}".format(index_path, e))
+    if cache is not None:
+        cache[filepath] = index
+    return pb_file
+
+
+# The AA names each PB file after the start of its partition, which may
+# be a year, month, day, hour or a number of minutes.
+PARTITION_GRANULARITIES = ("year", "month", "day", "hour")
+PARTITION_PATTERN = re.compile(
+    r"^(?P<suffix>.+):(?P<year>\d{4})(?:_(?P<month>\d{2}))?"
+    r"(?:_(?P<day>\d{2}))?(?:_(?P<hour>\d{2}))?(?:_(?P<minute>\d{2}))?\.pb$"
+)
+
+
+class Partition(NamedTuple):
+    """A PB file and the time range that the AA may store in it."""
+
+    filepath: str
+    start: datetime.datetime
+    end: datetime.datetime
+
+
+def parse_partition_name(filename):
+    """Parse the name of a PB file in the AA storage.
+
+    Args:
+        filename: file name such as "XF.RBV:2019_03_07.pb"
+
+    Returns:
+        tuple of the PV suffix and the start and end of the partition, or
+        None if filename is not the name of a PB file. The file name does
+        not give the length of minute partitions so they are taken to
+        extend to the end of the hour.
+    """
+    match = PARTITION_PATTERN.match(filename)
+    if match is None:
+        return None
+    fields = match.groupdict()
+    year = int(fields["year"])
+    month = int(fields["month"] or 1)
+    day = int(fields["day"] or 1)
+    hour = int(fields["hour"] or 0)
+    minute = int(fields["minute"] or 0)
+    try:
+        start = utils.utc_datetime(year, month, day, hour, minute)
+    except ValueError:
+        return None
+    # Minute partitions are treated as hours.
+    granularity = [g for g in PARTITION_GRANULARITIES if fields[g] is not None][-1]
+    end = next_partition_start(partition_start(start, granularity), granularity)
+    return fields["suffix"], start, end
+
+
+def partition_start(dt, granularity):
+    """Return the start of the AA partition containing dt.
+
+    Args:
+        dt: timezone-aware datetime
+        granularity: one of PARTITION_GRANULARITIES
+
+    Returns:
+        UTC datetime
+    """
+    dt = dt.astimezone(pytz.utc)
+    depth = PARTITION_GRANULARITIES.index(granularity) + 1
+    fields = [dt.year, dt.month, dt.day, dt.hour][:depth]
+    return utils.utc_datetime(*(fields + [1, 1, 0][depth - 1 :]))
+
+
+def next_partition_start(dt, granularity):
+    """Return the start of the AA partition following the one starting at dt.
+
+    Args:
+        dt: UTC datetime of the start of a partition
+        granularity: one of PARTITION_GRANULARITIES
+
+    Returns:
+        UTC datetime
+    """
+    if granularity == "year":
+        return dt.replace(year=dt.year + 1)
+    elif granularity == "month":
+        return dt.replace(year=dt.year + dt.month // 12, month=dt.month % 12 + 1)
+    elif granularity == "day":
+        return dt + datetime.timedelta(days=1)
+    return dt + datetime.timedelta(hours=1)
+
+
+def partition_boundaries(start, end, granularity):
+    """Return the starts of the AA partitions strictly between start and end.
+
+    Args:
+        start: timezone-aware datetime
+        end: timezone-aware datetime
+        granularity: one of PARTITION_GRANULARITIES
+
+    Returns:
+        list of UTC datetimes
+    """
+    boundaries = []
+    boundary = next_partition_start(partition_start(start, granularity), granularity)
+    while boundary < end:
+        boundaries.append(boundary)
+        boundary = next_partition_start(boundary, granularity)
+    return boundaries
+
+
+def list_partitions(directory, suffix):
+    """Find all the PB files for a PV.
+
+    Args:
+        directory: directory containing the PB files for the PV
+        suffix: last part of the PV name, which begins each file name
+
+    Returns:
+        list of Partition sorted by start
+    """
+    try:
+        filenames = os.listdir(directory)
+    except OSError:
+        log.warning("No pb directory {} found".format(directory))
+        return []
+    partitions = []
+    for filename in filenames:
+        parsed = parse_partition_name(filename)
+        if parsed is not None and parsed[0] == suffix:
+            filepath = os.path.join(directory, filename)
+            partitions.append(Partition(filepath, parsed[1], parsed[2]))
+    partitions.sort(key=lambda partition: (partition.start, partition.end))
+    # A partition cannot extend past the start of the next one, which
+    # gives the length of minute partitions.
+    for i, partition in enumerate(partitions[:-1]):
+        next_start = partitions[i + 1].start
+        if next_start < partition.end:
+            partitions[i] = partition._replace(end=next_start)
+    return partitions
+
+
+def find_partitions(directory, suffix, start, end):
+    """Find the PB files for a PV that may contain events in [start, end].
+
+    Args:
+        directory: directory containing the PB files for the PV
+        suffix: last part of the PV name, which begins each file name
+        start: datetime of the start of the range
+        end: datetime of the end of the range
+
+    Returns:
+        list of Partition sorted by start
+    """
+    partitions = list_partitions(directory, suffix)
+    return [p for p in partitions if p.start <= end and p.end > start]
 
 
 class PbFileFetcher(fetcher.Fetcher):
-    def __init__(self, root):
+    def __init__(
+        self,
+        root,
+        wire_decoding=False,
+        use_index=False,
+        index_dir=None,
+        index_stride=DEFAULT_INDEX_STRIDE,
+        nanoseconds=False,
+    ):
+        """
+
+        Args:
+            root: root directory of the AA storage
+            wire_decoding: if True, decode scalar types using aa.wire
+                rather than the protobuf library
+            use_index: if True, use a sidecar PbIndex for each file,
+                building it on first access
+            index_dir: directory in which to store indices. If None, they
+                are stored alongside the PB files.
+            index_stride: number of events between index entries
+            nanoseconds: if True, return ArchiveData with exact int64
+                nanosecond timestamps
+        """
         self._root = root
+        self._wire_decoding = wire_decoding
+        self._use_index = use_index
+        self._index_dir = index_dir
+        self._index_stride = index_stride
+        self._nanoseconds = nanoseconds
+        self._indices = {}
 
-    def _get_pb_file(self, pv, year):
+    def _open_pb_file(self, filepath):
+        if self._use_index:
+            return open_pb_file(
+                filepath, self._index_dir, self._index_stride, self._indices
+            )
+        # The AA writes one chunk to each file.
+        return PbFile(filepath, single_chunk=True)
+
+    def _pb_location(self, pv):
+        """Return the directory containing the PB files for pv and the
+        suffix with which their names begin."""
         # Split PV on either dash or colon
         parts = re.split("[-:]", pv)
         suffix = parts.pop()
         directory = os.path.join(self._root, os.path.sep.join(parts))
+        return directory, suffix
+
+    def _get_pb_file(self, pv, year):
+        directory, suffix = self._pb_location(pv)
         filename = "{}:{}.pb".format(suffix, year)
         return os.path.join(directory, filename)
 
-    @staticmethod
-    def _read_pb_files(files, pv, start, end, count):
-        raw_data = bytearray()
-        for filepath in files:
-            try:
-                with open(filepath, "rb") as f:
-                    # Ascii code for new line character. Makes a
-                    # new 'chunk' for each file.
-                    raw_data.append(10)
-                    raw_data.extend(f.read())
-            except IOError:  # File not found. No data.
-                log.warning("No pb file {} found".format(filepath))
-        return parse_pb_data(bytes(raw_data), pv, start, end, count)
+    def _get_partitions(self, pv, start, end):
+        """Return the partitions that may contain events in [start, end]
+        and those before them, which may contain the preceding event."""
+        directory, suffix = self._pb_location(pv)
+        partitions = list_partitions(directory, suffix)
+        earlier = [p for p in partitions if p.end <= start]
+        within = [p for p in partitions if p.start <= end and p.end > start]
+        return earlier, within
+
+    def _try_open_pb_file(self, filepath) -> Optional[PbFile]:
+        try:
+            return self._open_pb_file(filepath)
+        except IOError:  # File not found. No data.
+            log.warning("No pb file {} found".format(filepath))
+            return None
+
+    def _find_preceding(self, files, start, end, pb_file=None):
+        """Find the line of the latest event at or before start.
+
+        Only the last event of each file before the one containing start
+        is read, and files are searched from the latest until the event
+        is found.
+
+        Args:
+            files: paths of PB files in time order before the one that may
+                contain start
+            start: datetime of the start of the range
+            end: datetime of the end of the range
+            pb_file: open PbFile that may contain start, searched first,
+                or None
+
+        Returns:
+            (PbChunk, BufferLines) containing the line, or None if there
+            is no such event or it is after end
+        """
+        found = None if pb_file is None else pb_file.preceding_line(start)
+        for filepath in reversed(files):
+            if found is not None:
+                break
+            earlier_file = self._try_open_pb_file(filepath)
+            if earlier_file is not None:
+                with earlier_file:
+                    found = earlier_file.preceding_line(start)
+        if found is None:
+            return None
+        chunk, lines = found
+        timestamp = get_timestamp_from_line_function(chunk.info)(lines[0])
+        return found if timestamp <= utils.datetime_to_epoch(end) else None
+
+    def _iter_lines(self, files, start, end, earlier_files=()):
+        """Yield (PbChunk, BufferLines) for the events in [start, end] and
+        the preceding event, which may be in one of earlier_files."""
+        # Only the first file can contain events before start, so it is
+        # opened once to find the preceding event and read the range.
+        first_file = self._try_open_pb_file(files[0]) if files else None
+        try:
+            preceding = self._find_preceding(earlier_files, start, end, first_file)
+            if preceding is not None:
+                yield preceding
+            if first_file is not None:
+                yield from first_file.iter_lines(start, end, include_preceding=False)
+        finally:
+            if first_file is not None:
+                first_file.close()
+        for filepath in files[1:]:
+            pb_file = self._try_open_pb_file(filepath)
+            if pb_file is not None:
+                with pb_file:
+                    yield from pb_file.iter_lines(start, end, include_preceding=False)
+
+    def _read_pb_files(self, files, pv, start, end, count, earlier_files=()):
+        year_columns = []
+        enum_options = {}
+        remaining = count
+        blocks = self._iter_lines(files, start, end, earlier_files)
+        try:
+            for chunk, lines in blocks:
+                if not enum_options:
+                    enum_options = parse_enum_options_from_PayloadInfo(chunk.info)
+                if remaining is not None:
+                    # Stop reading once there are enough events.
+                    lines = lines[:remaining]
+                    remaining -= len(lines)
+                columns = decode_lines(lines, chunk.info.type, self._wire_decoding)
+                year_columns.append((chunk.info.year, columns))
+                if remaining == 0:
+                    break
+        finally:
+            blocks.close()
+        return data_from_columns(
+            pv, year_columns, count, enum_options, self._nanoseconds
+        )
+
+    def _iter_values(self, pv, start, end, request_params):
+        earlier, within = self._get_partitions(pv, start, end)
+        enum_options = {}
+        for chunk, lines in self._iter_lines(
+            [p.filepath for p in within], start, end, [p.filepath for p in earlier]
+        ):
+            if not enum_options:
+                enum_options = parse_enum_options_from_PayloadInfo(chunk.info)
+            columns = decode_lines(lines, chunk.info.type, self._wire_decoding)
+            yield data_from_columns(
+                pv, [(chunk.info.year, columns)], None, enum_options, self._nanoseconds
+            )
 
     def _get_values(self, pv, start, end=None, count=None, request_params=None):
-        pb_files = []
-        for year in range(start.year, end.year + 1):
-            pb_files.append(self._get_pb_file(pv, year))
+        earlier, within = self._get_partitions(pv, start, end)
+        pb_files = [partition.filepath for partition in within]
+        earlier_files = [partition.filepath for partition in earlier]
         log.info("Parsing pb files {}".format(pb_files))
-        return self._read_pb_files(pb_files, pv, start, end, count)
+        return self._read_pb_files(pb_files, pv, start, end, count, earlier_files)
 
 
 def get_iso_timestamp_for_event(year, event):
@@ -1,7 +1,5 @@
 """Class for making calls to the Archiver Appliance Rest API."""
-import requests
-
-from .utils import MONITOR, SCAN, dict_to_tuples
+from .utils import MONITOR, SCAN, create_session, dict_to_tuples
 
 __all__ = ["AaRestClient"]
 
@@ -9,8 +7,26 @@ __all__ = ["AaRestClient"]
 class AaRestClient(object):
     """Class used for making calls to the AA Rest API."""
 
-    def __init__(self, hostname, port=80):
+    def __init__(self, hostname, port=80, session=None, timeout=None):
+        """
+
+        Args:
+            hostname: hostname of Archiver Appliance
+            port: port to connect to
+            session: requests Session to use, which may be shared with
+                fetchers. If None, create one.
+            timeout: timeout in seconds for each request. If None, wait
+                forever.
+        """
         self._hostname = "{}:{}".format(hostname, port)
+        self._owns_session = session is None
+        self._session = create_session() if session is None else session
+        self._timeout = timeout
+
+    def close(self):
+        """Close the connections of the session if the client created it."""
+        if self._owns_session:
+            self._session.close()
 
     def _construct_url(self, command, **kwargs):
         """Construct the appropriate URL for the AA Rest API.
@@ -41,7 +57,7 @@ class AaRestClient(object):
 
         """
         url = self._construct_url(command, **kwargs)
-        response = requests.get(url)
+        response = self._session.get(url, timeout=self._timeout)
         response.raise_for_status()
         return response.json()
 
@@ -59,7 +75,9 @@ class AaRestClient(object):
 
         """
         url = self._construct_url(command, **kwargs)
-        response = requests.post(url, payload, headers=headers)
+        response = self._session.post(
+            url, payload, headers=headers, timeout=self._timeout
+        )
         return response.json()
 
     def get_all_pvs(self, pv=None, limit=-1):
@@ -1,6 +1,17 @@
+"""Utilities for working with the AA storage on disk."""
+import argparse
+import logging
+import os
+
+from google.protobuf.message import DecodeError
+
+from . import pb, utils
+
 __all__ = [
     "ParsingError",
     "pv_name_from_path",
+    "find_pb_files",
+    "build_indices",
 ]
 
 
@@ -54,3 +65,62 @@ def pv_name_from_path(path):
         pv_name = pv_stem
 
     return pv_name
+
+
+def find_pb_files(root):
+    """Yield the path of every PB file below root, in sorted order."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith(".pb"):
+                yield os.path.join(dirpath, filename)
+
+
+def build_indices(root, index_dir=None, stride=pb.DEFAULT_INDEX_STRIDE):
+    """Build or update the sidecar PbIndex of every PB file below root.
+
+    Indices that are already up to date are left alone, so this can be
+    run periodically to keep up with the AA appending to files.
+
+    Args:
+        root: root directory of the AA storage
+        index_dir: directory in which to store indices. If None, they are
+            stored alongside the PB files.
+        stride: number of events between index entries
+
+    Returns:
+        number of PB files indexed
+    """
+    count = 0
+    for filepath in find_pb_files(root):
+        try:
+            pb.open_pb_file(filepath, index_dir, stride).close()
+            count += 1
+        except (IOError, DecodeError) as e:
+            logging.warning("Could not index {}: {}".format(filepath, e))
+    return count
+
+
+def main(argv=None):
+    """Command line entry point to prebuild indices for a storage tree."""
+    parser = argparse.ArgumentParser(
+        description="Build sidecar time indices for the PB files in AA storage."
+    )
+    parser.add_argument("root", help="root directory of the AA storage")
+    parser.add_argument(
+        "--index-dir", help="directory in which to store the indices"
+    )
+    parser.add_argument(
+        "--stride",
+        type=int,
+        default=pb.DEFAULT_INDEX_STRIDE,
+        help="number of events between index entries",
+    )
+    args = parser.parse_args(argv)
+    utils.set_up_logging(level=logging.INFO)
+    count = build_indices(args.root, args.index_dir, args.stride)
+    print("Indexed {} pb files".format(count))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,10 @@ import logging
 from datetime import datetime
 from typing import Dict, List, Tuple
 
+import numpy
 import pytz
+import requests
+import requests.adapters
 import tzlocal
 
 __all__ = [
@@ -13,12 +16,17 @@ __all__ = [
     "utc_now",
     "EPOCH",
     "datetime_to_epoch",
+    "datetime_to_epoch_ns",
     "epoch_to_datetime",
+    "epoch_to_datetime64",
+    "epoch_to_datetimes",
     "add_local_timezone",
     "year_timestamp",
     "print_raw_bytes",
     "binary_search",
     "dict_to_tuples",
+    "DEFAULT_POOL_SIZE",
+    "create_session",
 ]
 
 
@@ -38,10 +46,80 @@ def datetime_to_epoch(dt):
     return int((dt - EPOCH).total_seconds())
 
 
+def datetime_to_epoch_ns(dt):
+    """Convert a timezone-aware datetime to int nanoseconds since the epoch."""
+    delta = dt - EPOCH
+    seconds = delta.days * 86400 + delta.seconds
+    return seconds * 1000000000 + delta.microseconds * 1000
+
+
 def epoch_to_datetime(secs):
     return datetime.fromtimestamp(secs, tz=pytz.utc)
 
 
+def epoch_to_datetime64(secs, unit="ns"):
+    """Convert an array of seconds since the epoch to numpy datetime64.
+
+    The whole and fractional seconds are converted separately so that
+    no precision is lost for present-day timestamps. NaN becomes NaT.
+
+    Args:
+        secs: array of seconds since the epoch
+        unit: "ns" or "us"
+
+    Returns:
+        numpy datetime64 array in UTC
+    """
+    per_second = {"ns": 1000000000, "us": 1000000}[unit]
+    secs = numpy.asarray(secs, dtype=numpy.float64)
+    missing = numpy.isnan(secs)
+    secs = numpy.where(missing, 0, secs)
+    whole = numpy.floor(secs)
+    fraction = numpy.round((secs - whole) * per_second).astype(numpy.int64)
+    ticks = whole.astype(numpy.int64) * per_second + fraction
+    ticks[missing] = numpy.iinfo(numpy.int64).min  # NaT
+    return ticks.view("datetime64[{}]".format(unit))
+
+
+def epoch_to_datetimes(secs, tz):
+    """Convert an array of seconds since the epoch to aware datetimes.
+
+    The result is the same as calling epoch_to_datetime(s).astimezone(tz)
+    for each element, but where there are many events per minute the
+    timezone is only consulted once for each distinct minute. This
+    assumes that UTC offsets only change on whole minutes.
+
+    Args:
+        secs: array of seconds since the epoch
+        tz: the timezone for the datetime objects
+
+    Returns:
+        numpy array of datetime objects
+    """
+    utc_times = epoch_to_datetime64(secs, "us")
+    minutes, inverse = numpy.unique(
+        utc_times.astype("datetime64[m]"), return_inverse=True
+    )
+    if len(minutes) * 4 > len(utc_times):
+        # Too few events per minute to gain anything.
+        result = numpy.empty(len(utc_times), dtype=object)
+        result[:] = [epoch_to_datetime(s).astimezone(tz) for s in secs]
+        return result
+    offsets = numpy.empty(len(minutes), dtype="timedelta64[us]")
+    tzinfos = []
+    for i, minute in enumerate(minutes.astype(object)):
+        local = pytz.utc.localize(minute).astimezone(tz)
+        offsets[i] = local.utcoffset()
+        tzinfos.append((local.tzinfo, local.fold))
+    local_times = (utc_times + offsets[inverse.reshape(-1)]).astype(object)
+    result = numpy.empty(len(local_times), dtype=object)
+    result[:] = [
+        dt.replace(tzinfo=tzinfos[i][0], fold=tzinfos[i][1])
+        for dt, i in zip(local_times, inverse.reshape(-1).tolist())
+    ]
+    return result
+
+
 def add_local_timezone(dt):
     """Add the local timezone to a naive datetime.
 
@@ -135,3 +213,34 @@ def dict_to_tuples(input_dict: Dict[str, str]) -> List[Tuple[str, str]]:
         List of tuples (key, value) sorted alphabetically by key
     """
     return [(key, input_dict[key]) for key in sorted(input_dict.keys())]
+
+
+# Number of connections kept open to each host by create_session().
+DEFAULT_POOL_SIZE = 10
+
+
+def create_session(pool_size=DEFAULT_POOL_SIZE, keep_alive=True, max_retries=0):
+    """Create a requests Session that reuses its connections.
+
+    A session may be shared between fetchers and clients, including from
+    different threads, to avoid setting up a new TCP connection for each
+    request.
+
+    Args:
+        pool_size: maximum number of connections to keep open to each host
+        keep_alive: if False, ask the server to close each connection
+            after the response
+        max_retries: number of times to retry failed connections
+
+    Returns:
+        requests.Session
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=max_retries
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if not keep_alive:
+        session.headers["Connection"] = "close"
+    return session
@@ -0,0 +1,212 @@
+"""Decode scalar PB events directly from the protobuf wire format.
+
+Parsing each event with the Google Protobuf library costs a few
+microseconds per event, even with the C++ backend. The scalar event
+messages defined in EPICSEvent.proto have a simple, fixed layout, so
+instead of parsing them one by one this module walks the fields of every
+event in a chunk at the same time using numpy arrays of byte positions.
+
+The protobuf wire format is described here:
+https://developers.google.com/protocol-buffers/docs/encoding
+
+Only the fields needed to build an ArchiveData object are decoded. Any
+event containing something that this module does not handle, such as the
+fieldvalues field, is reported back to the caller so that it can be
+parsed with the Google Protobuf library instead.
+
+"""
+from typing import NamedTuple
+
+import numpy
+
+__all__ = [
+    "WIRE_TYPES",
+    "WireColumns",
+    "decode_scalar_events",
+]
+
+
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+FIXED32 = 5
+
+FIELD_SECONDSINTOYEAR = 1
+FIELD_NANO = 2
+FIELD_VAL = 3
+FIELD_SEVERITY = 4
+FIELD_STATUS = 5
+FIELD_REPEATCOUNT = 6
+FIELD_FIELDACTUALCHANGE = 8
+
+# The longest possible varint.
+MAX_VARINT_LENGTH = 10
+
+# Scalar types that can be decoded, as keys of pb.TYPE_MAPPINGS. Values
+# are the wire type of the val field, the numpy dtype in which the value
+# is stored on the wire and the numpy dtype of the decoded values.
+WIRE_TYPES = {
+    1: (VARINT, "sint32", numpy.int64),  # ScalarShort
+    2: (FIXED32, "<f4", numpy.float64),  # ScalarFloat
+    3: (VARINT, "sint32", numpy.int64),  # ScalarEnum
+    4: (LENGTH_DELIMITED, "u1", numpy.uint8),  # ScalarByte
+    5: (FIXED32, "<i4", numpy.int64),  # ScalarInt
+    6: (FIXED64, "<f8", numpy.float64),  # ScalarDouble
+}
+
+
+class WireColumns(NamedTuple):
+    """The fields of a sequence of scalar events, one array per field.
+
+    Where unhandled is True the event could not be decoded and the other
+    arrays contain zeros for that event.
+    """
+
+    values: numpy.ndarray
+    secondsintoyear: numpy.ndarray
+    nanos: numpy.ndarray
+    severities: numpy.ndarray
+    statuses: numpy.ndarray
+    unhandled: numpy.ndarray
+
+
+def _read_varints(buf, pos):
+    """Read one varint starting at each position in buf.
+
+    Args:
+        buf: numpy uint8 array, padded so that reads cannot overrun it
+        pos: numpy int64 array of positions
+
+    Returns:
+        tuple of uint64 array of values and int64 array of the positions
+        following each varint. Malformed varints have a position of -1.
+    """
+    values = numpy.zeros(pos.shape, dtype=numpy.uint64)
+    new_pos = numpy.full(pos.shape, -1, dtype=numpy.int64)
+    todo = numpy.arange(len(pos))
+    for i in range(MAX_VARINT_LENGTH):
+        byte = buf[pos[todo] + i].astype(numpy.uint64)
+        values[todo] |= (byte & numpy.uint64(0x7F)) << numpy.uint64(7 * i)
+        more = byte >= 0x80
+        done = todo[~more]
+        new_pos[done] = pos[done] + i + 1
+        todo = todo[more]
+        if not todo.size:
+            break
+    return values, new_pos
+
+
+def _read_fixed(buf, pos, dtype):
+    """Read one little-endian fixed-width number at each position in buf."""
+    dtype = numpy.dtype(dtype)
+    offsets = numpy.arange(dtype.itemsize)
+    raw = buf[pos[:, numpy.newaxis] + offsets]
+    return raw.view(dtype).reshape(-1), pos + dtype.itemsize
+
+
+def _to_int32(values):
+    """Interpret varints as int32 (negative numbers use ten bytes)."""
+    return values.astype(numpy.int64).astype(numpy.int32)
+
+
+def _zigzag_decode(values):
+    """Interpret varints as sint32."""
+    as_int = values.astype(numpy.int64)
+    return ((as_int >> 1) ^ -(as_int & 1)).astype(numpy.int32)
+
+
+def decode_scalar_events(buffer, starts, ends, event_type):
+    """Decode unescaped scalar events stored contiguously in a buffer.
+
+    Args:
+        buffer: bytes-like object containing the unescaped events
+        starts: numpy int64 array of the offset at which each event starts
+        ends: numpy int64 array of the offset at which each event ends
+        event_type: the type of the events as key of WIRE_TYPES
+
+    Returns:
+        WireColumns with one entry for each event
+    """
+    val_wire_type, wire_dtype, dtype = WIRE_TYPES[event_type]
+    n = len(starts)
+    # Copy only the part of the buffer containing the events, padded so
+    # that reading a malformed event cannot overrun it.
+    lo = int(numpy.min(starts)) if n else 0
+    hi = int(numpy.max(ends)) if n else 0
+    padded = bytes(buffer[lo:hi]) + bytes(MAX_VARINT_LENGTH)
+    buf = numpy.frombuffer(padded, numpy.uint8)
+    pos = numpy.array(starts, dtype=numpy.int64) - lo
+    ends = numpy.asarray(ends, dtype=numpy.int64) - lo
+    values = numpy.zeros((n,), dtype=dtype)
+    secondsintoyear = numpy.zeros((n,), dtype=numpy.int64)
+    nanos = numpy.zeros((n,), dtype=numpy.int64)
+    severities = numpy.zeros((n,), dtype=numpy.int32)
+    statuses = numpy.zeros((n,), dtype=numpy.int32)
+    unhandled = numpy.zeros((n,), dtype=bool)
+
+    # Each pass decodes one field of every event that has not finished.
+    active = numpy.flatnonzero(pos < ends)
+    while active.size:
+        tags, field_pos = _read_varints(buf, pos[active])
+        field_numbers = tags >> numpy.uint64(3)
+        wire_types = tags & numpy.uint64(7)
+        next_pos = numpy.full(active.shape, -1, dtype=numpy.int64)
+
+        varint = wire_types == VARINT
+        if numpy.any(varint):
+            ints, after = _read_varints(buf, field_pos[varint])
+            next_pos[varint] = after
+            numbers = field_numbers[varint]
+            rows = active[varint]
+            for field, target, convert in (
+                (FIELD_SECONDSINTOYEAR, secondsintoyear, None),
+                (FIELD_NANO, nanos, None),
+                (FIELD_SEVERITY, severities, _to_int32),
+                (FIELD_STATUS, statuses, _to_int32),
+            ):
+                match = numbers == field
+                target[rows[match]] = (
+                    ints[match] if convert is None else convert(ints[match])
+                )
+            if val_wire_type == VARINT:
+                match = numbers == FIELD_VAL
+                values[rows[match]] = _zigzag_decode(ints[match])
+            # Other varint fields are valid but not needed.
+            known = numpy.isin(
+                numbers,
+                (
+                    FIELD_SECONDSINTOYEAR,
+                    FIELD_NANO,
+                    FIELD_SEVERITY,
+                    FIELD_STATUS,
+                    FIELD_REPEATCOUNT,
+                    FIELD_FIELDACTUALCHANGE,
+                ),
+            )
+            if val_wire_type == VARINT:
+                known |= numbers == FIELD_VAL
+            next_pos[numpy.flatnonzero(varint)[~known]] = -1
+
+        val = (field_numbers == FIELD_VAL) & (wire_types == val_wire_type)
+        if val_wire_type != VARINT and numpy.any(val):
+            rows = active[val]
+            if val_wire_type == LENGTH_DELIMITED:
+                lengths, data_pos = _read_varints(buf, field_pos[val])
+                lengths = lengths.astype(numpy.int64)
+                # Only single bytes fit into a scalar array.
+                single = lengths == 1
+                values[rows[single]] = buf[data_pos[single]]
+                after = data_pos + lengths
+                after[(lengths > 1) | (data_pos < 0)] = -1
+            else:
+                decoded, after = _read_fixed(buf, field_pos[val], wire_dtype)
+                values[rows] = decoded
+            next_pos[val] = after
+
+        # Anything else is left to the protobuf library.
+        failed = (next_pos < 0) | (next_pos > ends[active]) | (field_pos < 0)
+        unhandled[active[failed]] = True
+        pos[active] = next_pos
+        active = active[~failed & (next_pos < ends[active])]
+
+    return WireColumns(values, secondsintoyear, nanos, severities, statuses, unhandled)
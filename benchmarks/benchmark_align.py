@@ -0,0 +1,70 @@
+"""Benchmark aligning many PVs onto a common time base.
+
+The hand-written way to do this walks the union of timestamps in Python,
+keeping the last value of each PV. aa.align does one searchsorted per PV.
+
+Run with:
+
+    python benchmarks/benchmark_align.py [number of PVs] [events per PV]
+"""
+import sys
+import timeit
+
+import numpy
+
+from aa import align, data
+
+
+def make_pvs(n_pvs, n_events):
+    rng = numpy.random.default_rng(0)
+    pvs = []
+    for i in range(n_pvs):
+        timestamps = numpy.sort(rng.uniform(0, 86400, n_events))
+        pvs.append(
+            data.ArchiveData(
+                "BENCH-PV-{:03d}:SIGNAL".format(i),
+                rng.normal(size=n_events),
+                timestamps,
+                numpy.zeros((n_events,)),
+            )
+        )
+    return pvs
+
+
+def align_in_python(pvs):
+    """Merge the events of all PVs in time order, holding the last values.
+
+    Returns:
+        array with one row per timestamp and one column per PV
+    """
+    events = sorted(
+        (timestamp, i, value)
+        for i, pv in enumerate(pvs)
+        for timestamp, value in zip(pv.timestamps.tolist(), pv.values[:, 0].tolist())
+    )
+    last = [float("nan")] * len(pvs)
+    rows = {}
+    for timestamp, i, value in events:
+        last[i] = value
+        rows[timestamp] = list(last)
+    return numpy.array(list(rows.values()))
+
+
+def time_call(label, f, repeat=3):
+    best = min(timeit.repeat(f, number=1, repeat=repeat))
+    print("{:<30} {:8.3f} s".format(label, best))
+    return best
+
+
+def main(n_pvs=100, n_events=1000):
+    pvs = make_pvs(n_pvs, n_events)
+    print("Aligning {} PVs of {} events".format(n_pvs, n_events))
+    before = time_call("Python merge", lambda: align_in_python(pvs))
+    after = time_call("align.align()", lambda: align.align(pvs).to_array())
+    print("Speedup: {:.1f}x".format(before / after))
+    grid = align.union_timestamps(pvs)[:: max(n_pvs, 1)]
+    time_call("align.align() onto grid", lambda: align.align(pvs, grid).to_array())
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
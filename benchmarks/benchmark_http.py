@@ -0,0 +1,84 @@
+"""Benchmark retrievals with and without a pooled HTTP session.
+
+A stub Archiver Appliance is started on localhost which answers every
+request with the same small PB payload.
+
+Run with:
+
+    python benchmarks/benchmark_http.py [number of requests]
+"""
+import http.server
+import sys
+import threading
+import time
+
+import requests
+
+from aa import epics_event_pb2 as ee
+from aa import pb, utils
+
+PV = "BENCH-PV-01:SIGNAL"
+START = utils.utc_datetime(2019, 1, 1)
+END = utils.utc_datetime(2019, 1, 2)
+
+
+def make_payload():
+    info = ee.PayloadInfo()
+    info.type = 6
+    info.pvname = PV
+    info.year = 2019
+    event = ee.ScalarDouble()
+    event.secondsintoyear = 10
+    event.nano = 0
+    event.val = 1.0
+    lines = [info.SerializeToString(), event.SerializeToString()]
+    return b"\n".join(pb.escape_bytes(line) for line in lines) + b"\n"
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    # HTTP/1.1 allows the client to keep the connection open.
+    protocol_version = "HTTP/1.1"
+    # Otherwise the headers and body are delayed on a kept-alive connection.
+    disable_nagle_algorithm = True
+    payload = make_payload()
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.payload)))
+        self.end_headers()
+        self.wfile.write(self.payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class UnpooledPbFetcher(pb.PbFetcher):
+    """Open a new connection for every request, as aa used to."""
+
+    def _fetch_data(self, pv, start, end, request_params):
+        url = self._construct_url(pv, start, end, request_params)
+        return requests.get(url, stream=self._binary)
+
+
+def requests_per_second(fetcher, n_requests):
+    start = time.perf_counter()
+    for _ in range(n_requests):
+        fetcher.get_values(PV, START, END)
+    return n_requests / (time.perf_counter() - start)
+
+
+def main(n_requests=2000):
+    server = http.server.ThreadingHTTPServer(("localhost", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    print("Retrieving {} times from stub server on port {}".format(n_requests, port))
+    unpooled = requests_per_second(UnpooledPbFetcher("localhost", port), n_requests)
+    print("{:<30} {:8.0f} requests/s".format("new connection each time", unpooled))
+    pooled = requests_per_second(pb.PbFetcher("localhost", port), n_requests)
+    print("{:<30} {:8.0f} requests/s".format("pooled session", pooled))
+    print("Speedup: {:.1f}x".format(pooled / unpooled))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
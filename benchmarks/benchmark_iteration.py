@@ -0,0 +1,89 @@
+"""Benchmark iterating over the events of an ArchiveData object.
+
+Iterating used to build an ArchiveEvent, with its own attribute dict and
+a copy of each field, for every event. Rows now read the arrays of the
+ArchiveData object only when a field is accessed.
+
+Run with:
+
+    python benchmarks/benchmark_iteration.py [number of events]
+"""
+import sys
+import timeit
+import tracemalloc
+
+import numpy
+
+from aa import data
+
+PV = "BENCH-PV-01:SIGNAL"
+
+
+class DictArchiveEvent(object):
+    """An ArchiveEvent as it was before it had __slots__."""
+
+    def __init__(self, pv, value, timestamp, severity, enum_options):
+        self._pv = pv
+        self._value = value
+        self._timestamp = timestamp
+        self._severity = severity
+        self._enum_options = enum_options
+
+    @property
+    def timestamp(self):
+        return self._timestamp
+
+
+def iterate_by_copy(archive_data):
+    """Iterate as ArchiveData.__iter__ used to."""
+    for value, timestamp, severity in zip(
+        archive_data.values, archive_data.timestamps, archive_data.severities
+    ):
+        yield DictArchiveEvent(
+            archive_data.pv, value, timestamp, severity, archive_data.enum_options
+        )
+
+
+def sum_timestamps(events):
+    return sum(event.timestamp for event in events)
+
+
+def time_call(label, f, repeat=3):
+    best = min(timeit.repeat(f, number=1, repeat=repeat))
+    print("{:<30} {:8.3f} s".format(label, best))
+    return best
+
+
+def peak_memory(f):
+    """Peak memory in MB allocated while holding a list of all the events."""
+    tracemalloc.start()
+    events = list(f())
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del events
+    return peak / 1e6
+
+
+def main(n_events=1000000):
+    archive_data = data.ArchiveData(
+        PV,
+        numpy.arange(n_events, dtype=numpy.float64),
+        numpy.arange(n_events, dtype=numpy.float64),
+        numpy.zeros((n_events,)),
+    )
+    print("Iterating over {} events".format(n_events))
+    before = time_call(
+        "ArchiveEvent per event", lambda: sum_timestamps(iterate_by_copy(archive_data))
+    )
+    after = time_call("ArchiveData rows", lambda: sum_timestamps(archive_data))
+    print("Speedup: {:.1f}x".format(before / after))
+    print(
+        "Memory for list of events: {:.0f} MB before, {:.0f} MB after".format(
+            peak_memory(lambda: iterate_by_copy(archive_data)),
+            peak_memory(lambda: iter(archive_data)),
+        )
+    )
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,109 @@
+"""Benchmarks for parsing PB data.
+
+parse_pb_data decodes each event with the protobuf library, so its
+speedup over building an ArchiveEvent per line depends on the protobuf
+backend, which is printed. With the pure-python backend, parsing each
+message dominates and the speedup is small. Wire decoding
+does not use the protobuf library for scalar events, so its speedup does
+not depend on the backend.
+
+Run with:
+
+    python benchmarks/benchmark_pb.py [number of events]
+"""
+import io
+import sys
+import timeit
+
+from google.protobuf.internal import api_implementation
+
+from aa import data
+from aa import epics_event_pb2 as ee
+from aa import pb, utils
+
+PV = "BENCH-PV-01:SIGNAL"
+YEAR = 2019
+START = utils.utc_datetime(YEAR, 1, 1)
+END = utils.utc_datetime(YEAR + 1, 1, 1)
+
+
+def make_raw_data(n_events):
+    """Generate PB data containing n_events ScalarDouble events."""
+    info = ee.PayloadInfo()
+    info.type = 6
+    info.pvname = PV
+    info.year = YEAR
+    lines = [pb.escape_bytes(info.SerializeToString())]
+    event = ee.ScalarDouble()
+    for i in range(n_events):
+        event.secondsintoyear = i // 10
+        event.nano = (i % 10) * 100000000
+        event.val = i * 0.5
+        event.severity = i % 3
+        lines.append(pb.escape_bytes(event.SerializeToString()))
+    return b"\n".join(lines)
+
+
+def parse_by_event(raw_data):
+    """Parse PB data one ArchiveEvent at a time, for comparison."""
+    events = []
+    for year, (chunk_info, lines) in pb.break_up_chunks(raw_data).items():
+        for line in lines:
+            events.append(pb.event_from_line(line, PV, year, chunk_info.type))
+    return data.data_from_events(PV, events)
+
+
+def unescape_by_line(buffer):
+    """Unescape each line of a chunk separately, for comparison."""
+    lines = []
+    for line in buffer.split(b"\n"):
+        for key, value in pb.PB_REPLACEMENTS_UNESCAPING.items():
+            line = line.replace(key, value)
+        lines.append(line)
+    return lines
+
+
+def time_call(label, f, repeat=3):
+    best = min(timeit.repeat(f, number=1, repeat=repeat))
+    print("{:<30} {:8.3f} s".format(label, best))
+    return best
+
+
+def main(n_events=1000000):
+    raw_data = make_raw_data(n_events)
+    print("Parsing {} ScalarDouble events".format(n_events))
+    print("protobuf backend: {}".format(api_implementation.Type()))
+    by_event = time_call("ArchiveEvent per line", lambda: parse_by_event(raw_data))
+    columnar = time_call(
+        "parse_pb_data", lambda: pb.parse_pb_data(raw_data, PV, START, END)
+    )
+    wire_decoding = time_call(
+        "parse_pb_data (wire decoding)",
+        lambda: pb.parse_pb_data(raw_data, PV, START, END, wire_decoding=True),
+    )
+    time_call(
+        "parse_pb_stream",
+        lambda: pb.parse_pb_stream(io.BytesIO(raw_data), PV, START, END),
+    )
+    print(
+        "Speedup: {:.1f}x (depends on the protobuf backend)".format(
+            by_event / columnar
+        )
+    )
+    print("Speedup with wire decoding: {:.1f}x".format(by_event / wire_decoding))
+    # Only one line in a hundred contains an escape sequence.
+    escaped = [b"\x08\x01\x10\x02\x19" + bytes(8)] * n_events
+    escaped[::100] = [b"\x08\x01\x10\x02\x19\x1B\x02" + bytes(7)] * len(
+        escaped[::100]
+    )
+    buffer = b"\n".join(escaped)
+    print("Unescaping {} lines".format(n_events))
+    by_line = time_call("unescape each line", lambda: unescape_by_line(buffer))
+    by_chunk = time_call(
+        "unescape_lines", lambda: list(pb.unescape_lines(pb.split_lines(buffer)))
+    )
+    print("Speedup: {:.1f}x".format(by_line / by_chunk))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
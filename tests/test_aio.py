@@ -0,0 +1,164 @@
+import asyncio
+import json
+
+import numpy
+import pytest
+import utils as testutils
+
+from aa import aio, js, pb, utils
+
+PV = "dummy"
+
+
+class FakeResponse(object):
+    def __init__(self, body, status=200):
+        self._body = body
+        self.status = status
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise IOError(self.status)
+
+    async def read(self):
+        await asyncio.sleep(0)
+        return self._body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class FakeSession(object):
+    """Stand-in for an aiohttp ClientSession returning canned responses."""
+
+    def __init__(self, respond):
+        self._respond = respond
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def _request(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs))
+        session = self
+
+        class Request(FakeResponse):
+            async def __aenter__(self):
+                session.in_flight += 1
+                session.max_in_flight = max(session.max_in_flight, session.in_flight)
+                await asyncio.sleep(0.01)
+                session.in_flight -= 1
+                return session._respond(url)
+
+        return Request(None)
+
+    def get(self, url, **kwargs):
+        return self._request("get", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self._request("post", url, **kwargs)
+
+
+def pb_body(url):
+    events = [(i * 60, 0, float(i), 0) for i in range(100)]
+    return FakeResponse(testutils.make_pb_data(2018, 6, events))
+
+
+def test_AsyncPbFetcher_get_values_matches_parse_pb_data(jan_2018):
+    session = FakeSession(pb_body)
+    fetcher = aio.AsyncPbFetcher("dummy.com", 8000, session=session)
+    end = utils.utc_datetime(2018, 1, 1, 1)
+    result = asyncio.run(fetcher.get_values(PV, jan_2018, end))
+    expected = pb.parse_pb_data(pb_body(None)._body, PV, jan_2018, end)
+    assert result == expected
+    sync_fetcher = pb.PbFetcher("dummy.com", 8000)
+    expected_url = sync_fetcher._construct_url(PV, jan_2018, end, None)
+    assert session.requests == [("get", expected_url, {})]
+
+
+def test_AsyncPbFetcher_returns_empty_data_if_not_found(jan_2018, empty_data):
+    session = FakeSession(lambda url: FakeResponse(b"", status=404))
+    fetcher = aio.AsyncPbFetcher("dummy.com", 8000, session=session)
+    assert asyncio.run(fetcher.get_values(PV, jan_2018, jan_2018)) == empty_data
+
+
+def test_AsyncJsonFetcher_get_values_matches_parse_json_data(jan_2018):
+    with open(testutils.get_data_filepath("event.json"), "rb") as f:
+        body = f.read()
+    session = FakeSession(lambda url: FakeResponse(body))
+    fetcher = aio.AsyncJsonFetcher("dummy.com", 8000, session=session)
+    result = asyncio.run(fetcher.get_values(PV, jan_2018, jan_2018))
+    assert result == js.parse_json_data(json.loads(body), PV)
+
+
+def test_AsyncAaFetcher_get_values_many_limits_requests_in_flight(jan_2018):
+    def respond(url):
+        if "pv=bad" in url:
+            return FakeResponse(b"", status=500)
+        return pb_body(url)
+
+    session = FakeSession(respond)
+    fetcher = aio.AsyncPbFetcher("dummy.com", 8000, session=session)
+    pvs = ["pv{}".format(i) for i in range(20)] + ["bad"]
+    results = asyncio.run(
+        fetcher.get_values_many(pvs, jan_2018, jan_2018, max_concurrency=5)
+    )
+    assert list(results) == pvs[:-1]
+    assert list(results.errors) == ["bad"]
+    assert session.max_in_flight == 5
+
+
+def test_AsyncAaFetcher_get_values_many_raises_if_a_request_is_cancelled(jan_2018):
+    def respond(url):
+        if "pv=cancelled" in url:
+            raise asyncio.CancelledError()
+        return pb_body(url)
+
+    fetcher = aio.AsyncPbFetcher("dummy.com", 8000, session=FakeSession(respond))
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(fetcher.get_values_many(["a", "cancelled"], jan_2018, jan_2018))
+
+
+def test_AsyncAaRestClient_methods_return_awaitables():
+    body = json.dumps([{"pvName": "a"}, {"pvName": "b"}]).encode()
+    session = FakeSession(lambda url: FakeResponse(body))
+    client = aio.AsyncAaRestClient("host", session=session)
+    assert asyncio.run(client.get_never_connected_pvs()) == ["a", "b"]
+    asyncio.run(client.get_pv_statuses(["a", "b"]))
+    method, url, kwargs = session.requests[-1]
+    assert method == "post"
+    assert url == "http://host:80/mgmt/bpl/getPVStatus"
+    assert kwargs["data"] == "pv=a,b"
+
+
+def test_AsyncAaFetcher_requires_aiohttp_without_session():
+    if aio.aiohttp is not None:
+        pytest.skip("aiohttp is installed")
+    with pytest.raises(ImportError):
+        aio.AsyncPbFetcher("dummy.com", 8000)
+
+
+def test_AsyncAaFetcher_get_events_at_posts_pvs(jan_2018):
+    events = {"a": {"secs": 10, "nanos": 0, "val": [1, 2], "severity": 0}}
+    session = FakeSession(lambda url: FakeResponse(json.dumps(events).encode()))
+    fetcher = aio.AsyncPbFetcher("dummy.com", 8000, session=session)
+    snapshot = asyncio.run(fetcher.get_events_at(["a", "b"], jan_2018))
+    assert session.requests[0][0] == "post"
+    assert json.loads(session.requests[0][2]["data"]) == ["a", "b"]
+    numpy.testing.assert_equal(snapshot.values, [[1, 2], [0, 0]])
+    numpy.testing.assert_equal(snapshot.found, [True, False])
+
+
+def test_AsyncAaFetcher_get_events_at_falls_back_if_not_supported(jan_2018):
+    def respond(url):
+        if "getDataAtTime" in url:
+            return FakeResponse(b"", status=404)
+        return pb_body(url)
+
+    session = FakeSession(respond)
+    fetcher = aio.AsyncPbFetcher("dummy.com", 8000, session=session)
+    end = utils.utc_datetime(2018, 1, 1, 0, 30)
+    snapshot = asyncio.run(fetcher.get_events_at(["a", "b"], end))
+    assert [method for method, _, _ in session.requests] == ["post", "get", "get"]
+    numpy.testing.assert_equal(snapshot.values[:, 0], [30.0, 30.0])
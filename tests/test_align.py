@@ -0,0 +1,96 @@
+import numpy
+import pytest
+
+from aa import align, data, fetcher, utils
+
+
+def make_data(pv, timestamps, values, severities=None):
+    timestamps = numpy.array(timestamps, dtype=numpy.float64)
+    if severities is None:
+        severities = numpy.zeros(timestamps.shape)
+    severities = numpy.array(severities, dtype=numpy.float64)
+    return data.ArchiveData(pv, numpy.array(values), timestamps, severities)
+
+
+@pytest.fixture
+def pv_data():
+    return [
+        make_data("a", [10, 20, 30], [1.0, 2.0, 3.0], [0, 1, 2]),
+        make_data("b", [15, 25], [[10, 11], [20, 21]]),
+    ]
+
+
+def test_union_timestamps_merges_and_sorts(pv_data):
+    result = align.union_timestamps(pv_data)
+    numpy.testing.assert_equal(result, [10, 15, 20, 25, 30])
+    assert not len(align.union_timestamps([]))
+
+
+def test_grid_timestamps_includes_end():
+    start = utils.utc_datetime(2020, 1, 1)
+    end = utils.utc_datetime(2020, 1, 1, 0, 0, 10)
+    result = align.grid_timestamps(start, end, 2.5)
+    expected = utils.datetime_to_epoch(start) + numpy.arange(0, 10.1, 2.5)
+    numpy.testing.assert_equal(result, expected)
+    assert not len(align.grid_timestamps(end, start, 1))
+
+
+def test_align_asof_holds_last_value(pv_data):
+    result = align.align(pv_data)
+    numpy.testing.assert_equal(result.timestamps, [10, 15, 20, 25, 30])
+    numpy.testing.assert_equal(result["a"][:, 0], [1, 1, 2, 2, 3])
+    numpy.testing.assert_equal(result.severities["a"], [0, 0, 1, 1, 2])
+    expected = [[0, 0], [10, 11], [10, 11], [20, 21], [20, 21]]
+    numpy.testing.assert_equal(result["b"], expected)
+    numpy.testing.assert_equal(result.valid["b"], [False, True, True, True, True])
+
+
+def test_align_nearest_uses_closest_event(pv_data):
+    result = align.align(pv_data, [5, 14, 16, 100], align.NEAREST)
+    numpy.testing.assert_equal(result["a"][:, 0], [1, 1, 2, 3])
+    numpy.testing.assert_equal(result["b"][:, 0], [10, 10, 10, 20])
+    assert all(result.valid["a"])
+
+
+def test_align_linear_interpolates_between_events(pv_data):
+    result = align.align(pv_data, [5, 12.5, 20, 30, 31], align.LINEAR)
+    numpy.testing.assert_equal(result["a"][:, 0], [numpy.nan, 1.25, 2, 3, numpy.nan])
+    numpy.testing.assert_equal(result.valid["a"], [False, True, True, True, False])
+    numpy.testing.assert_equal(result["b"][1:3], [[numpy.nan] * 2, [15, 16]])
+
+
+def test_align_tolerance_limits_distance_to_event(pv_data):
+    result = align.align(pv_data, [10, 12, 19], align.ASOF, tolerance=2)
+    numpy.testing.assert_equal(result.valid["a"], [True, True, False])
+    numpy.testing.assert_equal(result["a"][:, 0], [1, 1, numpy.nan])
+    result = align.align(pv_data, [10, 12, 19], align.NEAREST, tolerance=2)
+    numpy.testing.assert_equal(result.valid["a"], [True, True, True])
+
+
+def test_align_handles_empty_data_and_rejects_bad_method(pv_data):
+    result = align.align([data.ArchiveData.empty("c")], [1, 2])
+    assert not any(result.valid["c"])
+    strings = make_data("s", [1, 2], ["x", "y"])
+    with pytest.raises(ValueError):
+        align.align([strings], method=align.LINEAR)
+    with pytest.raises(ValueError):
+        align.align(pv_data, method="cubic")
+
+
+def test_AlignedData_to_array_has_a_column_per_pv(pv_data):
+    result = align.align(pv_data, [15, 25])
+    numpy.testing.assert_equal(result.to_array(), [[1, 10], [2, 20]])
+    assert result.pvs == ["a", "b"]
+
+
+def test_MultiPvData_align(pv_data):
+    results = fetcher.MultiPvData((d.pv, d) for d in pv_data)
+    result = results.align([20], align.NEAREST)
+    numpy.testing.assert_equal(result.to_array(), [[2, 10]])
+
+
+def test_AlignedData_to_dataframe(pv_data):
+    pandas = pytest.importorskip("pandas")
+    frame = align.align(pv_data).to_dataframe()
+    assert list(frame.columns) == ["a", "b[0]", "b[1]"]
+    assert frame.index[0] == pandas.Timestamp(10, unit="s", tz="UTC")
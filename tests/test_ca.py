@@ -1,3 +1,4 @@
+import threading
 from datetime import datetime
 
 import mock
@@ -67,3 +68,43 @@ def test_CaFetcher_get_values_calls_client_get_twice_if_count_exceeds_10000(
     # Ask for two values.
     ca_fetcher.get_values("dummy", datetime.now(), datetime.now(), 10001)
     assert len(ca_fetcher._client.get.call_args_list) == 2
+
+
+def test_CaClient_uses_one_proxy_per_thread():
+    with mock.patch("aa.ca.ServerProxy", side_effect=lambda url: object()):
+        cac = ca.CaClient("http:url")
+        proxies = [cac._proxy]
+        thread = threading.Thread(target=lambda: proxies.append(cac._proxy))
+        thread.start()
+        thread.join()
+    assert proxies[0] is cac._proxy
+    assert proxies[1] is not proxies[0]
+
+
+def test_CaFetcher_iter_values_yields_each_page(ca_fetcher, event_1d, event_1d_alt):
+    events = [event_1d] * 10000
+    ca_fetcher._client.get.side_effect = (events, [event_1d_alt])
+    batches = ca_fetcher.iter_values(
+        "dummy", datetime.now(), datetime.now(), batch_size=10000
+    )
+    # The first page is requested before the second is needed.
+    first = next(batches)
+    assert len(ca_fetcher._client.get.call_args_list) == 1
+    assert len(first) == 10000
+    assert [len(batch) for batch in batches] == [1]
+    assert len(ca_fetcher._client.get.call_args_list) == 2
+
+
+def test_CaFetcher_get_values_concatenates_pages_once(
+    ca_fetcher, event_1d, event_1d_alt
+):
+    ca_fetcher._client.get.return_value = []
+    with mock.patch("aa.data.ArchiveData.concat") as mock_concat:
+        assert not len(ca_fetcher.get_values("dummy", datetime.now()))
+        mock_concat.assert_not_called()
+    ca_fetcher._client.get.side_effect = ([event_1d] * 10000, [event_1d_alt])
+    with mock.patch("aa.data.ArchiveData.concat") as mock_concat:
+        ca_fetcher.get_values("dummy", datetime.now(), datetime.now(), 20000)
+    (pages,), kwargs = mock_concat.call_args
+    assert [len(page) for page in pages] == [10000, 1]
+    assert kwargs == {"zero_pad": True}
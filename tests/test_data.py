@@ -1,4 +1,5 @@
 import datetime
+import pickle
 from collections import OrderedDict
 
 import mock
@@ -6,7 +7,7 @@ import numpy
 import pytest
 from pytz import timezone, utc
 
-from aa import data
+from aa import data, utils
 
 
 @pytest.mark.parametrize(
@@ -39,6 +40,30 @@ def test_ArchiveEvent_utc_datetimes_returns_numpy_array_of_datetimes(data_1d):
     assert data_1d.utc_datetimes[0] == utc_dt
 
 
+def test_enum_codes_indexes_labels_and_marks_unknown_values():
+    enum_options = OrderedDict([(0, "Off"), (1, "On"), (3, "Fault")])
+    values = numpy.array([[0], [1], [2], [3], [4], [-1]])
+    result = data.enum_codes(values, enum_options)
+    numpy.testing.assert_equal(result.labels, ["Off", "On", "Fault"])
+    numpy.testing.assert_equal(result.codes, [[0], [1], [-1], [2], [-1], [-1]])
+    expected = [["Off"], ["On"], [""], ["Fault"], [""], [""]]
+    numpy.testing.assert_equal(result.strings(), expected)
+
+
+def test_lookup_enum_string_ignores_values_that_are_not_whole_numbers():
+    enum_options = OrderedDict([(0, "Off"), (1, "On")])
+    values = numpy.array([1.0, 0.5, numpy.nan, numpy.inf, 1e30])
+    result = data.lookup_enum_string(values, enum_options)
+    numpy.testing.assert_equal(result, ["On", "", "", "", ""])
+
+
+def test_ArchiveData_enum_codes(data_1d):
+    assert data_1d.enum_codes is None
+    data_1d._enum_options = OrderedDict([(1, "One")])
+    numpy.testing.assert_equal(data_1d.enum_codes.codes, [[0]])
+    numpy.testing.assert_equal(data_1d.enum_strings, [["One"]])
+
+
 def test_ArchiveEvent_str(dummy_pv, event_1d):
     assert dummy_pv in str(event_1d)
 
@@ -114,6 +139,52 @@ def test_ArchiveData_concatenate_works_for_2d_arrays():
     numpy.testing.assert_equal(data3.severities, expected)
 
 
+def test_ArchiveData_concat_combines_many_objects_with_zero_padding():
+    parts = [
+        data.ArchiveData("dummy", numpy.ones((2, 1)), [1, 2], [0, 0]),
+        data.ArchiveData.empty("dummy"),
+        data.ArchiveData("dummy", numpy.full((1, 3), 2), [3], [1]),
+        data.ArchiveData("dummy", numpy.full((1, 2), 3), [4], [2]),
+    ]
+    result = data.ArchiveData.concat(parts, zero_pad=True)
+    expected = [[1, 0, 0], [1, 0, 0], [2, 2, 2], [3, 3, 0]]
+    numpy.testing.assert_equal(result.values, expected)
+    numpy.testing.assert_equal(result.timestamps, [1, 2, 3, 4])
+    numpy.testing.assert_equal(result.severities, [0, 0, 1, 2])
+    with pytest.raises(ValueError):
+        data.ArchiveData.concat(parts)
+
+
+def test_concat_values_pads_to_widest_and_longest_strings():
+    short, long = numpy.array([["a"]]), numpy.array([["hello", "world"]])
+    result = data.concat_values([short, numpy.zeros((0, 3)), long], zero_pad=True)
+    numpy.testing.assert_equal(result, [["a", ""], ["hello", "world"]])
+    with pytest.raises(ValueError):
+        data.concat_values([short, long])
+
+
+def test_ArchiveData_concat_checks_timestamps_once():
+    parts = [
+        data.ArchiveData("dummy", numpy.zeros((1,)), [i], [0]) for i in range(10)
+    ]
+    with mock.patch.object(data.ArchiveData, "_check_timestamps") as mock_check:
+        data.ArchiveData.concat(parts)
+    mock_check.assert_called_once()
+
+
+def test_ArchiveData_concat_keeps_exact_timestamps_only_if_all_exact():
+    ns = numpy.array([1, 2], dtype=numpy.int64) + 10 ** 18
+    exact = data.ArchiveData(
+        "dummy", numpy.zeros((2,)), None, numpy.zeros((2,)), timestamps_ns=ns
+    )
+    inexact = data.ArchiveData("dummy", numpy.zeros((1,)), [2e9], [0])
+    halves = [exact.subset(slice(1)), exact.subset(slice(1, 2))]
+    result = data.ArchiveData.concat(halves)
+    assert result.has_exact_timestamps
+    numpy.testing.assert_equal(result.timestamps_ns, ns)
+    assert not data.ArchiveData.concat([exact, inexact]).has_exact_timestamps
+
+
 def test_ArchiveData_constructor_raises_AssertionError_if_array_lengths_different(
     dummy_pv,
 ):
@@ -198,6 +269,109 @@ def test_ArchiveData_iterates_multiple_times():
             assert event == zero_event
 
 
+@pytest.fixture
+def ragged_data(dummy_pv):
+    values = [[1, 2, 3], [4], [], [5, 6]]
+    return data.data_from_values(
+        dummy_pv, values, [1, 2, 3, 4], [0, 1, 0, 1], ragged=True
+    )
+
+
+def test_ragged_ArchiveData_stores_values_without_padding(ragged_data):
+    assert ragged_data.is_ragged
+    assert len(ragged_data) == 4
+    numpy.testing.assert_equal(ragged_data.flat_values, [1, 2, 3, 4, 5, 6])
+    numpy.testing.assert_equal(ragged_data.lengths, [3, 1, 0, 2])
+    numpy.testing.assert_equal(ragged_data[1].value, [4])
+    assert [len(event.value) for event in ragged_data] == [3, 1, 0, 2]
+    expected = [[1, 2, 3], [4, 0, 0], [0, 0, 0], [5, 6, 0]]
+    numpy.testing.assert_equal(ragged_data.values, expected)
+    assert not ragged_data.to_dense().is_ragged
+    assert ragged_data.to_dense() == ragged_data
+
+
+@pytest.mark.parametrize(
+    "key", [slice(1, 4), slice(None, None, 2), numpy.array([False, True, True, True])]
+)
+def test_ragged_ArchiveData_subset_selects_events(ragged_data, key):
+    result = ragged_data.subset(key)
+    assert result.is_ragged
+    expected = [list(ragged_data[i].value) for i in numpy.arange(4)[key]]
+    assert [list(event.value) for event in result] == expected
+    numpy.testing.assert_equal(result.timestamps, ragged_data.timestamps[key])
+
+
+def test_ragged_ArchiveData_concat_does_not_pad(ragged_data):
+    dense = data.ArchiveData("dummy", numpy.array([[7, 8]]), [5], [0])
+    result = data.ArchiveData.concat([ragged_data.subset(slice(1, None)), dense])
+    assert result.is_ragged
+    numpy.testing.assert_equal(result.flat_values, [4, 5, 6, 7, 8])
+    numpy.testing.assert_equal(result.offsets, [0, 1, 1, 3, 5])
+
+
+def test_ArchiveData_to_ragged_keeps_given_lengths(data_2d_2_events):
+    result = data_2d_2_events.to_ragged([1, 3])
+    numpy.testing.assert_equal(result.lengths, [1, 3])
+    numpy.testing.assert_equal(result[0].value, data_2d_2_events.values[0, :1])
+    numpy.testing.assert_equal(result[1].value, data_2d_2_events.values[1])
+
+
+@pytest.fixture
+def minute_data(dummy_pv):
+    timestamps = numpy.arange(0, 600, 60.0)
+    return data.ArchiveData(dummy_pv, timestamps / 60, timestamps, timestamps * 0)
+
+
+def test_ArchiveData_index_of_and_at_find_last_event_at_or_before(minute_data):
+    assert minute_data.index_of(utc.localize(datetime.datetime(1970, 1, 1))) == 0
+    instant = utc.localize(datetime.datetime(1970, 1, 1, 0, 2, 59))
+    assert minute_data.index_of(instant) == 2
+    assert minute_data.at(instant).value == 2
+    before = utc.localize(datetime.datetime(1969, 12, 31))
+    assert minute_data.index_of(before) == -1
+    with pytest.raises(ValueError):
+        minute_data.at(before)
+
+
+def test_ArchiveData_between_returns_views_of_range(minute_data):
+    start = utc.localize(datetime.datetime(1970, 1, 1, 0, 2, 30))
+    end = utc.localize(datetime.datetime(1970, 1, 1, 0, 5))
+    result = minute_data.between(start, end)
+    numpy.testing.assert_equal(result.values[:, 0], [3, 4, 5])
+    assert numpy.shares_memory(result.values, minute_data.values)
+    result = minute_data.between(start, end, include_preceding=True)
+    numpy.testing.assert_equal(result.values[:, 0], [2, 3, 4, 5])
+    assert len(minute_data.between(start)) == 7
+    assert not len(minute_data.between(end, start))
+
+
+def test_ArchiveData_between_uses_exact_timestamps(dummy_pv):
+    ns = numpy.array([1, 2, 3]) + 10 ** 18
+    exact = data.ArchiveData(
+        dummy_pv, numpy.zeros((3,)), None, numpy.zeros((3,)), timestamps_ns=ns
+    )
+    start = utc.localize(datetime.datetime(2001, 9, 9, 1, 46, 40))
+    # The events are a few nanoseconds after start.
+    assert len(exact.between(start, start)) == 0
+    assert exact.index_of(start) == -1
+
+
+def test_ArchiveData_between_finds_events_at_microsecond_instants(dummy_pv):
+    # Built as the PB parser builds float timestamps.
+    year_start = utils.year_timestamp(2020)
+    seconds = numpy.array([86400, 24063495, 27634440])
+    nanos = numpy.array([250000000, 493107000, 907571000])
+    timestamps = year_start + seconds + 1e-9 * nanos
+    archive_data = data.ArchiveData(
+        dummy_pv, numpy.arange(3), timestamps, numpy.zeros((3,))
+    )
+    for i, event in enumerate(archive_data):
+        instant = event.utc_datetime
+        assert instant.microsecond == nanos[i] // 1000
+        assert archive_data.index_of(instant) == i
+        assert archive_data.between(instant, instant).values[:, 0].tolist() == [i]
+
+
 def test_data_from_events_returns_empty_data_if_no_events_provided(
     dummy_pv, empty_data
 ):
@@ -221,6 +395,40 @@ def test_data_from_events_handles_two_2d_events(
     assert data.data_from_events(dummy_pv, (event_2d, event_2d_alt)) == data_2d_2_events
 
 
+def test_data_from_events_zero_pads_waveforms_of_different_lengths(dummy_pv):
+    events = [
+        data.ArchiveEvent(dummy_pv, [1, 2], 1, 0),
+        data.ArchiveEvent(dummy_pv, [3.5], 2, 0),
+        data.ArchiveEvent(dummy_pv, [4, 5, 6], 3, 0),
+    ]
+    result = data.data_from_events(dummy_pv, events, count=2)
+    numpy.testing.assert_equal(result.values, [[1, 2], [3.5, 0]])
+    result = data.data_from_events(dummy_pv, events)
+    assert result.values.dtype == numpy.float64
+    numpy.testing.assert_equal(result.values, [[1, 2, 0], [3.5, 0, 0], [4, 5, 6]])
+
+
+@pytest.mark.parametrize(
+    "values,expected_dtype",
+    [
+        ([1, 2.5], numpy.float64),
+        ([[1, 2], [3]], numpy.int64),
+        (["a", "bcd"], numpy.dtype("U3")),
+        (["a", 1], object),
+    ],
+)
+def test_values_array_uses_type_of_all_values(values, expected_dtype):
+    result = data.values_array(values)
+    assert result.dtype == expected_dtype
+    assert result.shape[0] == len(values)
+
+
+def test_ragged_values_pads_each_event_with_zeros():
+    flat = numpy.array([1, 2, 3, 4, 5, 6])
+    result = data.ragged_values(flat, [0, 3, 3, 4, 6])
+    numpy.testing.assert_equal(result, [[1, 2, 3], [0, 0, 0], [4, 0, 0], [5, 6, 0]])
+
+
 def test_parse_enum_options_expected_output():
     test_input = {
         "name": "CS-CS-MSTAT-01:MODE",
@@ -265,3 +473,151 @@ def test_parse_enum_options_expected_output():
     )
     result = data.parse_enum_options(test_input)
     assert result == expect
+
+
+def test_StatisticsData_from_archive_data_treats_raw_events_as_bins(data_1d):
+    stats = data.StatisticsData.from_archive_data(
+        data_1d, ("mean", "std", "minimum", "maximum", "count")
+    )
+    assert len(stats) == len(data_1d)
+    numpy.testing.assert_equal(stats.mean, data_1d.values[:, 0])
+    numpy.testing.assert_equal(stats.minimum, data_1d.values[:, 0])
+    numpy.testing.assert_equal(stats.std, 0)
+    numpy.testing.assert_equal(stats.count, 1)
+
+
+def test_StatisticsData_from_archive_data_fills_missing_statistics_with_nan():
+    archive_data = data.ArchiveData(
+        "errorbar_60(pv)", numpy.array([[1.0, 0.1]]), numpy.array([1.0]), numpy.zeros(1)
+    )
+    stats = data.StatisticsData.from_archive_data(archive_data, ("mean", "std"), "pv")
+    assert stats.pv == "pv"
+    numpy.testing.assert_equal(stats.std, [0.1])
+    assert numpy.isnan(stats.maximum[0])
+
+
+def test_Snapshot_from_rows_pads_values_and_marks_missing_pvs(jan_2018):
+    rows = {"a": (1.5, 10.0, 0), "c": (numpy.array([1, 2, 3]), 20.0, 2)}
+    options = {"c": OrderedDict([(1, "One")])}
+    snapshot = data.Snapshot.from_rows(jan_2018, ["a", "b", "c"], rows, options)
+    assert len(snapshot) == 3
+    assert "b" in snapshot and "d" not in snapshot
+    numpy.testing.assert_equal(snapshot.values, [[1.5, 0, 0], [0, 0, 0], [1, 2, 3]])
+    numpy.testing.assert_equal(snapshot.timestamps, [10.0, numpy.nan, 20.0])
+    numpy.testing.assert_equal(snapshot.found, [True, False, True])
+    event = snapshot.get_event("c")
+    numpy.testing.assert_equal(event.value, [1, 2, 3])
+    assert (event.pv, event.timestamp, event.severity) == ("c", 20.0, 2)
+    assert event.enum_options == options["c"]
+    with pytest.raises(ValueError):
+        snapshot.get_event("b")
+    with pytest.raises(KeyError):
+        snapshot.get_event("d")
+
+
+def test_Snapshot_from_rows_stores_strings_and_numbers_as_objects(jan_2018):
+    rows = {"a": ("text", 10.0, 0), "b": (2.0, 20.0, 0)}
+    snapshot = data.Snapshot.from_rows(jan_2018, ["a", "b"], rows)
+    assert snapshot.values.dtype == object
+    assert snapshot.values[0, 0] == "text"
+
+
+def test_ArchiveEvent_has_no_attribute_dict(event_1d):
+    assert not hasattr(event_1d, "__dict__")
+    with pytest.raises(AttributeError):
+        event_1d.other = 1
+
+
+def test_ArchiveData_rows_read_the_underlying_arrays(data_2d_2_events):
+    events = list(data_2d_2_events)
+    assert len(events) == 2
+    for i, event in enumerate(events):
+        assert isinstance(event, data.ArchiveEvent)
+        assert not hasattr(event, "__dict__")
+        assert event == data.ArchiveEvent(
+            data_2d_2_events.pv,
+            data_2d_2_events.values[i],
+            data_2d_2_events.timestamps[i],
+            data_2d_2_events.severities[i],
+        )
+        assert numpy.shares_memory(event.value, data_2d_2_events.values)
+    assert data_2d_2_events[-1] == events[1]
+    assert data_2d_2_events.get_event(numpy.int64(0)) == events[0]
+    with pytest.raises(IndexError):
+        data_2d_2_events.get_event(2)
+
+
+def test_ArchiveData_row_pickles_as_ArchiveEvent(data_2_events):
+    row = data_2_events[1]
+    unpickled = pickle.loads(pickle.dumps(row))
+    assert type(unpickled) is data.ArchiveEvent
+    assert unpickled == row
+
+
+def test_ArchiveData_datetime64s(data_2_events):
+    result = data_2_events.datetime64s
+    assert result.dtype == numpy.dtype("datetime64[ns]")
+    expected = [
+        numpy.datetime64(dt.replace(tzinfo=None)) for dt in data_2_events.utc_datetimes
+    ]
+    numpy.testing.assert_array_equal(result, expected)
+
+
+def test_ArchiveData_datetime_index_requires_pandas(data_2_events):
+    with mock.patch("aa.data.pandas", None):
+        with pytest.raises(ImportError):
+            data_2_events.datetime_index()
+
+
+def test_ArchiveData_datetime_index(data_2_events):
+    pytest.importorskip("pandas")
+    tz = timezone("Europe/Amsterdam")
+    index = data_2_events.datetime_index(tz)
+    assert list(index.to_pydatetime()) == list(data_2_events.datetimes(tz))
+
+
+@pytest.mark.parametrize("use_pandas", [True, False])
+def test_ArchiveData_datetimes_rounds_like_ArchiveEvent_datetime(use_pandas):
+    if use_pandas:
+        pytest.importorskip("pandas")
+    timestamps = numpy.array([1500000000.123456955, 1500000000.999999999])
+    archive_data = data.ArchiveData("pv", numpy.zeros(2), timestamps, numpy.zeros(2))
+    tz = timezone("Europe/Amsterdam")
+    expected = [event.datetime(tz) for event in archive_data]
+    with mock.patch("aa.data.pandas", data.pandas if use_pandas else None):
+        assert list(archive_data.datetimes(tz)) == expected
+
+
+def test_ArchiveData_with_timestamps_ns_derives_float_timestamps():
+    timestamps_ns = numpy.array([1500000000123456789, 1500000000123456790])
+    archive_data = data.ArchiveData(
+        "pv", numpy.zeros(2), None, numpy.zeros(2), timestamps_ns=timestamps_ns
+    )
+    assert archive_data.has_exact_timestamps
+    assert archive_data._timestamps is None
+    numpy.testing.assert_equal(archive_data.timestamps, timestamps_ns / 1e9)
+    numpy.testing.assert_equal(
+        archive_data.datetime64s.view(numpy.int64), timestamps_ns
+    )
+    # The two events differ although their float timestamps are equal.
+    assert archive_data.timestamps[0] == archive_data.timestamps[1]
+    first, second = archive_data.subset([0]), archive_data.subset([1])
+    assert first != second
+
+
+def test_ArchiveData_concatenate_and_subset_keep_timestamps_ns(data_1d):
+    first = data.ArchiveData(
+        "pv", numpy.zeros(2), None, numpy.zeros(2), timestamps_ns=numpy.array([1, 2])
+    )
+    second = data.ArchiveData(
+        "pv", numpy.ones(1), None, numpy.zeros(1), timestamps_ns=numpy.array([3])
+    )
+    combined = first.concatenate(second)
+    numpy.testing.assert_equal(combined.timestamps_ns, [1, 2, 3])
+    subset = combined.subset(numpy.array([False, True, True]))
+    assert subset.has_exact_timestamps
+    numpy.testing.assert_equal(subset.timestamps_ns, [2, 3])
+    # Without exact timestamps on both sides, float timestamps are used.
+    mixed = data.ArchiveData("pv", *data_1d.values.T, [0.5], [0]).concatenate(second)
+    assert not mixed.has_exact_timestamps
+    numpy.testing.assert_equal(mixed.timestamps_ns, [500000000, 3])
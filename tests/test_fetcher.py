@@ -1,12 +1,17 @@
+import json
+import threading
+import time
 from collections import OrderedDict
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import mock
+import numpy
 import pytest
 import pytz
+import requests
 import tzlocal
 
-from aa import fetcher
+from aa import data, fetcher
 
 EARLY_DATE = datetime(2001, 1, 1, 1, 1)
 LATE_DATE = datetime(2010, 2, 3, 4, 5)
@@ -52,7 +57,7 @@ def test_AaFetcher_constructs_url_correctly(dummy_pv, aa_fetcher):
     early = pytz.utc.localize(EARLY_DATE)
     late = pytz.utc.localize(LATE_DATE)
 
-    with mock.patch("requests.get") as mock_get:
+    with mock.patch("requests.Session.get") as mock_get:
         aa_fetcher.get_values(dummy_pv, early, late, None)
         expected = (
             "dummy-url?pv=dummy&from=2001-01-01T01:01:00Z&to=2010-02-03T04:05:00Z"
@@ -100,6 +105,222 @@ def test_AaFetcher_converts_to_local_if_no_timezone(dummy_pv, aa_fetcher):
 def test_AaFetcher_get_values_raises_NotImplementedError(
     dummy_pv, jan_2018, aa_fetcher
 ):
-    with mock.patch("requests.get"):
+    with mock.patch("requests.Session.get"):
         with pytest.raises(NotImplementedError):
             aa_fetcher.get_values(dummy_pv, jan_2018)
+
+
+def test_AaFetcher_uses_shared_session_with_timeout(dummy_pv, jan_2018):
+    session = mock.MagicMock()
+    fetchers = [fetcher.AaFetcher("localhost", "3003", session=session, timeout=5)]
+    fetchers.append(fetcher.AaFetcher("localhost", "3004", session=session))
+    for aa_fetcher in fetchers:
+        aa_fetcher._url = "dummy-url"
+        aa_fetcher._parse_raw_data = mock.MagicMock()
+        aa_fetcher.get_values(dummy_pv, jan_2018, jan_2018)
+    assert session.get.call_count == 2
+    assert session.get.call_args_list[0][1]["timeout"] == 5
+    # A shared session is left open for its other users.
+    for aa_fetcher in fetchers:
+        aa_fetcher.close()
+    session.close.assert_not_called()
+
+
+def test_AaFetcher_reuses_its_own_session(dummy_pv, jan_2018, aa_fetcher):
+    aa_fetcher._parse_raw_data = mock.MagicMock()
+    with mock.patch("requests.Session.get") as mock_get:
+        aa_fetcher.get_values(dummy_pv, jan_2018, jan_2018)
+        aa_fetcher.get_values(dummy_pv, jan_2018, jan_2018)
+    assert mock_get.call_count == 2
+    with mock.patch("requests.Session.close") as mock_close:
+        aa_fetcher.close()
+    mock_close.assert_called_once()
+
+
+class RecordingFetcher(fetcher.Fetcher):
+    """Fetcher that records how many PVs it is retrieving at once."""
+
+    def __init__(self, failing=()):
+        self._failing = failing
+        self._lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def _get_values(self, pv, start, end, count, request_params):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.01)
+        with self._lock:
+            self.active -= 1
+        if pv in self._failing:
+            raise ValueError(pv)
+        request_params["pv"] = pv
+        return (pv, start, end, count, request_params)
+
+
+def test_Fetcher_get_values_many_returns_data_for_each_pv(jan_2018):
+    f = RecordingFetcher()
+    pvs = ["pv{}".format(i) for i in range(20)]
+    params = {"a": "b"}
+    results = f.get_values_many(pvs, jan_2018, jan_2018, 3, params, max_workers=4)
+    assert list(results) == pvs
+    for pv in pvs:
+        assert results[pv] == (pv, jan_2018, jan_2018, 3, {"a": "b", "pv": pv})
+    assert params == {"a": "b"}
+    assert results.errors == {}
+    assert 1 < f.max_active <= 4
+
+
+def test_Fetcher_get_values_many_captures_errors_per_pv(jan_2018):
+    f = RecordingFetcher(failing=("bad1", "bad2"))
+    results = f.get_values_many(["bad1", "good", "bad2"], jan_2018, request_params={})
+    assert list(results) == ["good"]
+    assert sorted(results.errors) == ["bad1", "bad2"]
+    assert isinstance(results.errors["bad1"], ValueError)
+
+
+class DataFetcher(fetcher.Fetcher):
+    def __init__(self, archive_data):
+        self._data = archive_data
+
+    def _get_values(self, pv, start, end, count, request_params):
+        return self._data
+
+
+def make_data(n, width=1, first=0):
+    values = numpy.arange(first, first + n * width).reshape((n, width))
+    timestamps = numpy.arange(first, first + n, dtype=numpy.float64)
+    return data.ArchiveData("dummy", values, timestamps, numpy.zeros((n,)))
+
+
+def test_Fetcher_iter_values_yields_batches(dummy_pv, jan_2018):
+    archive_data = make_data(25)
+    f = DataFetcher(archive_data)
+    batches = list(f.iter_values(dummy_pv, jan_2018, jan_2018, batch_size=10))
+    assert [len(batch) for batch in batches] == [10, 10, 5]
+    combined = batches[0].concatenate(batches[1]).concatenate(batches[2])
+    assert combined == archive_data
+
+
+def test_batches_regroups_and_zero_pads_blocks():
+    blocks = [make_data(3), make_data(0), make_data(4, 2, first=3), make_data(1)]
+    batches = list(fetcher._batches(blocks, 5))
+    assert [len(batch) for batch in batches] == [5, 3]
+    numpy.testing.assert_equal(batches[0].values[:, 1], [0, 0, 0, 4, 6])
+    assert batches[1].values.shape == (3, 2)
+
+
+def test_processed_pv():
+    assert fetcher.processed_pv("a-b-c:d", "mean", 600) == "mean_600(a-b-c:d)"
+    assert fetcher.processed_pv("a", "optimized", 2000.0) == "optimized_2000(a)"
+
+
+def test_processed_pv_raises_ValueError_if_operator_invalid():
+    with pytest.raises(ValueError):
+        fetcher.processed_pv("a", "average", 600)
+
+
+@pytest.mark.parametrize(
+    "seconds,points,expected", ((3600, 6, 600), (3601, 6, 601), (10, 100, 1))
+)
+def test_auto_bin_size(seconds, points, expected):
+    start = pytz.utc.localize(EARLY_DATE)
+    end = start + timedelta(seconds=seconds)
+    assert fetcher.auto_bin_size(start, end, points) == expected
+
+
+def test_AaFetcher_constructs_url_with_encoded_operator(aa_fetcher):
+    aa_fetcher._url = "dummy-url"
+    early = pytz.utc.localize(EARLY_DATE)
+    url = aa_fetcher._construct_url("mean_600(a-b:c d)", early, early, None)
+    assert url.startswith("dummy-url?pv=mean_600%28a-b:c%20d%29&from=")
+
+
+def test_AaFetcher_get_processed_values_chooses_bin_size(aa_fetcher, dummy_pv):
+    aa_fetcher._get_values = mock.MagicMock(return_value=make_data(3))
+    start = pytz.utc.localize(EARLY_DATE)
+    end = start + timedelta(hours=1)
+    result = aa_fetcher.get_processed_values(dummy_pv, start, end, "max", points=60)
+    assert aa_fetcher._get_values.call_args[0][0] == "max_60(dummy)"
+    assert result == make_data(3)
+    aa_fetcher.get_processed_values(dummy_pv, start, end, "optimized", points=500)
+    assert aa_fetcher._get_values.call_args[0][0] == "optimized_500(dummy)"
+    with pytest.raises(ValueError):
+        aa_fetcher.get_processed_values(dummy_pv, start, end, "nth", points=500)
+
+
+def test_AaFetcher_get_processed_values_returns_statistics(aa_fetcher, dummy_pv):
+    values = numpy.array([[1.5, 0.5, 1, 2, 2], [3.0, 0.0, 3, 3, 1]])
+    aa_fetcher._get_values = mock.MagicMock(
+        return_value=data.ArchiveData(
+            "optimized_2(dummy)", values, numpy.array([10.0, 20.0]), numpy.zeros(2)
+        )
+    )
+    start = pytz.utc.localize(EARLY_DATE)
+    result = aa_fetcher.get_processed_values(dummy_pv, start, start, "optimized", 2)
+    assert isinstance(result, data.StatisticsData)
+    assert result.pv == dummy_pv
+    numpy.testing.assert_equal(result.mean, [1.5, 3.0])
+    numpy.testing.assert_equal(result.std, [0.5, 0.0])
+    numpy.testing.assert_equal(result.minimum, [1, 3])
+    numpy.testing.assert_equal(result.maximum, [2, 3])
+    numpy.testing.assert_equal(result.count, [2, 1])
+    numpy.testing.assert_equal(result.timestamps, [10.0, 20.0])
+
+
+class EventFetcher(fetcher.Fetcher):
+    """Fetcher returning one event for PVs named by their value."""
+
+    def _get_values(self, pv, start, end, count, request_params):
+        if pv == "bad":
+            raise ValueError(pv)
+        if pv == "missing":
+            return data.ArchiveData.empty(pv)
+        return data.ArchiveData(
+            pv, numpy.array([float(pv)]), numpy.array([1.0]), numpy.array([0.0])
+        )
+
+
+def test_Fetcher_get_events_at_returns_snapshot(jan_2018):
+    snapshot = EventFetcher().get_events_at(["1", "missing", "2", "bad"], jan_2018)
+    assert snapshot.pvs == ["1", "missing", "2", "bad"]
+    numpy.testing.assert_equal(snapshot.values[:, 0], [1.0, 0.0, 2.0, 0.0])
+    numpy.testing.assert_equal(snapshot.found, [True, False, True, False])
+    assert list(snapshot.errors) == ["bad"]
+
+
+def test_AaFetcher_get_events_at_posts_pvs_in_batches(aa_fetcher, jan_2018):
+    def post(url, body, **kwargs):
+        events = {
+            pv: {"secs": 100, "nanos": 5e8, "val": int(pv), "severity": 1}
+            for pv in json.loads(body)
+            if pv != "0"
+        }
+        return mock.MagicMock(json=mock.MagicMock(return_value=events))
+
+    pvs = [str(i) for i in range(5)]
+    with mock.patch("requests.Session.post", side_effect=post) as mock_post:
+        with mock.patch("aa.fetcher.SNAPSHOT_BATCH_SIZE", 2):
+            snapshot = aa_fetcher.get_events_at(pvs, jan_2018)
+    assert mock_post.call_count == 3
+    assert mock_post.call_args[0][0] == (
+        "http://localhost:3003/retrieval/data/getDataAtTime"
+        "?at=2018-01-01T00:00:00Z&includeProxies=true"
+    )
+    numpy.testing.assert_equal(snapshot.values[:, 0], [0, 1, 2, 3, 4])
+    numpy.testing.assert_equal(snapshot.timestamps, [numpy.nan] + [100.5] * 4)
+    numpy.testing.assert_equal(snapshot.severities, [0, 1, 1, 1, 1])
+
+
+def test_AaFetcher_get_events_at_falls_back_if_not_supported(aa_fetcher, jan_2018):
+    response = mock.MagicMock(status_code=404)
+    response.raise_for_status.side_effect = requests.HTTPError(response=response)
+    aa_fetcher._get_values = mock.MagicMock(return_value=make_data(1))
+    with mock.patch("requests.Session.post", return_value=response) as mock_post:
+        aa_fetcher.get_events_at(["a", "b"], jan_2018)
+        snapshot = aa_fetcher.get_events_at(["a", "b"], jan_2018)
+    # Once getDataAtTime is found to be missing it is not tried again.
+    assert mock_post.call_count == 1
+    assert aa_fetcher._get_values.call_count == 4
+    numpy.testing.assert_equal(snapshot.found, [True, True])
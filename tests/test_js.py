@@ -82,3 +82,15 @@ def test_JsonFetcher_decodes_enum_events_correctly(
     assert aa_data.enum_strings[0] == "User"
     assert aa_data[0].enum_string[0] == "User"
     assert aa_data.values[0] == 4
+
+
+def test_parse_json_data_keeps_exact_nanoseconds(dummy_pv):
+    json_data = json.loads(utils.load_from_file("waveform.json"))
+    expected = js.parse_json_data(json_data, dummy_pv)
+    result = js.parse_json_data(json_data, dummy_pv, nanoseconds=True)
+    assert result.has_exact_timestamps
+    assert result == expected
+    events = json_data[0]["data"]
+    numpy.testing.assert_array_equal(
+        result.timestamps_ns, [e["secs"] * 10 ** 9 + e["nanos"] for e in events]
+    )
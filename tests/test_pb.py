@@ -1,4 +1,7 @@
+import datetime
+import io
 import os
+import threading
 
 import mock
 import numpy
@@ -106,7 +109,7 @@ def test_PbFetcher_creates_correct_url():
 
 
 def test_PbFetcher_get_calls_get_with_correct_url(dummy_pv, jan_2018):
-    with mock.patch("requests.get") as mock_get:
+    with mock.patch("requests.Session.get") as mock_get:
         mock_get.return_value = testutils.mock_response(raw=PB_CHUNK)
         pb_fetcher = pb.PbFetcher("dummy.com", 8000)
         pb_fetcher.get_event_at(dummy_pv, jan_2018)
@@ -115,13 +118,13 @@ def test_PbFetcher_get_calls_get_with_correct_url(dummy_pv, jan_2018):
             "?pv=dummy&from=2018-01-01T00:00:00Z&to=2018-01-01T00:00:00Z"
             "&fetchLatestMetadata=true"
         )
-        mock_get.assert_called_with(expected_url, stream=True)
+        mock_get.assert_called_with(expected_url, stream=True, timeout=None)
 
 
 def test_PbFetcher_get_returns_empty_data_if_get_throws_HTTPError_404(
     dummy_pv, jan_2018, empty_data
 ):
-    with mock.patch("requests.get") as mock_get:
+    with mock.patch("requests.Session.get") as mock_get:
         mock_response = mock.MagicMock(status_code=404)
         http_error = requests.exceptions.HTTPError(response=mock_response)
         mock_get.side_effect = http_error
@@ -133,7 +136,7 @@ def test_PbFetcher_get_returns_empty_data_if_get_throws_HTTPError_404(
 def test_PbFetcher_get_raises_if_get_throws_HTTPError_not_404(
     dummy_pv, jan_2018, empty_data
 ):
-    with mock.patch("requests.get") as mock_get:
+    with mock.patch("requests.Session.get") as mock_get:
         mock_response = mock.MagicMock(status_code=405)
         http_error = requests.exceptions.HTTPError(response=mock_response)
         mock_get.side_effect = http_error
@@ -188,6 +191,439 @@ def test_PbFileFetcher_read_pb_files_omits_subsequent_event(dummy_pv, jan_2001):
     assert len(data) == 0
 
 
+@pytest.mark.parametrize(
+    "filename,start,end",
+    (
+        ("X:2015.pb", (2015, 1, 1), (2016, 1, 1)),
+        ("X:2015_12.pb", (2015, 12, 1), (2016, 1, 1)),
+        ("X:2015_02_28.pb", (2015, 2, 28), (2015, 3, 1)),
+        ("X:2015_02_28_23.pb", (2015, 2, 28, 23), (2015, 3, 1)),
+        ("X:2015_02_28_23_15.pb", (2015, 2, 28, 23, 15), (2015, 3, 1)),
+        ("X:Y.Z:2015_02.pb", (2015, 2, 1), (2015, 3, 1)),
+    ),
+)
+def test_parse_partition_name(filename, start, end):
+    suffix = filename.rsplit(":", 1)[0]
+    expected = (suffix, utils.utc_datetime(*start), utils.utc_datetime(*end))
+    assert pb.parse_partition_name(filename) == expected
+
+
+@pytest.mark.parametrize("filename", ("X:2015.pb.idx", "X:2015_13.pb", "X.pb"))
+def test_parse_partition_name_rejects_other_files(filename):
+    assert pb.parse_partition_name(filename) is None
+
+
+def make_partitions(directory, fmt):
+    """Write one PB file per partition with an event every ten minutes
+    from the start of 2015 until the end of 2 January 2015."""
+    directory.mkdir(parents=True, exist_ok=True)
+    partitions = {}
+    for secs in range(0, 2 * 86400, 600):
+        dt = utils.epoch_to_datetime(utils.year_timestamp(2015) + secs)
+        partitions.setdefault(dt.strftime(fmt), []).append((secs, 0, secs, 0))
+    for name, events in partitions.items():
+        data = testutils.make_pb_data(2015, 6, events)
+        (directory / "PV:{}.pb".format(name)).write_bytes(data)
+    # Files for other PVs in the same directory are ignored.
+    (directory / "PV2:2015.pb").write_bytes(testutils.make_pb_data(2015, 6, []))
+
+
+@pytest.mark.parametrize(
+    "fmt", ("%Y", "%Y_%m", "%Y_%m_%d", "%Y_%m_%d_%H", "%Y_%m_%d_%H_%M")
+)
+def test_PbFileFetcher_get_values_reads_partitions(tmp_path, fmt):
+    make_partitions(tmp_path / "A" / "B" / "C", fmt)
+    fetcher = pb.PbFileFetcher(str(tmp_path))
+    start = utils.utc_datetime(2015, 1, 1, 22, 55)
+    end = utils.utc_datetime(2015, 1, 2, 1, 0)
+    data = fetcher.get_values("A-B-C:PV", start, end)
+    # The event preceding the start is included.
+    expected = numpy.arange(22 * 3600 + 50 * 60, 25 * 3600 + 1, 600)
+    numpy.testing.assert_equal(data.values[:, 0], expected)
+
+
+def test_PbFileFetcher_get_values_opens_only_intersecting_partitions(tmp_path):
+    make_partitions(tmp_path / "A" / "B" / "C", "%Y_%m_%d_%H")
+    fetcher = pb.PbFileFetcher(str(tmp_path))
+    start = utils.utc_datetime(2015, 1, 1, 22, 55)
+    end = utils.utc_datetime(2015, 1, 2, 1, 0)
+    with mock.patch.object(fetcher, "_read_pb_files") as mock_read:
+        fetcher.get_values("A-B-C:PV", start, end)
+    filenames = [os.path.basename(f) for f in mock_read.call_args[0][0]]
+    assert filenames == [
+        "PV:2015_01_01_22.pb",
+        "PV:2015_01_01_23.pb",
+        "PV:2015_01_02_00.pb",
+        "PV:2015_01_02_01.pb",
+    ]
+
+
+def test_PbFileFetcher_get_values_opens_each_partition_once(tmp_path):
+    make_partitions(tmp_path / "A" / "B" / "C", "%Y_%m_%d_%H")
+    fetcher = pb.PbFileFetcher(str(tmp_path))
+    start = utils.utc_datetime(2015, 1, 1, 23, 0)
+    end = utils.utc_datetime(2015, 1, 2, 0, 30)
+    with mock.patch.object(
+        fetcher, "_open_pb_file", wraps=fetcher._open_pb_file
+    ) as mock_open:
+        data = fetcher.get_values("A-B-C:PV", start, end)
+    assert data.values[0, 0] == 23 * 3600
+    filenames = [os.path.basename(c[0][0]) for c in mock_open.call_args_list]
+    assert filenames == ["PV:2015_01_01_23.pb", "PV:2015_01_02_00.pb"]
+
+
+def test_PbFileFetcher_get_values_handles_missing_directory(tmp_path):
+    fetcher = pb.PbFileFetcher(str(tmp_path))
+    start = utils.utc_datetime(2015, 1, 1)
+    data = fetcher.get_values("A-B-C:PV", start, start)
+    assert len(data) == 0
+
+
+def test_PbFileFetcher_get_values_many(tmp_path):
+    make_partitions(tmp_path / "A" / "B" / "C", "%Y_%m_%d")
+    fetcher = pb.PbFileFetcher(str(tmp_path))
+    start = utils.utc_datetime(2015, 1, 1, 23)
+    end = utils.utc_datetime(2015, 1, 2, 1)
+    results = fetcher.get_values_many(["A-B-C:PV", "A-B-C:PV2", "A-B:C"], start, end)
+    assert results["A-B-C:PV"] == fetcher.get_values("A-B-C:PV", start, end)
+    assert len(results["A-B-C:PV2"]) == 0
+    assert len(results["A-B:C"]) == 0
+    assert results.errors == {}
+
+
+def make_stream_data(event_type=6):
+    """PB data with chunks for several years, including a repeated year."""
+
+    def val(i):
+        return [i, i + 1, i + 2][: i % 3 + 1] if event_type > 6 else i
+
+    chunks = []
+    for year, first in ((2014, 0), (2015, 0), (2015, 100), (2016, 0)):
+        events = [(i * 3600, i % 40, val(i), i % 4) for i in range(first, first + 50)]
+        chunks.append(testutils.make_pb_data(year, event_type, events))
+    return b"\n".join(chunks)
+
+
+@pytest.mark.parametrize("event_type", (6, 9))
+@pytest.mark.parametrize("wire_decoding", (False, True))
+@pytest.mark.parametrize("block_size", (1, 7, 1000, 1 << 20))
+@pytest.mark.parametrize(
+    "start,end,count",
+    (
+        ((2013, 1, 1), (2017, 1, 1), None),
+        ((2015, 1, 1, 10), (2015, 1, 5, 10), None),
+        ((2015, 1, 2), (2016, 1, 1, 5), 30),
+        ((2016, 1, 1, 5), (2016, 1, 1, 5), None),
+        ((2016, 6, 1), (2016, 7, 1), None),
+    ),
+)
+def test_parse_pb_stream_matches_parse_pb_data(
+    event_type, wire_decoding, block_size, start, end, count
+):
+    raw_data = make_stream_data(event_type)
+    start = utils.utc_datetime(*start)
+    end = utils.utc_datetime(*end)
+    expected = pb.parse_pb_data(raw_data, PV, start, end, count, wire_decoding)
+    result = pb.parse_pb_stream(
+        io.BytesIO(raw_data), PV, start, end, count, wire_decoding, block_size
+    )
+    assert result == expected
+    assert result.values.dtype == expected.values.dtype
+
+
+@pytest.mark.parametrize("filename", ("string_event.pb", "jan_2016.pb"))
+def test_parse_pb_stream_matches_parse_pb_data_for_files(filename, jan_2001, jan_2018):
+    with open(testutils.get_data_filepath(filename), "rb") as f:
+        raw_data = f.read()
+    expected = pb.parse_pb_data(raw_data, PV, jan_2001, jan_2018)
+    result = pb.parse_pb_stream(io.BytesIO(raw_data), PV, jan_2001, jan_2018)
+    numpy.testing.assert_array_equal(result.values, expected.values)
+    numpy.testing.assert_array_equal(result.timestamps, expected.timestamps)
+    numpy.testing.assert_array_equal(result.severities, expected.severities)
+    assert result.enum_options == expected.enum_options
+
+
+@pytest.mark.parametrize("block_size", (7, 1 << 20))
+@pytest.mark.parametrize("count,shape", ((None, (3, 3)), (2, (2, 2))))
+def test_parse_pb_stream_ignores_width_of_events_outside_range(
+    block_size, count, shape
+):
+    widths = (6, 1, 2, 3, 8)
+    events = [(i * 10, 0, [1.0] * width, 0) for i, width in enumerate(widths)]
+    raw_data = testutils.make_pb_data(2015, 9, events)
+    start = utils.utc_datetime(2015, 1, 1, 0, 0, 15)
+    end = utils.utc_datetime(2015, 1, 1, 0, 0, 35)
+    expected = pb.parse_pb_data(raw_data, PV, start, end, count)
+    result = pb.parse_pb_stream(
+        io.BytesIO(raw_data), PV, start, end, count, block_size=block_size
+    )
+    assert result.values.shape == expected.values.shape == shape
+    assert result == expected
+
+
+def test_parse_pb_stream_handles_empty_stream(jan_2001, jan_2018, empty_data):
+    assert pb.parse_pb_stream(io.BytesIO(b""), PV, jan_2001, jan_2018) == empty_data
+
+
+def test_parse_pb_stream_raises_errors_from_stream(jan_2001, jan_2018):
+    stream = mock.MagicMock()
+    stream.read.side_effect = [make_stream_data()[:100], IOError("lost connection")]
+    with pytest.raises(IOError):
+        pb.parse_pb_stream(stream, PV, jan_2001, jan_2018)
+
+
+def test_parse_pb_stream_stops_reading_if_parsing_fails(jan_2001, jan_2018):
+    stream = mock.MagicMock()
+    stream.read.return_value = b"not a pb header\n"
+    with pytest.raises(Exception):
+        pb.parse_pb_stream(stream, PV, jan_2001, jan_2018)
+
+
+def concatenate_batches(batches):
+    result = batches[0]
+    for batch in batches[1:]:
+        result = result.concatenate(batch)
+    return result
+
+
+@pytest.mark.parametrize("start", ((2014, 6, 1), (2015, 1, 2), (2016, 1, 1, 5)))
+def test_PbFetcher_iter_values_matches_get_values(start):
+    raw_data = make_stream_data()
+    start = utils.utc_datetime(*start)
+    end = utils.utc_datetime(2016, 1, 2)
+    pb_fetcher = pb.PbFetcher("dummy.com", 8000)
+    with mock.patch("requests.Session.get") as mock_get:
+        mock_get.side_effect = lambda *args, **kwargs: testutils.mock_response(
+            raw=raw_data
+        )
+        expected = pb_fetcher.get_values(PV, start, end)
+        with mock.patch("aa.pb.STREAM_BLOCK_SIZE", 100):
+            batches = list(pb_fetcher.iter_values(PV, start, end, batch_size=7))
+    assert all(len(batch) == 7 for batch in batches[:-1])
+    assert concatenate_batches(batches) == expected
+
+
+def test_PbFetcher_iter_values_yields_nothing_if_not_found(jan_2018):
+    response = requests.Response()
+    response.status_code = 404
+    response.raw = mock.MagicMock()
+    with mock.patch("requests.Session.get") as mock_get:
+        mock_get.return_value = response
+        pb_fetcher = pb.PbFetcher("dummy.com", 8000)
+        assert list(pb_fetcher.iter_values(PV, jan_2018, jan_2018)) == []
+    # The connection is released back to the session.
+    response.raw.release_conn.assert_called_once_with()
+
+
+def test_PbFile_iter_lines_matches_read_lines(pb_file_2015):
+    start = utils.utc_datetime(2015, 1, 3, 12, 30)
+    end = utils.utc_datetime(2015, 1, 20)
+    with pb.PbFile(pb_file_2015) as pb_file:
+        [(chunk, lines)] = pb_file.read_lines(start, end)
+        blocks = list(pb_file.iter_lines(start, end, block_size=50))
+    assert len(blocks) > 1
+    assert all(block_chunk == chunk for block_chunk, _ in blocks)
+    assert [line for _, block in blocks for line in block] == list(lines)
+
+
+def test_PbFileFetcher_iter_values_matches_get_values(tmp_path):
+    make_partitions(tmp_path / "A" / "B" / "C", "%Y_%m_%d_%H")
+    fetcher = pb.PbFileFetcher(str(tmp_path))
+    start = utils.utc_datetime(2015, 1, 1, 22, 55)
+    end = utils.utc_datetime(2015, 1, 2, 1, 0)
+    expected = fetcher.get_values("A-B-C:PV", start, end)
+    batches = list(fetcher.iter_values("A-B-C:PV", start, end, batch_size=4))
+    assert [len(batch) for batch in batches] == [4, 4, 4, 2]
+    assert concatenate_batches(batches) == expected
+
+
+@pytest.mark.parametrize(
+    "start,end,granularity,expected",
+    (
+        ((2015, 3, 4, 5), (2015, 6, 1), "month", [(2015, 4, 1), (2015, 5, 1)]),
+        ((2015, 12, 31, 23), (2016, 1, 1, 2), "hour", [(2016, 1, 1), (2016, 1, 1, 1)]),
+        ((2015, 3, 4), (2015, 3, 5), "day", []),
+        ((2014, 6, 1), (2016, 6, 1), "year", [(2015, 1, 1), (2016, 1, 1)]),
+    ),
+)
+def test_partition_boundaries(start, end, granularity, expected):
+    boundaries = pb.partition_boundaries(
+        utils.utc_datetime(*start), utils.utc_datetime(*end), granularity
+    )
+    assert boundaries == [utils.utc_datetime(*b) for b in expected]
+
+
+FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+class FakeArchiver(object):
+    """Respond to getData.raw requests like the AA, including the event
+    preceding the start of the request."""
+
+    def __init__(self, events_by_year):
+        self._events_by_year = events_by_year
+        self.requests = []
+
+    def get(self, url, **kwargs):
+        query = dict(param.split("=") for param in url.split("?")[1].split("&"))
+        self.requests.append((query["from"], query["to"]))
+        start, end = (
+            utils.datetime_to_epoch(
+                utils.UTC.localize(datetime.datetime.strptime(query[key], FORMAT))
+            )
+            for key in ("from", "to")
+        )
+        chunks = []
+        preceding = None
+        for year, events in self._events_by_year.items():
+            year_start = utils.year_timestamp(year)
+            selected = [e for e in events if start < year_start + e[0] <= end]
+            earlier = [e for e in events if year_start + e[0] <= start]
+            if earlier:
+                preceding = (year, earlier[-1])
+            if selected:
+                chunks.append((year, selected))
+        if preceding is not None:
+            year, event = preceding
+            if chunks and chunks[0][0] == year:
+                chunks[0] = (year, [event] + chunks[0][1])
+            else:
+                chunks.insert(0, (year, [event]))
+        raw = b"\n".join(testutils.make_pb_data(y, 6, e) for y, e in chunks)
+        return testutils.mock_response(raw=raw)
+
+
+@pytest.mark.parametrize("window", ("year", "month", "day", "hour"))
+def test_PbFetcher_with_window_matches_single_request(window):
+    events_by_year = {
+        2015: [(secs, 0, float(secs), 0) for secs in range(0, 86400 * 365, 1800)],
+        2016: [(secs, 0, float(secs), 0) for secs in range(0, 86400 * 3, 1800)],
+    }
+    start = utils.utc_datetime(2015, 12, 30, 22, 10)
+    end = utils.utc_datetime(2016, 1, 2, 1, 0)
+    archiver = FakeArchiver(events_by_year)
+    with mock.patch("requests.Session.get", side_effect=archiver.get):
+        expected = pb.PbFetcher("dummy.com", 8000).get_values(PV, start, end)
+        assert len(archiver.requests) == 1
+        fetcher = pb.PbFetcher("dummy.com", 8000, window=window, max_workers=4)
+        result = fetcher.get_values(PV, start, end)
+    windows = len(pb.partition_boundaries(start, end, window)) + 1
+    assert len(archiver.requests) == 1 + windows
+    assert result == expected
+
+
+def test_PbFetcher_does_not_split_requests_with_count(jan_2018):
+    archiver = FakeArchiver({2018: [(10, 0, 1.0, 0)]})
+    with mock.patch("requests.Session.get", side_effect=archiver.get):
+        fetcher = pb.PbFetcher("dummy.com", 8000, window="hour")
+        fetcher.get_values(PV, jan_2018, utils.utc_datetime(2018, 1, 2), count=1)
+    assert len(archiver.requests) == 1
+
+
+def test_PbFetcher_rejects_unknown_window():
+    with pytest.raises(ValueError):
+        pb.PbFetcher("dummy.com", 8000, window="fortnight")
+
+
+def test_PbFetcher_get_processed_values_parses_optimized_vectors(jan_2018):
+    events = [(i * 600, 0, [i, 0.5, i - 1, i + 1, 100], 0) for i in range(6)]
+    raw = testutils.make_pb_data(2018, 13, events, pv="optimized_6(dummy)")
+    with mock.patch("requests.Session.get") as mock_get:
+        mock_get.return_value = testutils.mock_response(raw=raw)
+        pb_fetcher = pb.PbFetcher("dummy.com", 8000)
+        end = utils.utc_datetime(2018, 1, 1, 1)
+        stats = pb_fetcher.get_processed_values(PV, jan_2018, end, "optimized", 6)
+    assert "pv=optimized_6%28dummy%29&" in mock_get.call_args[0][0]
+    numpy.testing.assert_equal(stats.mean, numpy.arange(6))
+    numpy.testing.assert_equal(stats.maximum, numpy.arange(6) + 1)
+    numpy.testing.assert_equal(stats.count, 100)
+
+
+def decoded_line_count(mock_decode_lines):
+    return sum(len(call[0][0]) for call in mock_decode_lines.call_args_list)
+
+
+def test_parse_pb_data_only_decodes_count_events():
+    raw_data = make_stream_data()
+    start = utils.utc_datetime(2015, 1, 2)
+    end = utils.utc_datetime(2017, 1, 1)
+    expected = pb.parse_pb_data(raw_data, PV, start, end)
+    with mock.patch("aa.pb.decode_lines", wraps=pb.decode_lines) as mock_decode:
+        result = pb.parse_pb_data(raw_data, PV, start, end, count=5)
+    assert decoded_line_count(mock_decode) == 5
+    numpy.testing.assert_equal(result.values, expected.values[:5])
+
+
+class CountingStream(io.BytesIO):
+    def __init__(self, *args):
+        super(CountingStream, self).__init__(*args)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        block = super(CountingStream, self).read(size)
+        self.bytes_read += len(block)
+        return block
+
+
+def test_parse_pb_stream_stops_reading_when_count_found():
+    events = [(i, 0, float(i), 0) for i in range(100000)]
+    raw_data = testutils.make_pb_data(2015, 6, events)
+    instant = utils.utc_datetime(2015, 1, 1, 0, 0, 10)
+    stream = CountingStream(raw_data)
+    result = pb.parse_pb_stream(stream, PV, instant, instant, 1, block_size=100)
+    numpy.testing.assert_equal(result.values, [[10.0]])
+    # The reader thread may have read a few blocks ahead.
+    assert stream.bytes_read <= 100 * (pb.STREAM_READ_AHEAD + 10)
+
+
+class StallingStream(io.BytesIO):
+    """Returns its data in one read, then blocks until closed."""
+
+    def __init__(self, *args):
+        super(StallingStream, self).__init__(*args)
+        self.closed_event = threading.Event()
+
+    def read(self, size=-1):
+        block = super(StallingStream, self).read()
+        if not block:
+            self.closed_event.wait()
+        return block
+
+    def close(self):
+        self.closed_event.set()
+
+
+def test_PbFetcher_returns_when_count_found_without_waiting_for_stream(jan_2018):
+    events = [(i, 0, float(i), 0) for i in range(10)]
+    stream = StallingStream(testutils.make_pb_data(2018, 6, events))
+    response = mock.MagicMock()
+    response.raw = stream
+    response.close = stream.close
+    fetcher = pb.PbFetcher("dummy.com", 8000)
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(
+            fetcher._parse_raw_data(response, PV, jan_2018, jan_2018, 1)
+        )
+    )
+    thread.start()
+    thread.join(5)
+    stream.close()
+    assert not thread.is_alive()
+    numpy.testing.assert_equal(results[0].values, [[0.0]])
+
+
+def test_PbFileFetcher_read_pb_files_only_decodes_count_events(pb_file_2015):
+    start = utils.utc_datetime(2015, 1, 2)
+    end = utils.utc_datetime(2015, 2, 1)
+    fetcher = pb.PbFileFetcher("root")
+    expected = fetcher._read_pb_files([pb_file_2015] * 2, PV, start, end, None)
+    with mock.patch("aa.pb.decode_lines", wraps=pb.decode_lines) as mock_decode:
+        result = fetcher._read_pb_files([pb_file_2015] * 2, PV, start, end, 3)
+    assert decoded_line_count(mock_decode) == 3
+    numpy.testing.assert_equal(result.values, expected.values[:3])
+
+
 def test_get_iso_timestamp_for_event_has_expected_output():
     event = ee.ScalarInt()
     event.secondsintoyear = 15156538
@@ -195,3 +631,392 @@ def test_get_iso_timestamp_for_event_has_expected_output():
     year = 2017
     expected = "2017-06-25T11:08:58.381176+01:00"
     assert pb.get_iso_timestamp_for_event(year, event) == expected
+
+
+@pytest.mark.parametrize("filename", ["jan_2016.pb", "string_event.pb"])
+def test_parse_pb_data_matches_events_parsed_one_by_one(filename, jan_2001, jan_2018):
+    with open(testutils.get_data_filepath(filename), "rb") as f:
+        raw_data = b"\n" + f.read()
+    events = []
+    for year, (chunk_info, lines) in pb.break_up_chunks(raw_data).items():
+        for line in lines:
+            events.append(pb.event_from_line(line, PV, year, chunk_info.type))
+    result = pb.parse_pb_data(raw_data, PV, jan_2001, jan_2018)
+    assert len(result) == len(events)
+    for event, expected in zip(result, events):
+        assert event.value == expected.value
+        assert event.timestamp == expected.timestamp
+        assert event.severity == expected.severity
+
+
+def test_parse_pb_data_decodes_waveforms(jan_2001, jan_2018):
+    events = [(1, 0, [1.5, 2.5, 3.5], 0), (2, 0, [4.5, 5.5, 6.5], 1)]
+    raw_data = testutils.make_pb_data(2015, 13, events)
+    result = pb.parse_pb_data(raw_data, PV, jan_2001, jan_2018)
+    expected = numpy.array(((1.5, 2.5, 3.5), (4.5, 5.5, 6.5)))
+    numpy.testing.assert_equal(result.values, expected)
+    numpy.testing.assert_equal(result.severities, (0, 1))
+
+
+def test_parse_pb_data_keeps_longer_strings_after_preceding_event(jan_2018):
+    events = [(1, 0, ["a"], 0), (3600, 0, ["hello", "world"], 0)]
+    raw_data = testutils.make_pb_data(2018, 7, events)
+    start = utils.utc_datetime(2018, 1, 1, 0, 30)
+    end = utils.utc_datetime(2018, 1, 1, 2)
+    expected = [["a", ""], ["hello", "world"]]
+    result = pb.parse_pb_data(raw_data, PV, start, end)
+    numpy.testing.assert_equal(result.values, expected)
+    result = pb.parse_pb_stream(io.BytesIO(raw_data), PV, start, end)
+    numpy.testing.assert_equal(result.values, expected)
+
+
+def test_parse_pb_data_respects_count(jan_2001, jan_2018):
+    events = [(i, 0, float(i), 0) for i in range(10)]
+    raw_data = testutils.make_pb_data(2015, 6, events)
+    result = pb.parse_pb_data(raw_data, PV, jan_2001, jan_2018, count=3)
+    numpy.testing.assert_equal(result.values[:, 0], (0, 1, 2))
+
+
+def test_decode_lines_zero_pads_waveforms_of_different_lengths():
+    raw_data = testutils.make_pb_data(2015, 12, [(1, 0, [1, 2, 3], 0), (2, 0, [4], 0)])
+    lines = raw_data.strip().split(b"\n")[1:]
+    columns = pb.decode_lines(lines, 12)
+    numpy.testing.assert_equal(columns.values, ((1, 2, 3), (4, 0, 0)))
+    numpy.testing.assert_equal(columns.secondsintoyear, (1, 2))
+
+
+def test_decode_lines_returns_bytes_as_uint8():
+    raw_data = testutils.make_pb_data(2015, 11, [(1, 0, b"ab\n", 0)])
+    lines = raw_data.strip().split(b"\n")[1:]
+    columns = pb.decode_lines(lines, 11)
+    assert columns.values.dtype == numpy.uint8
+    numpy.testing.assert_equal(columns.values, ((97, 98, 10),))
+
+
+def unescape_bytes_by_replacement(byte_seq):
+    for key, value in pb.PB_REPLACEMENTS_UNESCAPING.items():
+        byte_seq = byte_seq.replace(key, value)
+    return byte_seq
+
+
+@pytest.mark.parametrize(
+    "test_bytes",
+    (
+        b"",
+        b"\x1B",
+        b"\x1B\x1B\x01\x01",
+        b"\x1B\x01\x03\x1B\x02\x1B\x03\x1B\x04",
+        bytes(range(256)) * 2,
+    ),
+)
+def test_unescape_bytes_matches_replacement_in_order(test_bytes):
+    assert pb.unescape_bytes(test_bytes) == unescape_bytes_by_replacement(test_bytes)
+
+
+def test_split_lines_ignores_trailing_newline():
+    lines = pb.split_lines(b"ab\n\ncde\n")
+    assert list(lines) == [b"ab", b"", b"cde"]
+
+
+def test_split_lines_handles_region_of_buffer():
+    lines = pb.split_lines(b"ab\ncd\nef", 3, 8)
+    assert list(lines) == [b"cd", b"ef"]
+    assert list(lines[1:]) == [b"ef"]
+
+
+def test_unescape_lines_unescapes_only_lines_in_region():
+    escaped = [b"hello", b"a\x1B\x02b", b"\x1B\x01\x03", b"bye", b"c\x1B\x03"]
+    lines = pb.split_lines(b"\n".join(escaped))
+    unescaped = pb.unescape_lines(lines[1:4])
+    assert list(unescaped) == [b"a\nb", b"\x1B\x03", b"bye"]
+
+
+def test_unescape_lines_returns_same_lines_if_no_escapes():
+    lines = pb.split_lines(b"hello\nbye")
+    assert pb.unescape_lines(lines) is lines
+
+
+def test_parse_pb_data_keeps_whitespace_at_end_of_chunk(jan_2001, jan_2018):
+    event = ee.ScalarString(secondsintoyear=1, nano=0, val="ends with space ")
+    info = ee.PayloadInfo(type=0, pvname=PV, year=2015)
+    raw_data = info.SerializeToString() + b"\n" + event.SerializeToString()
+    result = pb.parse_pb_data(raw_data, PV, jan_2001, jan_2018)
+    assert result.values[0, 0] == "ends with space "
+
+
+def test_unescape_lines_matches_unescaping_each_line():
+    """Only one line in a hundred contains an escape sequence.
+
+    benchmarks/benchmark_pb.py compares the time taken by the two.
+    """
+    escaped = [b"\x08\x01\x10\x02\x19" + bytes(8)] * 20000
+    escaped[::100] = [b"\x08\x01\x10\x02\x19\x1B\x02" + bytes(7)] * 200
+    buffer = b"\n".join(escaped)
+    by_line = [unescape_bytes_by_replacement(line) for line in buffer.split(b"\n")]
+    assert list(pb.unescape_lines(pb.split_lines(buffer))) == by_line
+
+
+@pytest.fixture
+def pb_file_2015(tmp_path):
+    """A PB file with an event every hour of January 2015.
+
+    Some events need escaping because of the value of nano.
+    """
+    events = [(3600 * i, i % 40, float(i), i % 3) for i in range(24 * 31)]
+    filepath = tmp_path / "pv:2015.pb"
+    filepath.write_bytes(testutils.make_pb_data(2015, 6, events))
+    return str(filepath)
+
+
+@pytest.mark.parametrize(
+    "start,end",
+    (
+        ((2015, 1, 3, 12, 30), (2015, 1, 4, 1)),
+        ((2014, 1, 1), (2015, 1, 1, 1)),
+        ((2015, 1, 31), (2016, 1, 1)),
+        ((2015, 1, 1), (2015, 1, 1)),
+        ((2014, 1, 1), (2014, 6, 1)),
+        ((2015, 6, 1), (2016, 6, 1)),
+    ),
+)
+def test_PbFile_read_lines_matches_parse_pb_data(pb_file_2015, start, end):
+    start = utils.utc_datetime(*start)
+    end = utils.utc_datetime(*end)
+    with open(pb_file_2015, "rb") as f:
+        expected = pb.parse_pb_data(f.read(), PV, start, end)
+    fetcher = pb.PbFileFetcher("root")
+    result = fetcher._read_pb_files([pb_file_2015], PV, start, end, None)
+    assert result == expected
+
+
+def test_PbFile_read_lines_reads_only_lines_in_range(pb_file_2015):
+    start = utils.utc_datetime(2015, 1, 2)
+    end = utils.utc_datetime(2015, 1, 2, 5, 30)
+    with pb.PbFile(pb_file_2015) as pb_file:
+        [(chunk, lines)] = pb_file.read_lines(start, end)
+        assert chunk.info.year == 2015
+    # The preceding event at midnight plus 5 events.
+    assert len(lines) == 6
+
+
+def test_PbFile_finds_chunks_in_file(jan_2001, jan_2018):
+    with pb.PbFile(testutils.get_data_filepath("string_event.pb")) as pb_file:
+        assert [c.info.year for c in pb_file.chunks] == [2017, 2018, 2017]
+        chunk_lines = pb_file.read_lines(jan_2001, jan_2018)
+    assert [len(lines) for _, lines in chunk_lines] == [0, 0, 1]
+
+
+def test_PbFile_with_single_chunk_does_not_scan_file(pb_file_2015):
+    start = utils.utc_datetime(2015, 1, 2)
+    end = utils.utc_datetime(2015, 1, 2, 5, 30)
+    with pb.PbFile(pb_file_2015) as pb_file:
+        expected = pb_file.read_lines(start, end)
+    find_chunks = pb.PbFile._find_chunks
+    with mock.patch.object(
+        pb.PbFile, "_find_chunks", autospec=True, side_effect=find_chunks
+    ) as mock_find_chunks:
+        with pb.PbFile(pb_file_2015, single_chunk=True) as pb_file:
+            result = pb_file.read_lines(start, end)
+    mock_find_chunks.assert_called_once_with(mock.ANY, first_only=True)
+    [(_, expected_lines)], [(_, lines)] = expected, result
+    assert list(lines) == list(expected_lines)
+
+
+def test_PbFile_with_single_chunk_scans_file_if_blank_line_found(jan_2001, jan_2018):
+    filepath = testutils.get_data_filepath("string_event.pb")
+    with pb.PbFile(filepath) as pb_file:
+        expected = pb_file.read_lines(jan_2001, jan_2018)
+    with pb.PbFile(filepath, single_chunk=True) as pb_file:
+        result = pb_file.read_lines(jan_2001, jan_2018)
+        assert [c.info.year for c in pb_file.chunks] == [2017, 2018, 2017]
+    assert [(c, list(lines)) for c, lines in result] == [
+        (c, list(lines)) for c, lines in expected
+    ]
+
+
+def test_PbFile_handles_empty_file(tmp_path, jan_2001, jan_2018):
+    filepath = tmp_path / "pv:2015.pb"
+    filepath.write_bytes(b"")
+    with pb.PbFile(str(filepath)) as pb_file:
+        assert pb_file.read_lines(jan_2001, jan_2018) == []
+
+
+def test_PbFile_handles_missing_final_newline(tmp_path, jan_2001, jan_2018):
+    filepath = tmp_path / "pv:2015.pb"
+    events = [(1, 0, 1.0, 0), (2, 0, 2.0, 0)]
+    filepath.write_bytes(testutils.make_pb_data(2015, 6, events).rstrip(b"\n"))
+    fetcher = pb.PbFileFetcher("root")
+    result = fetcher._read_pb_files([str(filepath)], PV, jan_2001, jan_2018, None)
+    numpy.testing.assert_equal(result.values, ((1.0,), (2.0,)))
+
+
+@pytest.mark.parametrize(
+    "start,end",
+    (
+        ((2015, 1, 3, 12, 30), (2015, 1, 4, 1)),
+        ((2014, 1, 1), (2015, 1, 1, 1)),
+        ((2015, 1, 31), (2016, 1, 1)),
+        ((2015, 1, 9, 1), (2015, 1, 9, 1)),
+    ),
+)
+def test_PbFileFetcher_with_index_matches_without(pb_file_2015, start, end):
+    start = utils.utc_datetime(*start)
+    end = utils.utc_datetime(*end)
+    expected = pb.PbFileFetcher("root")._read_pb_files(
+        [pb_file_2015], PV, start, end, None
+    )
+    fetcher = pb.PbFileFetcher("root", use_index=True, index_stride=7)
+    result = fetcher._read_pb_files([pb_file_2015], PV, start, end, None)
+    assert result == expected
+    assert os.path.exists(pb_file_2015 + ".idx")
+
+
+def test_open_pb_file_reuses_saved_index(pb_file_2015, tmp_path):
+    index_dir = str(tmp_path / "indices")
+    pb.open_pb_file(pb_file_2015, index_dir, stride=10).close()
+    index_path = pb.PbIndex.sidecar_path(pb_file_2015, index_dir)
+    assert index_path.startswith(index_dir)
+    with mock.patch("aa.pb.PbIndex.build") as mock_build:
+        with pb.open_pb_file(pb_file_2015, index_dir, stride=10) as pb_file:
+            assert pb_file.index is not None
+        mock_build.assert_not_called()
+
+
+@pytest.mark.parametrize("size", (0, 10, 100, -10))
+def test_open_pb_file_rebuilds_truncated_index(pb_file_2015, size):
+    pb.open_pb_file(pb_file_2015, stride=10).close()
+    index_path = pb.PbIndex.sidecar_path(pb_file_2015)
+    with open(index_path, "r+b") as f:
+        f.truncate(size if size >= 0 else os.path.getsize(index_path) + size)
+    assert pb.PbIndex.load(index_path) is None
+    with pb.open_pb_file(pb_file_2015, stride=10) as pb_file:
+        assert pb_file.index is not None
+    assert pb.PbIndex.load(index_path) is not None
+
+
+def test_open_pb_file_extends_index_when_file_appended(tmp_path):
+    filepath = str(tmp_path / "pv:2015.pb")
+    events = [(i, 0, float(i), 0) for i in range(100)]
+    raw_data = testutils.make_pb_data(2015, 6, events)
+    with open(filepath, "wb") as f:
+        f.write(raw_data[: raw_data.index(b"\n") + 1 + 20 * 14])
+    pb.open_pb_file(filepath, stride=3).close()
+    with open(filepath, "wb") as f:
+        f.write(raw_data)
+    with pb.open_pb_file(filepath, stride=3) as pb_file:
+        extended = pb_file.index
+        rebuilt = pb.PbIndex.build(pb_file, 3)
+    assert extended.size == len(raw_data)
+    numpy.testing.assert_equal(extended.entry_offsets, rebuilt.entry_offsets)
+    numpy.testing.assert_equal(extended.entry_timestamps, rebuilt.entry_timestamps)
+    start = utils.utc_datetime(2015, 1, 1, 0, 1, 30)
+    end = utils.utc_datetime(2015, 1, 1, 0, 1, 35)
+    with pb.open_pb_file(filepath, stride=3) as pb_file:
+        [(_, lines)] = pb_file.read_lines(start, end)
+    columns = pb.decode_lines(lines, 6)
+    numpy.testing.assert_equal(columns.secondsintoyear, numpy.arange(90, 96))
+
+
+def test_PbIndex_bounds_bracket_target(pb_file_2015):
+    with pb.PbFile(pb_file_2015) as pb_file:
+        index = pb.PbIndex.build(pb_file, 24)
+        chunk = pb_file.chunks[0]
+        target = utils.datetime_to_epoch(utils.utc_datetime(2015, 1, 3, 5))
+        lo, hi = index.bounds(0, target)
+        assert pb_file.timestamp_at(chunk, lo) <= target
+        assert pb_file.timestamp_at(chunk, hi) > target
+        # 24 events per index entry, one per hour.
+        assert pb_file.timestamp_at(chunk, lo) == target - 5 * 3600
+
+
+@pytest.mark.parametrize("use_index", (False, True))
+def test_PbFileFetcher_get_events_at_matches_get_event_at(tmp_path, use_index):
+    make_partitions(tmp_path / "A" / "B" / "C", "%Y")
+    fetcher = pb.PbFileFetcher(str(tmp_path), use_index=use_index, index_stride=10)
+    instant = utils.utc_datetime(2015, 1, 1, 12, 5)
+    snapshot = fetcher.get_events_at(["A-B-C:PV", "A-B-C:PV2"], instant)
+    assert snapshot.get_event("A-B-C:PV") == fetcher.get_event_at("A-B-C:PV", instant)
+    numpy.testing.assert_equal(snapshot.found, [True, False])
+
+
+def test_parse_pb_data_returns_one_preceding_event_from_earlier_year():
+    raw_data = b"\n".join(
+        [
+            testutils.make_pb_data(2014, 6, [(100, 0, 1.0, 0), (200, 0, 2.0, 0)]),
+            testutils.make_pb_data(2015, 6, [(86400 * 40, 0, 3.0, 0)]),
+        ]
+    )
+    start = utils.utc_datetime(2015, 1, 2)
+    end = utils.utc_datetime(2015, 3, 1)
+    result = pb.parse_pb_data(raw_data, PV, start, end)
+    numpy.testing.assert_equal(result.values[:, 0], [2.0, 3.0])
+    stream_result = pb.parse_pb_stream(io.BytesIO(raw_data), PV, start, end)
+    assert stream_result == result
+    # The preceding event is omitted if the range ends before it.
+    earlier = utils.utc_datetime(2014, 1, 1)
+    assert len(pb.parse_pb_data(raw_data, PV, start, earlier)) == 0
+
+
+def test_PbFileFetcher_reads_preceding_event_from_tail_of_earlier_partition(tmp_path):
+    directory = tmp_path / "A"
+    directory.mkdir()
+    events_2014 = [(secs, 0, float(secs), 0) for secs in range(0, 86400 * 300, 600)]
+    (directory / "PV:2014.pb").write_bytes(testutils.make_pb_data(2014, 6, events_2014))
+    (directory / "PV:2015.pb").write_bytes(
+        testutils.make_pb_data(2015, 6, [(86400 * 40, 0, -1.0, 0)])
+    )
+    fetcher = pb.PbFileFetcher(str(tmp_path))
+    start = utils.utc_datetime(2015, 1, 2)
+    end = utils.utc_datetime(2015, 3, 1)
+    searched = []
+
+    def search(pb_file, *args, **kwargs):
+        searched.append(os.path.basename(pb_file.filepath))
+        return original_search(pb_file, *args, **kwargs)
+
+    original_search = pb.PbFile.search
+    with mock.patch.object(pb.PbFile, "search", autospec=True, side_effect=search):
+        result = fetcher.get_values("A:PV", start, end)
+    numpy.testing.assert_equal(result.values[:, 0], [events_2014[-1][2], -1.0])
+    # The 2014 file is not searched since its last event precedes start.
+    assert "PV:2014.pb" not in searched
+    batches = list(fetcher.iter_values("A:PV", start, end))
+    assert concatenate_batches(batches) == result
+    event = fetcher.get_event_at("A:PV", start)
+    assert event.value[0] == events_2014[-1][2]
+
+
+@pytest.mark.parametrize("wire_decoding", (False, True))
+def test_parse_pb_data_keeps_exact_nanoseconds(wire_decoding):
+    raw_data = make_stream_data()
+    start = utils.utc_datetime(2014, 1, 2)
+    end = utils.utc_datetime(2016, 1, 2)
+    expected = pb.parse_pb_data(raw_data, PV, start, end, None, wire_decoding)
+    result = pb.parse_pb_data(raw_data, PV, start, end, None, wire_decoding, True)
+    assert result.has_exact_timestamps
+    assert result.timestamps_ns.dtype == numpy.int64
+    numpy.testing.assert_array_equal(result.values, expected.values)
+    numpy.testing.assert_allclose(result.timestamps, expected.timestamps, rtol=0)
+    # make_stream_data() has events on whole seconds with nano = i % 40.
+    seconds, nanos = numpy.divmod(result.timestamps_ns, 10 ** 9)
+    numpy.testing.assert_array_equal(seconds, numpy.round(expected.timestamps))
+    years = seconds.astype("datetime64[s]").astype("datetime64[Y]").astype(int) + 1970
+    year_starts = [utils.year_timestamp(year) for year in years]
+    numpy.testing.assert_array_equal(nanos, (seconds - year_starts) // 3600 % 40)
+    stream_result = pb.parse_pb_stream(
+        io.BytesIO(raw_data), PV, start, end, None, wire_decoding, nanoseconds=True
+    )
+    numpy.testing.assert_array_equal(stream_result.timestamps_ns, result.timestamps_ns)
+
+
+def test_PbFileFetcher_returns_exact_nanoseconds(tmp_path):
+    make_partitions(tmp_path / "A" / "B" / "C", "%Y_%m_%d_%H")
+    fetcher = pb.PbFileFetcher(str(tmp_path), nanoseconds=True)
+    start = utils.utc_datetime(2015, 1, 1, 22, 55)
+    end = utils.utc_datetime(2015, 1, 2, 1, 0)
+    result = fetcher.get_values("A-B-C:PV", start, end)
+    expected = (utils.year_timestamp(2015) + result.values[:, 0]) * 10 ** 9
+    numpy.testing.assert_array_equal(result.timestamps_ns, expected.astype(numpy.int64))
+    batches = list(fetcher.iter_values("A-B-C:PV", start, end, batch_size=4))
+    assert all(batch.has_exact_timestamps for batch in batches)
+    assert concatenate_batches(batches) == result
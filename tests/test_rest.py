@@ -52,23 +52,35 @@ def test_AaRestClient_construct_url(kwargs, aa_client):
         ("getPolicyList", "get_policy_list", {}),
     ],
 )
-@mock.patch("requests.get")
+@mock.patch("requests.Session.get")
 def test_AaRestClient_simple_gets(mock_get, command, method, kwargs, aa_client):
     target_url = aa_client._construct_url(command, **kwargs)
     getattr(aa_client, method)(**kwargs)
-    mock_get.assert_called_with(target_url)
+    mock_get.assert_called_with(target_url, timeout=None)
 
 
-@mock.patch("requests.post")
+@mock.patch("requests.Session.post")
 def test_AaRestClient_get_pv_statuses(mock_post, aa_client):
     pv_names = ["dummy1", "dummy2"]
     pv_name_payload = "pv=dummy1,dummy2"
     headers = {"Content-Type": "application/x-www-form-urlencoded"}
     target_url = aa_client._construct_url("getPVStatus")
     aa_client.get_pv_statuses(pv_names)
-    mock_post.assert_called_with(target_url, pv_name_payload, headers=headers)
+    mock_post.assert_called_with(
+        target_url, pv_name_payload, headers=headers, timeout=None
+    )
 
 
 def test_AaRestClient_archive_pv_raises_ValueError_if_method_invalid(aa_client):
     with pytest.raises(ValueError):
         aa_client.archive_pv("dummy", 10, "not-scan-or-monitor")
+
+
+def test_AaRestClient_uses_shared_session_with_timeout():
+    session = mock.MagicMock()
+    client = rest.AaRestClient(HOSTNAME, session=session, timeout=(1, 10))
+    client.get_pv_status("dummy")
+    client.get_pv_statuses(["dummy"])
+    target_url = client._construct_url("getPVStatus", pv="dummy")
+    session.get.assert_called_once_with(target_url, timeout=(1, 10))
+    assert session.post.call_args[1]["timeout"] == (1, 10)
@@ -1,6 +1,9 @@
+import os
+
 import pytest
+import utils as testutils
 
-from aa import storage
+from aa import pb, storage
 
 
 @pytest.mark.parametrize(
@@ -22,3 +25,16 @@ def test_pv_name_from_path(path, pv):
 def test_pv_name_from_path_raises_ParsingError_if_not_conventional(path):
     with pytest.raises(storage.ParsingError):
         storage.pv_name_from_path(path)
+
+
+def test_build_indices_indexes_all_pb_files(tmp_path):
+    directory = tmp_path / "BL13J" / "MO" / "PI" / "01"
+    directory.mkdir(parents=True)
+    for year in (2015, 2016):
+        data = testutils.make_pb_data(year, 6, [(1, 0, 1.0, 0)])
+        (directory / "X:{}.pb".format(year)).write_bytes(data)
+    index_dir = tmp_path / "indices"
+    assert storage.build_indices(str(tmp_path / "BL13J"), str(index_dir)) == 2
+    for year in (2015, 2016):
+        filepath = str(directory / "X:{}.pb".format(year))
+        assert os.path.exists(pb.PbIndex.sidecar_path(filepath, str(index_dir)))
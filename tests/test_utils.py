@@ -1,5 +1,6 @@
 from datetime import datetime
 
+import numpy
 import pytest
 import pytz
 
@@ -33,6 +34,11 @@ def test_datetime_to_epoch_works_for_current_datetime_bst():
     assert utils.datetime_to_epoch(DATETIME_BST) == UNIX_TIME
 
 
+def test_datetime_to_epoch_ns_keeps_microseconds():
+    dt = DATETIME_BST.replace(microsecond=123456)
+    assert utils.datetime_to_epoch_ns(dt) == UNIX_TIME * 1000000000 + 123456000
+
+
 def test_epoch_to_datetime_works_for_short_difference():
     assert utils.epoch_to_datetime(15) == JUST_AFTER_EPOCH
 
@@ -100,3 +106,33 @@ def test_binary_search_returns_index_plus_one_if_value_equals_item_in_seq():
 )
 def test_dict_to_tuples_has_correct_output(input_dict, expect):
     assert utils.dict_to_tuples(input_dict) == expect
+
+
+def test_create_session_configures_connection_pool():
+    session = utils.create_session(pool_size=4, keep_alive=False, max_retries=2)
+    adapter = session.get_adapter("http://archiver:17668")
+    assert adapter._pool_maxsize == 4
+    assert adapter.max_retries.total == 2
+    assert session.headers["Connection"] == "close"
+
+
+def test_epoch_to_datetime64_keeps_nanoseconds_and_maps_nan_to_nat():
+    secs = numpy.array([1422752399.004147078, 0.5, numpy.nan])
+    result = utils.epoch_to_datetime64(secs)
+    assert result.dtype == numpy.dtype("datetime64[ns]")
+    assert result[0].astype("datetime64[us]") == numpy.datetime64(
+        "2015-02-01T00:59:59.004147"
+    )
+    assert result[1] == numpy.datetime64("1970-01-01T00:00:00.5")
+    assert numpy.isnat(result[2])
+
+
+@pytest.mark.parametrize("tz", (pytz.utc, TZ_BST, pytz.timezone("US/Eastern")))
+@pytest.mark.parametrize("step", (0.7, 3601.3))
+def test_epoch_to_datetimes_matches_epoch_to_datetime(tz, step):
+    # Across the end of British Summer Time on 29 October 2017.
+    secs = 1509237000 + numpy.arange(5000) * step
+    result = utils.epoch_to_datetimes(secs, tz)
+    expected = [utils.epoch_to_datetime(s).astimezone(tz) for s in secs]
+    assert list(result) == expected
+    assert [dt.utcoffset() for dt in result] == [dt.utcoffset() for dt in expected]
@@ -0,0 +1,73 @@
+import numpy
+import pytest
+
+from aa import pb, wire
+
+# Values for each scalar type, including ones that need escaping.
+TYPE_VALUES = {
+    1: [0, 1, -1, 10, 32767, -32768, 27],
+    2: [0.0, 1.5, -2.25, 1e30, float("nan"), 10.0, 3.4e-38],
+    3: [0, 1, 2, 10, 13, 27, 65535],
+    4: [b"\x00", b"\x0a", b"\x1b", b"\x0d", b"\xff", b"a", b""],
+    5: [0, 1, -1, 10, 2 ** 31 - 1, -(2 ** 31), 0x1B0A0D],
+    6: [0.0, 1.5, -2.25, 1e300, float("nan"), 10.0, 5e-324],
+}
+
+
+def make_lines(event_type, field_values=False):
+    lines = []
+    for i, val in enumerate(TYPE_VALUES[event_type]):
+        event = pb.TYPE_MAPPINGS[event_type]()
+        event.secondsintoyear = 10 * i + 0x0A
+        event.nano = 123456789 * i % 1000000000
+        event.val = val
+        event.severity = i % 4
+        event.status = -i if i % 2 else i
+        if i == 3:
+            event.repeatcount = 5
+            event.fieldactualchange = True
+        if field_values and i == 2:
+            field_value = event.fieldvalues.add()
+            field_value.name = "DESC"
+            field_value.val = "description"
+        lines.append(pb.escape_bytes(event.SerializeToString()))
+    return lines
+
+
+@pytest.mark.parametrize("event_type", sorted(wire.WIRE_TYPES))
+@pytest.mark.parametrize("field_values", (False, True))
+def test_wire_decoding_matches_protobuf(event_type, field_values):
+    lines = make_lines(event_type, field_values)
+    expected = pb.decode_lines(lines, event_type)
+    result = pb.decode_lines(lines, event_type, wire_decoding=True)
+    for field in pb.EventColumns._fields:
+        expected_field = getattr(expected, field)
+        result_field = getattr(result, field)
+        assert result_field.dtype == expected_field.dtype
+        assert result_field.shape == expected_field.shape
+        assert result_field.tobytes() == expected_field.tobytes()
+
+
+def test_decode_scalar_events_reports_fieldvalues_as_unhandled():
+    lines = [pb.unescape_bytes(line) for line in make_lines(6, field_values=True)]
+    ends = numpy.cumsum([len(line) for line in lines])
+    starts = ends - [len(line) for line in lines]
+    columns = wire.decode_scalar_events(b"".join(lines), starts, ends, 6)
+    numpy.testing.assert_equal(numpy.flatnonzero(columns.unhandled), (2,))
+
+
+def test_decode_scalar_events_reports_truncated_event_as_unhandled():
+    line = pb.unescape_bytes(make_lines(6)[1])
+    columns = wire.decode_scalar_events(line, [0], [len(line) - 3], 6)
+    assert columns.unhandled[0]
+
+
+def test_parse_pb_data_with_wire_decoding(jan_2001, jan_2018):
+    info = pb.ee.PayloadInfo(type=6, pvname="a", year=2015)
+    lines = [pb.escape_bytes(info.SerializeToString())] + make_lines(6)
+    raw_data = b"\n".join(lines)
+    expected = pb.parse_pb_data(raw_data, "a", jan_2001, jan_2018)
+    result = pb.parse_pb_data(raw_data, "a", jan_2001, jan_2018, wire_decoding=True)
+    numpy.testing.assert_equal(result.values, expected.values)
+    numpy.testing.assert_equal(result.timestamps, expected.timestamps)
+    numpy.testing.assert_equal(result.severities, expected.severities)
@@ -1,8 +1,12 @@
+import io
 import json
 import os
 
 import mock
 
+from aa import epics_event_pb2 as ee
+from aa import pb
+
 
 def mock_response(json_str=None, raw=None):
     resp = mock.MagicMock()
@@ -10,8 +14,7 @@ def mock_response(json_str=None, raw=None):
         loaded_json = json.loads(json_str)
         resp.json = mock.MagicMock(return_value=loaded_json)
     if raw is not None:
-        resp.raw = mock.MagicMock()
-        resp.raw.read = mock.MagicMock(return_value=raw)
+        resp.raw = io.BytesIO(raw)
     return resp
 
 
@@ -39,3 +42,39 @@ def load_from_file(filename):
     filepath = get_data_filepath(filename)
     with open(filepath) as f:
         return f.read()
+
+
+def make_pb_data(year, event_type, events, pv="dummy", headers=None):
+    """Build the contents of a PB file containing the given events.
+
+    Args:
+        year: year for the PayloadInfo header
+        event_type: type of the events as key of pb.TYPE_MAPPINGS
+        events: sequence of (secondsintoyear, nano, val, severity) tuples
+        pv: PV name for the PayloadInfo header
+        headers: optional dict of extra header fields
+
+    Returns:
+        escaped PB data as bytes, ending with a newline
+
+    """
+    info = ee.PayloadInfo()
+    info.type = event_type
+    info.pvname = pv
+    info.year = year
+    for name, val in (headers or {}).items():
+        header = info.headers.add()
+        header.name = name
+        header.val = val
+    lines = [pb.escape_bytes(info.SerializeToString())]
+    for secondsintoyear, nano, val, severity in events:
+        event = pb.TYPE_MAPPINGS[event_type]()
+        event.secondsintoyear = secondsintoyear
+        event.nano = nano
+        if isinstance(val, (list, tuple)):
+            event.val.extend(val)
+        else:
+            event.val = val
+        event.severity = severity
+        lines.append(pb.escape_bytes(event.SerializeToString()))
+    return b"\n".join(lines) + b"\n"